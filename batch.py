@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""creates several staging environments in a single process.
+   Environments share hg mirrors, the pip cache, the port allocator and a
+   global concurrency budget"""
+from lib.staging import Environment
+from lib.pipeline import Pipeline, PipelineError
+from lib.state import StateError
+import lib.budget as budget
+import lib.deadline as deadline
+import lib.trace as trace
+from lib.logger import logger, setup as setup_logging
+import argparse
+from functools import partial
+
+
+def parse_environment(spec, default_cfg):
+    """parses [CONFIG:]BUG[:USERNAME] and returns (config, bug, username)"""
+    fields = spec.split(':')
+    if fields[0].endswith('.ini'):
+        cfg = fields.pop(0)
+    else:
+        cfg = default_cfg
+    if not cfg or not fields or len(fields) > 2 or not fields[0]:
+        msg = 'bad environment: {0} (expected [CONFIG:]BUG[:USERNAME])'
+        raise argparse.ArgumentTypeError(msg.format(spec))
+    username = fields[1] if len(fields) == 2 else None
+    return cfg, fields[0], username
+
+
+if __name__ == '__main__':
+
+    setup_logging()
+    log = logger('staging release')
+
+    parser = argparse.ArgumentParser()
+    msg = 'environments: [CONFIG:]BUG[:USERNAME] (e.g. config/beta.ini:1234)'
+    parser.add_argument('environments', help=msg, nargs='+')
+    parser.add_argument('-c', '--cfg', help='default configuration file')
+    parser.add_argument('-v', '--version', help='version', required=True)
+    msg = 'staging release comma separated values (e.g: firefox,fennec)'
+    parser.add_argument('-r', '--release', help=msg, required=True)
+    msg = 'maximum number of concurrent clones and of concurrent installs ' \
+          '(default: from the cpus, load and memory of the host)'
+    parser.add_argument('-j', '--jobs', help=msg, type=int)
+    msg = 'directory for the shared hg mirrors'
+    parser.add_argument('--mirror-dir', help=msg)
+    msg = 'directory for the shared pip cache'
+    parser.add_argument('--pip-cache', help=msg)
+    msg = 'resume interrupted runs, skipping the completed steps'
+    parser.add_argument('--resume', help=msg, action='store_true')
+    msg = 'writes a trace-event file (chrome://tracing) of the run'
+    parser.add_argument('--trace', help=msg)
+    msg = 'do not use and update the step timing history'
+    parser.add_argument('--no-history', help=msg, action='store_true')
+    msg = 'skip the preflight checks'
+    parser.add_argument('--skip-preflight', help=msg, action='store_true')
+    msg = 'cancels the run after this many minutes (resume it with --resume)'
+    parser.add_argument('--deadline', help=msg, type=float)
+    args = parser.parse_args()
+
+    options = {}
+    if args.mirror_dir:
+        options[('common', 'mirror_dir')] = args.mirror_dir
+    if args.pip_cache:
+        options[('common', 'pip_cache')] = args.pip_cache
+    budget.adapt(args.jobs)
+
+    batch = Pipeline()
+    try:
+        for spec in args.environments:
+            cfg, bug, username = parse_environment(spec, args.cfg)
+            environment = Environment(cfg, bug, args.release, args.version,
+                                      username, args.resume, options)
+            batch.add(environment.name,
+                      partial(environment.run,
+                              preflight=not args.skip_preflight,
+                              history=not args.no_history))
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+    except StateError as error:
+        log.error('unable to read provisioning state: {0}'.format(error))
+        raise SystemExit(1)
+    if args.trace:
+        trace.enable()
+    if args.deadline:
+        deadline.set_deadline(args.deadline * 60)
+    try:
+        batch.run()
+    except PipelineError as error:
+        log.error('staging release setup failed: {0}'.format(error))
+    finally:
+        if args.trace:
+            trace.save(args.trace)
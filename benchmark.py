@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""offline end-to-end benchmark: runs the repositories, patch and master
+   stages against synthetic local repositories (see lib.benchmark) and
+   reports wall time, repos/min and peak memory of every stage as json.
+   micro runs the micro-benchmarks (see lib.microbench) and compares them
+   with a baseline, imports checks the import time of the command line
+   tools against their budget"""
+from lib.benchmark import Benchmark, BenchmarkError, STAGES, compare
+import lib.microbench as microbench
+from lib.logger import logger, setup as setup_logging
+import argparse
+import json
+import shutil
+import tempfile
+
+
+def print_comparison(rows):
+    """prints the rows of compare()"""
+    for stage, metric, before, after, change in rows:
+        change = 'n/a' if change is None else '{0:+.1f}%'.format(change)
+        print('{0:<14}{1:<22}{2:>12}{3:>12}{4:>10}'.format(
+            stage, metric, before, after, change))
+
+
+def print_micro_comparison(rows):
+    """prints the rows of microbench.compare()"""
+    for name, before, after, change, regression in rows:
+        flag = 'SLOWER' if regression else ''
+        print('{0:<40}{1:>12.6f}{2:>12.6f}{3:>+9.1f}% {4}'.format(
+            name, before, after, change, flag))
+
+
+if __name__ == '__main__':
+
+    setup_logging()
+    log = logger('staging release')
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+
+    run = commands.add_parser('run', help='runs the benchmark')
+    run.add_argument('-c', '--cfg', help='configuration file', required=True)
+    msg = 'staging release comma separated values (default: firefox)'
+    run.add_argument('-r', '--release', help=msg, default='firefox')
+    msg = 'work directory, kept at the end (default: a temporary directory)'
+    run.add_argument('-w', '--workdir', help=msg)
+    msg = 'files in every synthetic repository (default: 200)'
+    run.add_argument('--files', help=msg, type=int, default=200)
+    msg = 'size of the files in KB (default: 4)'
+    run.add_argument('--file-kb', help=msg, type=int, default=4)
+    msg = 'changesets in every synthetic repository (default: 20)'
+    run.add_argument('--commits', help=msg, type=int, default=20)
+    msg = 'comma separated stages (default: {0})'.format(','.join(STAGES))
+    run.add_argument('--stages', help=msg, default=','.join(STAGES))
+    msg = 'run the whole Master.install (needs virtualenv and a package index)'
+    run.add_argument('--master-install', help=msg, action='store_true')
+    msg = 'ssh (a fake ssh hg.mozilla.org) or local (default: ssh)'
+    run.add_argument('--transport', help=msg, choices=('ssh', 'local'),
+                     default='ssh')
+    run.add_argument('-o', '--output', help='writes the results to a file')
+    run.add_argument('--compare', help='results of a previous run')
+
+    micro = commands.add_parser('micro', help='runs the micro-benchmarks')
+    msg = 'runs only the benchmarks whose name contains one of these'
+    micro.add_argument('names', help=msg, nargs='*')
+    msg = 'untimed samples (default: {0})'.format(microbench.WARMUP)
+    micro.add_argument('--warmup', help=msg, type=int,
+                       default=microbench.WARMUP)
+    msg = 'timed samples (default: {0})'.format(microbench.REPEAT)
+    micro.add_argument('--repeat', help=msg, type=int,
+                       default=microbench.REPEAT)
+    msg = 'baseline (default: tests/microbench_baseline.json)'
+    micro.add_argument('--baseline', help=msg, default=microbench.BASELINE)
+    msg = 'slower than the baseline by this percentage is a regression ' \
+          '(default: {0:.0f})'.format(microbench.THRESHOLD * 100)
+    micro.add_argument('--threshold', help=msg, type=float,
+                       default=microbench.THRESHOLD * 100)
+    msg = 'writes the results to the baseline instead of comparing them'
+    micro.add_argument('--save-baseline', help=msg, action='store_true')
+    micro.add_argument('-o', '--output', help='writes the results to a file')
+
+    imports = commands.add_parser('imports',
+                                  help='checks the import time budget')
+    msg = 'modules to import (default: {0})'.format(
+        ', '.join(sorted(microbench.IMPORT_BUDGET)))
+    imports.add_argument('modules', help=msg, nargs='*')
+    msg = 'imports of every module (default: {0})'.format(
+        microbench.IMPORT_REPEAT)
+    imports.add_argument('--repeat', help=msg, type=int,
+                         default=microbench.IMPORT_REPEAT)
+
+    diff = commands.add_parser('compare', help='compares two results')
+    diff.add_argument('old', help='results of the previous run')
+    diff.add_argument('new', help='results of the new run')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.old) as old, open(args.new) as new:
+            print_comparison(compare(json.load(old), json.load(new)))
+        raise SystemExit(0)
+
+    if args.command == 'imports':
+        times = microbench.import_times(args.modules, args.repeat)
+        for module in sorted(times):
+            budget = microbench.IMPORT_BUDGET.get(module)
+            budget = 'n/a' if budget is None else '{0}ms'.format(budget)
+            print('{0:<30}{1:>9.1f}ms{2:>10}'.format(module, times[module],
+                                                     budget))
+        over = microbench.over_budget(times)
+        if over:
+            log.error('over the import time budget: {0}'.format(
+                ', '.join(module for module, _, _ in over)))
+            raise SystemExit(1)
+        raise SystemExit(0)
+
+    if args.command == 'micro':
+        report = microbench.run(args.names, args.warmup, args.repeat)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        if args.save_baseline:
+            with open(args.baseline, 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+            log.info('baseline saved in {0}'.format(args.baseline))
+            raise SystemExit(0)
+        with open(args.baseline) as baseline:
+            rows = microbench.compare(json.load(baseline), report,
+                                      args.threshold / 100)
+        print_micro_comparison(rows)
+        if any(row[4] for row in rows):
+            log.error('micro-benchmarks slower than the baseline')
+            raise SystemExit(1)
+        raise SystemExit(0)
+
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error('unknown stages: {0}'.format(', '.join(unknown)))
+    workdir = args.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='staging-benchmark-')
+        # Benchmark creates the work directory
+        shutil.rmtree(workdir)
+    benchmark = Benchmark(args.cfg, workdir, args.release, args.files,
+                          args.file_kb, args.commits, args.master_install,
+                          args.transport)
+    try:
+        report = benchmark.run(stages)
+    except BenchmarkError as error:
+        log.error(error)
+        raise SystemExit(1)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if args.compare:
+        with open(args.compare) as old:
+            print_comparison(compare(json.load(old), report))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""staging daemon: keeps warm pools of ports, virtualenvs and hg mirrors
+   and creates/removes staging environments on request.
+   serve starts the daemon, provision, teardown and status send a request
+   to a running daemon"""
+from lib.daemon import StagingDaemon, DaemonError, send_request
+import lib.budget as budget
+import lib.deadline as deadline
+from lib.logger import logger, setup as setup_logging
+import argparse
+import json
+
+
+if __name__ == '__main__':
+
+    setup_logging()
+    log = logger('staging release')
+
+    parser = argparse.ArgumentParser()
+    msg = 'unix socket (default: staging.sock)'
+    parser.add_argument('-s', '--socket', help=msg, default='staging.sock')
+    commands = parser.add_subparsers(dest='command')
+
+    serve = commands.add_parser('serve', help='starts the daemon')
+    serve.add_argument('-c', '--cfg', help='configuration file', required=True)
+    msg = 'directory of the pre-built virtualenvs'
+    serve.add_argument('--pool-dir', help=msg, required=True)
+    msg = 'number of port sets to keep reserved (default: 2)'
+    serve.add_argument('--ports', help=msg, type=int, default=2)
+    msg = 'number of virtualenvs to keep ready (default: 1)'
+    serve.add_argument('--virtualenvs', help=msg, type=int, default=1)
+    msg = 'maximum number of concurrent clones and of concurrent installs ' \
+          '(default: from the cpus, load and memory of the host)'
+    serve.add_argument('-j', '--jobs', help=msg, type=int)
+
+    provision = commands.add_parser('provision',
+                                    help='creates a staging environment')
+    provision.add_argument('-b', '--bug', help='bug tracking id',
+                           required=True)
+    provision.add_argument('-v', '--version', help='version', required=True)
+    msg = 'staging release comma separated values (e.g: firefox,fennec)'
+    provision.add_argument('-r', '--release', help=msg, required=True)
+    msg = 'username: if not specified, whoami will be used'
+    provision.add_argument('-u', '--username', help=msg)
+    msg = 'resume an interrupted run, skipping the completed steps'
+    provision.add_argument('--resume', help=msg, action='store_true')
+
+    teardown = commands.add_parser('teardown',
+                                   help='removes a staging environment')
+    teardown.add_argument('-b', '--bug', help='bug tracking id', required=True)
+    msg = 'username: if not specified, whoami will be used'
+    teardown.add_argument('-u', '--username', help=msg)
+    msg = 'maximum number of concurrent ssh commands (default: 4)'
+    teardown.add_argument('-j', '--jobs', help=msg, type=int, default=4)
+
+    commands.add_parser('status', help='shows pools and running requests')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        budget.adapt(args.jobs)
+        daemon = StagingDaemon(args.cfg, args.socket, args.pool_dir,
+                               args.ports, args.virtualenvs)
+        try:
+            daemon.serve_forever()
+        except DaemonError as error:
+            log.error(error)
+            raise SystemExit(1)
+        except KeyboardInterrupt:
+            # terminates the commands of the running requests, the
+            # background removals of the teardowns keep running
+            deadline.cancel('daemon stopped')
+            log.info('daemon stopped')
+        raise SystemExit(0)
+
+    request = dict((key, value) for key, value in vars(args).items()
+                   if key != 'socket' and value is not None)
+    try:
+        reply = send_request(args.socket, request)
+    except DaemonError as error:
+        log.error('cannot reach the daemon: {0}'.format(error))
+        raise SystemExit(1)
+    print(json.dumps(reply, indent=2, sort_keys=True))
+    if reply.get('status') != 'ok':
+        raise SystemExit(1)
@@ -0,0 +1,383 @@
+"""
+offline end-to-end benchmarks of the staging stages.
+Synthetic mozilla repositories are created in a work directory, ssh
+hg.mozilla.org is replaced by lib/fakehgmo.py (or by the local
+transport, see lib.transport) and the real code runs against them:
+prepare_user_repos (repositories), the patches (patch) and the master
+clones (master).
+Every stage runs in its own process: the peak memory of a stage is the
+peak of its process. Results are a json document, compare() reports the
+changes from a previous run (see benchmark.py).
+"""
+import json
+import os
+import pipes
+import platform
+import resource
+import subprocess
+import sys
+import time
+import urllib
+
+from lib.config import Config
+from lib.capture import OutputCapture
+from lib.manifest import StagingManifest
+from lib.repositories import Repositories
+from lib.patch import PatchBuildbotConfigs, PatchTools, PatchRunner
+from lib.master import Master
+import lib.trace as trace
+from lib.logger import logger, setup
+log = logger(__name__)
+
+# in execution order, every stage needs the previous ones
+STAGES = ('repositories', 'patch', 'master')
+# metrics reported by compare()
+COMPARED = ('wall_s', 'repos_per_min', 'peak_rss_kb', 'children_peak_rss_kb')
+
+USERNAME = 'bench'
+TRACKING_BUG = '1000000'
+VERSION = '33.0b1'
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(LIB_DIR)
+
+SHIPPED_LOCALES = 'en-US\nde\nfr\nit linux win32\nja-JP-mac osx\n'
+# one @OPTION@ per line, see generate_master_json
+MASTER_JSON_TEMPLATE = """[
+  {
+    "name": "@MASTER_NAME@",
+    "basedir": "@BASEDIR@",
+    "http_port": @HTTP_PORT@,
+    "ssh_port": @SSH_PORT@,
+    "pb_port": @PB_PORT@,
+    "role": "@ROLE@"
+  }
+]
+"""
+
+
+class BenchmarkError(Exception):
+    """Generic Benchmark error"""
+    pass
+
+
+def _hg(args, cwd=None):
+    """runs hg args, raises a BenchmarkError if it fails"""
+    cmd = ('hg', '--config', 'ui.username=bench <bench@localhost>')
+    process = subprocess.Popen(cmd + tuple(args), cwd=cwd,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    if OutputCapture('hg {0}'.format(args[0])).feed_process(process):
+        raise BenchmarkError('hg {0} failed'.format(' '.join(args)))
+
+
+def _write(path, text):
+    """writes text in path, creating its directory"""
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as out:
+        out.write(text)
+
+
+def _filler(name, size):
+    """returns about size bytes of text for the file name"""
+    line = '# {0}: https://hg.mozilla.org/build/tools\n'.format(name)
+    return line * max(1, size // len(line))
+
+
+def file_url(path):
+    """returns the file:// url of path"""
+    return 'file://{0}'.format(urllib.pathname2url(os.path.abspath(path)))
+
+
+def make_repo(path, files, file_kb, commits, branches=(), contents=None):
+    """creates a synthetic hg repository in path: files files of about
+       file_kb KB in the first of commits changesets, the next ones change
+       a slice of them. Every branch in branches gets a changeset.
+       contents, a {relative path: text} dictionary, adds files with a
+       known content (e.g. the staging files) to the first changeset"""
+    _hg(('init', path))
+    names = ['src/{0:02d}/file{1:05d}.py'.format(index % 100, index)
+             for index in xrange(files)]
+    for commit in xrange(max(1, commits)):
+        changed = {'CHANGES': 'changeset {0}\n'.format(commit)}
+        if commit == 0:
+            changed.update(contents or {})
+            indexes = xrange(files)
+        else:
+            indexes = xrange(commit, files, commits)
+        for index in indexes:
+            name = names[index]
+            changed[name] = '{0}# changeset {1}\n'.format(
+                _filler(name, file_kb * 1024), commit)
+        for name, text in changed.items():
+            _write(os.path.join(path, name), text)
+        _hg(('commit', '--addremove', '-m', 'changeset {0}'.format(commit)),
+            cwd=path)
+    for branch in branches:
+        _hg(('branch', branch), cwd=path)
+        _write(os.path.join(path, 'CHANGES'), 'branch {0}\n'.format(branch))
+        _hg(('commit', '-m', 'branch {0}'.format(branch)), cwd=path)
+        _hg(('update', 'default'), cwd=path)
+    # served repositories have no working directory
+    _hg(('update', 'null'), cwd=path)
+
+
+def repository_contents(config, name):
+    """returns the files, as {relative path: text}, the stages need in the
+       synthetic copy of the repository name"""
+    if name == 'buildbot-configs':
+        release = config.get_list('common', 'staging_release')
+        text = ''.join("{0}_repo_path = 'build/{0}'\n".format(repo)
+                       for repo in config.options('repositories'))
+        text += "mozilla_repo_path = 'releases/mozilla-beta'\n"
+        text += "stage_repo_path = 'users/stage-ffxbld'\n"
+        return dict((path, text)
+                    for path in StagingManifest(config, release).paths)
+    if name == 'tools' and config.has_section('patch-tools'):
+        # tracked, patch-tools replaces it
+        dst = config.get('patch-tools', 'dst_production_masters_json')
+        return {dst: '[]\n'}
+    return {}
+
+
+def create_mozilla_repos(config, root, files, file_kb, commits):
+    """creates the synthetic mozilla repositories of config under root,
+       returns their number"""
+    created = []
+    for name in config.options('repositories'):
+        src = config.get(name, 'src_repo_name')
+        if src in created:
+            continue
+        # buildbot-configs is patched on default and production
+        branches = ('production',) if name == 'buildbot-configs' else ()
+        make_repo(os.path.join(root, src), files, file_kb, commits, branches,
+                  repository_contents(config, name))
+        created.append(src)
+    return len(created)
+
+
+def write_ssh(bin_dir, root, user_dir):
+    """writes bin_dir/ssh: it runs lib/fakehgmo.py on root and user_dir"""
+    path = os.path.join(bin_dir, 'ssh')
+    args = (sys.executable, os.path.join(LIB_DIR, 'fakehgmo.py'), root,
+            user_dir)
+    _write(path, '#!/bin/sh\nexec {0} "$@"\n'.format(
+        ' '.join(pipes.quote(arg) for arg in args)))
+    os.chmod(path, 0o755)
+    return path
+
+
+def span_summary(events):
+    """returns {category:name: {count, seconds}} of the spans in events"""
+    summary = {}
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        key = '{0}:{1}'.format(event['cat'], event['name'])
+        entry = summary.setdefault(key, {'count': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['seconds'] = round(entry['seconds'] + event['dur'] / 1e6, 3)
+    return summary
+
+
+def _run_repositories(config, master_install):
+    Repositories(config).prepare_user_repos()
+    return len(config.options('repositories'))
+
+
+def _run_patch(config, master_install):
+    release = config.get_list('common', 'staging_release')
+    manifest = StagingManifest(config, release)
+    runner = PatchRunner()
+    runner.register(PatchBuildbotConfigs(config, release,
+                                         'patch-buildbot-configs', manifest))
+    runner.register(PatchTools(config, release, 'patch-tools', manifest))
+    runner.run()
+    return len(runner.patches)
+
+
+def _run_master(config, master_install):
+    master = Master(config)
+    if master_install:
+        master.install()
+    else:
+        # the repositories part of Master.install, virtualenv and pip need
+        # a package index
+        master._prepare_dirs()
+        master._clone_repositories()
+    return len(config.get_list('master', 'repositories'))
+
+
+_RUNNERS = {'repositories': _run_repositories,
+            'patch': _run_patch,
+            'master': _run_master}
+
+
+def run_stage(stage, config_files, result_file, master_install=False):
+    """runs stage with the configuration in config_files and writes its
+       metrics in result_file. Call it in a new process (see
+       Benchmark.run_stage): memory and cpu are the ones of the process"""
+    config = Config()
+    config.read_from(config_files)
+    trace.enable()
+    start = time.time()
+    repos = _RUNNERS[stage](config, master_install)
+    wall = time.time() - start
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {'stage': stage,
+              'wall_s': round(wall, 3),
+              'repos': repos,
+              'repos_per_min': round(repos * 60 / wall, 2) if wall else None,
+              'cpu_s': round(own.ru_utime + own.ru_stime, 3),
+              'children_cpu_s': round(children.ru_utime +
+                                      children.ru_stime, 3),
+              'peak_rss_kb': own.ru_maxrss,
+              'children_peak_rss_kb': children.ru_maxrss,
+              'spans': span_summary(trace.events())}
+    with open(result_file, 'w') as out:
+        json.dump(result, out, indent=2, sort_keys=True)
+    return result
+
+
+class Benchmark(object):
+    """end-to-end benchmark of the configuration cfg, in workdir (it must
+       not exist). Every mozilla repository has files files of file_kb KB
+       and commits changesets. transport is ssh (the fake ssh) or local"""
+    def __init__(self, cfg, workdir, release='firefox', files=200,
+                 file_kb=4, commits=20, master_install=False,
+                 transport='ssh'):
+        self.cfg = os.path.abspath(cfg)
+        self.workdir = os.path.abspath(workdir)
+        self.release = release
+        self.files = files
+        self.file_kb = file_kb
+        self.commits = commits
+        self.master_install = master_install
+        self.transport = transport
+        self.root = os.path.join(self.workdir, 'hg.mozilla.org')
+        self.user_dir = os.path.join(self.root, 'users',
+                                     '{0}_mozilla.com'.format(USERNAME))
+        self.bin_dir = os.path.join(self.workdir, 'bin')
+        self.overrides = os.path.join(self.workdir, 'benchmark.ini')
+
+    def parameters(self):
+        """returns the parameters of this benchmark"""
+        return {'config': os.path.basename(self.cfg),
+                'release': self.release,
+                'files': self.files,
+                'file_kb': self.file_kb,
+                'commits': self.commits,
+                'master_install': self.master_install,
+                'transport': self.transport}
+
+    def write_overrides(self):
+        """writes the fixtures and the configuration that points cfg to
+           them and to the local repositories"""
+        locales = os.path.join(self.workdir, 'shipped-locales')
+        _write(locales, SHIPPED_LOCALES)
+        template = os.path.join(self.workdir, 'dev-master_config.json.in')
+        _write(template, MASTER_JSON_TEMPLATE)
+        sections = (
+            ('common', (('root', os.path.join(self.workdir, 'root')),
+                        ('username', USERNAME),
+                        ('tracking_bug', TRACKING_BUG),
+                        ('staging_release', self.release),
+                        ('version', VERSION),
+                        ('hg_m_o', self.root),
+                        ('hg_user_repo', self.user_dir),
+                        ('replication_delay', '0'),
+                        ('transport', self.transport))),
+            ('locales', (('url', file_url(locales)),)),
+            ('patch-tools', (('src_production_masters_json',
+                              file_url(template)),)),
+        )
+        with open(self.overrides, 'w') as out:
+            for section, values in sections:
+                out.write('[{0}]\n'.format(section))
+                for option, value in values:
+                    out.write('{0}={1}\n'.format(option, value))
+
+    def configuration(self):
+        """returns the configuration used by the stages"""
+        config = Config()
+        config.read_from([self.cfg, self.overrides])
+        return config
+
+    def setup(self):
+        """creates the work directory, the synthetic repositories and the
+           fake ssh, returns the seconds it took"""
+        if os.path.exists(self.workdir):
+            raise BenchmarkError('{0} already exists'.format(self.workdir))
+        start = time.time()
+        os.makedirs(self.bin_dir)
+        self.write_overrides()
+        repos = create_mozilla_repos(self.configuration(), self.root,
+                                     self.files, self.file_kb, self.commits)
+        write_ssh(self.bin_dir, self.root, self.user_dir)
+        seconds = time.time() - start
+        log.info('created {0} repositories in {1:.1f}s'.format(repos,
+                                                               seconds))
+        return seconds
+
+    def run_stage(self, stage):
+        """runs stage in a new process, returns its metrics"""
+        result_file = os.path.join(self.workdir, '{0}.json'.format(stage))
+        cmd = [sys.executable, '-m', 'lib.benchmark', stage, self.cfg,
+               self.overrides, result_file]
+        if self.master_install:
+            cmd.append('--master-install')
+        env = dict(os.environ)
+        env['PATH'] = os.pathsep.join((self.bin_dir, env.get('PATH', '')))
+        process = subprocess.Popen(cmd, cwd=REPO_DIR, env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        if OutputCapture('benchmark {0}'.format(stage)).feed_process(process):
+            raise BenchmarkError('stage {0} failed'.format(stage))
+        with open(result_file) as result:
+            result = json.load(result)
+        log.info('{0}: {1:.1f}s, {2} repos/min, peak rss {3} KB'.format(
+            stage, result['wall_s'], result['repos_per_min'],
+            result['peak_rss_kb']))
+        return result
+
+    def run(self, stages=STAGES):
+        """runs setup() and stages, in order, returns the report"""
+        setup_s = self.setup()
+        results = [self.run_stage(stage) for stage in stages]
+        return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'parameters': self.parameters(),
+                'setup_s': round(setup_s, 3),
+                'stages': results}
+
+
+def compare(old, new):
+    """returns the list of (stage, metric, old value, new value, change in
+       percent) of the stages in the reports old and new"""
+    if old.get('parameters') != new.get('parameters'):
+        log.warning('the benchmarks have different parameters')
+    previous = dict((result['stage'], result) for result in old['stages'])
+    rows = []
+    for result in new['stages']:
+        if result['stage'] not in previous:
+            continue
+        for metric in COMPARED:
+            before = previous[result['stage']].get(metric)
+            after = result.get(metric)
+            change = None
+            if before and after is not None:
+                change = 100.0 * (after - before) / before
+            rows.append((result['stage'], metric, before, after, change))
+    return rows
+
+
+if __name__ == '__main__':
+    # python -m lib.benchmark <stage> <cfg> <overrides> <result file>
+    #                         [--master-install]
+    setup()
+    run_stage(sys.argv[1], sys.argv[2:4], sys.argv[4],
+              '--master-install' in sys.argv[5:])
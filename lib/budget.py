@@ -0,0 +1,213 @@
+"""
+global concurrency budget.
+When several staging environments are provisioned by the same process
+(see batch.py), the budget limits how many heavy operations run at the
+same time across all of them. There are two pools:
+
+ * network: remote ssh commands, hg and git clones
+ * cpu: virtualenv and pip installs (wheel builds), file scanning
+
+set_budget() gives both pools a fixed size. adapt() sizes them from the
+host: cpu count, load average (/proc/loadavg) and available memory; the
+sizes follow the load of the host: they are computed again, at most every
+ADAPT_INTERVAL seconds, when an operation asks for a slot.
+"""
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.logger import logger
+log = logger(__name__)
+
+NETWORK = 'network'
+CPU = 'cpu'
+# network operations mostly wait: concurrent ones for every idle cpu
+NETWORK_PER_CPU = 2
+# at most this many concurrent network operations (hg.mozilla.org is shared)
+NETWORK_MAX = 8
+# memory (in MB) an operation of each pool may need
+JOB_MEMORY_MB = {NETWORK: 256, CPU: 512}
+# seconds between two evaluations of the host resources
+ADAPT_INTERVAL = 30
+
+_limiters = {}
+_maximum = None
+_adaptive = False
+_adapted = 0
+_lock = threading.Lock()
+
+
+class Limiter(object):
+    """a semaphore whose size can change, size None means no limit"""
+    def __init__(self, name, size=None):
+        self.name = name
+        self.size = size
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def resize(self, size):
+        """changes the size, running operations keep their slot"""
+        with self._condition:
+            self.size = size
+            self._condition.notify_all()
+
+    def acquire(self, count=1):
+        """waits for count free slots (at most the size), returns the
+           number of slots taken"""
+        with self._condition:
+            if self.size:
+                count = min(count, self.size)
+            while self.size and self.in_use + count > self.size:
+                self._condition.wait()
+            self.in_use += count
+            return count
+
+    def release(self, count=1):
+        with self._condition:
+            self.in_use -= count
+            self._condition.notify_all()
+
+
+def cpu_count():
+    """returns the number of cpus (1 if unknown)"""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def load_average(path='/proc/loadavg'):
+    """returns the load average of the last minute, None if unknown"""
+    try:
+        with open(path) as loadavg:
+            return float(loadavg.read().split()[0])
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+def available_memory(path='/proc/meminfo'):
+    """returns the memory available for new processes in MB, None if
+       unknown"""
+    values = {}
+    try:
+        with open(path) as meminfo:
+            for line in meminfo:
+                name, _, value = line.partition(':')
+                values[name] = int(value.split()[0])
+    except (IOError, IndexError, ValueError):
+        return None
+    if 'MemAvailable' in values:
+        available = values['MemAvailable']
+    elif 'MemFree' in values:
+        # kernels older than 3.14
+        available = values['MemFree'] + values.get('Cached', 0)
+    else:
+        return None
+    return available // 1024
+
+
+def host_limits(cpus, load=None, memory=None, maximum=None):
+    """returns {pool: size} for a host with cpus, load average and memory
+       (MB) available; None values are ignored. maximum caps both pools"""
+    idle = float(cpus)
+    if load is not None:
+        idle = max(cpus - load, 1.0)
+    limits = {CPU: max(int(idle), 1),
+              NETWORK: max(min(int(idle * NETWORK_PER_CPU), NETWORK_MAX), 1)}
+    for pool in limits:
+        if memory is not None:
+            limits[pool] = max(min(limits[pool],
+                                   memory // JOB_MEMORY_MB[pool]), 1)
+        if maximum:
+            limits[pool] = min(limits[pool], maximum)
+    return limits
+
+
+def _set_limits(limits):
+    """resizes (or creates) the limiters, returns True if any changed"""
+    changed = False
+    for pool, size in limits.items():
+        limiter = _limiters.get(pool)
+        if limiter is None:
+            _limiters[pool] = Limiter(pool, size)
+            changed = True
+        elif limiter.size != size:
+            limiter.resize(size)
+            changed = True
+    return changed
+
+
+def set_budget(size):
+    """allows at most size concurrent operations in each pool, None or 0
+       removes the limit"""
+    global _adaptive
+    with _lock:
+        _adaptive = False
+        if size:
+            log.debug('concurrency budget: {0}'.format(size))
+            _set_limits({NETWORK: size, CPU: size})
+        else:
+            _limiters.clear()
+
+
+def adapt(maximum=None):
+    """sizes the pools from the resources of the host (at most maximum
+       operations in each pool, if set) and keeps adapting them"""
+    global _adaptive, _maximum
+    with _lock:
+        _adaptive = True
+        _maximum = maximum
+    _adapt(force=True)
+
+
+def _adapt(force=False):
+    """evaluates the host resources again, at most every ADAPT_INTERVAL
+       seconds"""
+    global _adapted
+    with _lock:
+        now = time.time()
+        if not _adaptive or (not force and now - _adapted < ADAPT_INTERVAL):
+            return
+        _adapted = now
+        cpus = cpu_count()
+        load = load_average()
+        memory = available_memory()
+        # the operations running now are part of the load and of the used
+        # memory: without them, the limits would shrink as they start
+        in_use = dict((pool, limiter.in_use)
+                      for pool, limiter in _limiters.items())
+        if load is not None:
+            load = max(load - in_use.get(CPU, 0), 0.0)
+        if memory is not None:
+            memory += sum(in_use[pool] * JOB_MEMORY_MB[pool]
+                          for pool in in_use)
+        limits = host_limits(cpus, load, memory, _maximum)
+        if _set_limits(limits):
+            log.info('concurrency limits: network {0}, cpu {1} (cpus: {2}, '
+                     'load: {3}, available memory: {4} MB)'.format(
+                         limits[NETWORK], limits[CPU], cpus, load, memory))
+
+
+def limit(pool):
+    """returns the size of pool, None if it has no limit"""
+    limiter = _limiters.get(pool)
+    if limiter is None:
+        return None
+    return limiter.size
+
+
+@contextmanager
+def slot(pool=NETWORK, count=1):
+    """context manager: waits for count free slots in pool (capped at its
+       size), yields the number of slots held"""
+    _adapt()
+    limiter = _limiters.get(pool)
+    if limiter is None:
+        yield count
+        return
+    count = limiter.acquire(count)
+    try:
+        yield count
+    finally:
+        limiter.release(count)
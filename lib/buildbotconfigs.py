@@ -1,10 +1,15 @@
-import os
-import sh
 import shutil
 import tempfile
 
+from lib.scanner import scan_tree
+import lib.deadline as deadline
+from lib.lazy import lazy_import
 from lib.logger import logger
 log = logger(__name__)
+sh = lazy_import('sh')
+
+# paths containing any of these words are not prepared for staging
+STAGING_EXCLUDE = ('test', 'calendar', 'seamonkey', 'b2g')
 
 
 class BuildbotConfigsError(Exception):
@@ -38,7 +43,7 @@ class BuildbotConfigs(object):
         cmd = ("hg.mozilla.org", "clone", dst_repo_name,  src_repo_name)
         log.info('cloning {0} to {1}'.format(src_repo_name, dst_repo_name))
         log.debug('running ssh {0}'.format(' '.join(cmd)))
-        sh.ssh(cmd)
+        deadline.run_command('ssh', sh.ssh, cmd)
 
     def delete_user_repo(self):
         """delete user's remote repository"""
@@ -54,7 +59,7 @@ class BuildbotConfigs(object):
         log.debug('running ssh {0}'.format(' '.join(cmd)))
         output = []
         try:
-            for line in sh.ssh(cmd, _iter=True):
+            for line in deadline.command_lines('ssh', sh.ssh, cmd):
                 out = line.strip()
                 log.debug(out)
                 output.append(out)
@@ -74,7 +79,7 @@ class BuildbotConfigs(object):
         log.debug('running sh {0}'.format(' '.join(cmd)))
         self.local_checkout_dir = dst_dir
         try:
-            sh.hg('clone', repo, dst_dir)
+            deadline.run_command('clone', sh.hg, 'clone', repo, dst_dir)
         except sh.ErrorReturnCode as error:
             msg = 'clone failed'
             msg = '{0}: hg {1}'.format(msg, ' '.join(cmd))
@@ -89,20 +94,9 @@ class BuildbotConfigs(object):
         if not self.local_checkout_dir:
             msg = 'prepare for staging failed: local checkout does not exist'
             raise BuildbotConfigsError(msg)
-        files = set()
-        for root, dirs, files in os.walk(self.local_checkout_dir):
-            for script in files:
-                if script.endswith('.py'):
-                    with open(os.path.join(root, script)) as src:
-                        for line in src.readlines():
-                            if 'build/' in line and 'test' not in line:
-                                files.add(os.path.join(root, script))
-
-        files = filter(lambda k: 'test' not in k, files)
-        files = filter(lambda k: 'calendar' not in k, files)
-        files = filter(lambda k: 'seamonkey' not in k, files)
-        files = filter(lambda k: 'b2g' not in k, files)
-        return files
+        return scan_tree(self.local_checkout_dir, b'build/',
+                         suffixes=('.py',), exclude=STAGING_EXCLUDE,
+                         skip_lines_with=b'test')
 
 
 def update_to_user_repo(configuration, filename):
@@ -0,0 +1,114 @@
+"""
+bounded capture of the output of child processes (hg, git, pip, setup.py).
+Only the last max_bytes of the output of each command are kept in memory;
+they are logged only if the command fails (or raises, e.g. a timeout).
+Every command logs its line and byte counters at debug level, so the size
+of the log does not depend on the size of the clones.
+Set the capture size to 0 to log every line, as before.
+"""
+import collections
+
+import lib.deadline as deadline
+from lib.logger import logger
+log = logger(__name__)
+
+# bytes kept for each command
+CAPTURE_BYTES = 64 * 1024
+
+_max_bytes = CAPTURE_BYTES
+
+
+def set_capture_size(max_bytes):
+    """keeps the last max_bytes of each command output, 0 logs every
+       line"""
+    global _max_bytes
+    _max_bytes = max_bytes
+
+
+class RingBuffer(object):
+    """keeps the last max_bytes of the lines added to it"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.dropped = 0
+        self._lines = collections.deque()
+
+    def append(self, line):
+        self._lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_bytes and len(self._lines) > 1:
+            self.size -= len(self._lines.popleft())
+            self.dropped += 1
+
+    def lines(self):
+        """returns the lines in the buffer"""
+        return list(self._lines)
+
+
+class OutputCapture(object):
+    """captures the output of a command, use it as context manager:
+
+        with OutputCapture('hg clone') as output:
+            for line in hg(cmd, _iter=True):
+                output.feed(line)
+
+       the output is logged if the with block raises an exception or
+       if failed() is called"""
+    def __init__(self, name, max_bytes=None):
+        self.name = name
+        if max_bytes is None:
+            max_bytes = _max_bytes
+        self.max_bytes = max_bytes
+        self.lines = 0
+        self.bytes = 0
+        self.buffer = RingBuffer(max_bytes) if max_bytes else None
+
+    def feed(self, line):
+        """adds a line of output"""
+        line = line.rstrip('\r\n')
+        self.lines += 1
+        self.bytes += len(line) + 1
+        if self.buffer is None:
+            log.debug(line)
+        else:
+            self.buffer.append(line)
+
+    def feed_process(self, process, kind=None):
+        """reads the stdout of process (a subprocess.Popen object) until
+           the end, waits for it and returns its exit code.
+           A non zero exit code dumps the output. If kind is set, process
+           is killed after the timeout of kind (see lib.deadline.watch)"""
+        if kind is None:
+            return self._feed_process(process)
+        with deadline.watch(process, kind, self.name):
+            return self._feed_process(process)
+
+    def _feed_process(self, process):
+        for line in iter(process.stdout.readline, ''):
+            self.feed(line)
+        returncode = process.wait()
+        if returncode != 0:
+            self.failed('exit code {0}'.format(returncode))
+        return returncode
+
+    def failed(self, reason):
+        """logs the captured output"""
+        log.error('{0} failed ({1}), {2} lines of output'.format(
+            self.name, reason, self.lines))
+        if self.buffer is None:
+            # already logged
+            return
+        if self.buffer.dropped:
+            log.error('[... {0} lines omitted]'.format(self.buffer.dropped))
+        for line in self.buffer.lines():
+            log.error('{0}: {1}'.format(self.name, line))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.failed(exc_value)
+        log.debug('%s: %d lines, %d bytes of output', self.name, self.lines,
+                  self.bytes)
+        return False
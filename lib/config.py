@@ -5,12 +5,13 @@ import os
 import pwd
 import random
 import string
-import lib.ports as ports
-from lib.which import which
 import configparser
 
+from lib.lazy import lazy_import
 from lib.logger import logger
 log = logger(__name__)
+# only needed to generate runtime values
+ports = lazy_import('lib.ports')
 
 
 def get_username():
@@ -41,6 +42,8 @@ class Config(configparser.ConfigParser):
             interpolation=configparser.ExtendedInterpolation()
         )
         self.skip_validation = False
+        # (section, option) of the values generated at runtime
+        self.generated = set()
 
     def get(self, section, option, **_3to2kwargs):
         try:
@@ -67,12 +70,19 @@ class Config(configparser.ConfigParser):
             log.debug(error)
             raise ConfigError(error)
 
-    def read_from(self, filenames):
+    def read_from(self, filenames, values=None):
         """reads the configuration from a file or a list of files
            and then generates some runtime specific values
-           as (ports, passwords,..)"""
+           as (ports, passwords,..)
+           values is an optional {(section, option): value} dictionary of
+           runtime values already generated elsewhere (e.g. ports leased by
+           the staging daemon), they are not generated again"""
         self.read(filenames)
         self._validate()
+        if values:
+            for (section, option), value in values.items():
+                self.set(section, option, value)
+                self.generated.add((section, option))
         self._set_runtime_values()
 
     def _validate(self):
@@ -157,6 +167,7 @@ class Config(configparser.ConfigParser):
         password = generate_random_password()
         log.debug('shipit password: {0}'.format(password))
         self.set('shipit', 'password', password)
+        self.generated.add(('shipit', 'password'))
 
     def _set_shipit_port(self):
         """finds an empty port for shipit"""
@@ -169,10 +180,21 @@ class Config(configparser.ConfigParser):
         shipit_base_port = int(self.get('port_ranges', 'shipit'))
         _ports = ports.available_in_range(shipit_base_port,
                                           shipit_base_port + port_range)
-        # random.sample(_ports, 1) returns a list
-        shipit_port = str(random.sample(_ports, 1)[0])
+        # skip ports picked by other configurations in this process
+        _ports -= ports.reserved()
+        while True:
+            if len(_ports) < 1:
+                msg = "no available ports for ship it. Giving up"
+                raise ConfigError(msg)
+            # random.sample(_ports, 1) returns a list
+            shipit_port = random.sample(_ports, 1)[0]
+            if ports.reserve(shipit_port):
+                break
+            _ports.discard(shipit_port)
+        shipit_port = str(shipit_port)
         log.debug('shipit port: {0}'.format(shipit_port))
         self.set('shipit', 'port', shipit_port)
+        self.generated.add(('shipit', 'port'))
 
     def _set_master_ports(self):
         """finds three random ports for master (pb, ssh and http)"""
@@ -193,6 +215,8 @@ class Config(configparser.ConfigParser):
         pb_base_port = int(self.get('port_ranges', 'master_pb'))
         _ports = ports.available_in_range(http_base_port,
                                           http_base_port + port_range)
+        # skip ports picked by other configurations in this process
+        _ports -= ports.reserved()
 
         while True:
             if len(_ports) < 1:
@@ -205,7 +229,8 @@ class Config(configparser.ConfigParser):
             pb_port = pb_base_port + suffix
             ssh_port = ssh_base_port + suffix
 
-            if not ports.in_use(pb_port) and not ports.in_use(ssh_port):
+            if not ports.in_use(pb_port) and not ports.in_use(ssh_port) \
+               and ports.reserve(http_port, pb_port, ssh_port):
                 # we have found 3 ports that fit into our algorithm!
                 log.debug('master ports:')
                 log.debug('http: {0}'.format(http_port))
@@ -214,6 +239,9 @@ class Config(configparser.ConfigParser):
                 self.set('master', 'ssh_port', str(ssh_port))
                 self.set('master', 'pb_port', str(pb_port))
                 self.set('master', 'http_port', str(http_port))
+                self.generated.update((('master', 'ssh_port'),
+                                       ('master', 'pb_port'),
+                                       ('master', 'http_port')))
                 return
             # some of the ports was not free
             # discarding current port and picking up a new one
@@ -222,8 +250,39 @@ class Config(configparser.ConfigParser):
         msg = "no available ports for your staging master. Giving up"
         raise ConfigError(msg)
 
+    def reuse_values(self, values):
+        """replaces the values generated at runtime (passwords, ports...)
+           with the ones of a previous run.
+           values is a {(section, option): value} dictionary, values that
+           are set in the configuration file are left untouched.
+           The ports of the previous run are reserved and the generated
+           ones released; if any of them is reserved by another
+           configuration, the generated ports are kept."""
+        previous_ports = {}
+        for (section, option), value in values.items():
+            if (section, option) not in self.generated:
+                continue
+            if option.endswith('port') and value != self.get(section, option):
+                previous_ports[(section, option)] = value
+                continue
+            log.debug('reusing {0}:{1} = {2}'.format(section, option, value))
+            self.set(section, option, value)
+        if not previous_ports:
+            return
+        if not ports.reserve(*[int(port)
+                               for port in previous_ports.values()]):
+            log.warning('the ports of the previous run are reserved by '
+                        'another environment, using new ports')
+            return
+        ports.release(*[int(self.get(section, option))
+                        for section, option in previous_ports])
+        for (section, option), value in previous_ports.items():
+            log.debug('reusing {0}:{1} = {2}'.format(section, option, value))
+            self.set(section, option, value)
+
     def _set_python_path(self):
         """adds the full path to your python executable in common:python_path"""
+        from lib.which import which
         self.set('common', 'python_path', which('python'))
 
     def __str__(self):
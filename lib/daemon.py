@@ -0,0 +1,377 @@
+"""
+staging daemon.
+A long running process that keeps warm pools of the slow resources needed
+by a staging environment:
+
+ * port sets (ship it and master ports) already scanned and reserved
+ * pre-built, relocatable, master virtualenvs
+ * up to date hg mirrors (common:mirror_dir)
+
+and accepts provisioning and teardown requests on a local unix socket.
+Requests and replies are single line json documents, e.g.:
+
+    {"command": "provision", "bug": "1234", "version": "33.0b1",
+     "release": "firefox"}
+    {"status": "ok", "environment": "user-1234", ...}
+
+Pools are refilled in background after every request.
+"""
+import json
+import os
+import shutil
+import socket
+import SocketServer
+import threading
+import time
+
+from lib.config import Config, ConfigError, get_username
+from lib.venv import Virtualenv, VirtualenvError
+from lib.mirror import MirrorCache, MirrorError
+from lib.staging import Environment
+from lib.pipeline import PipelineError
+from lib.teardown import Teardown, TeardownError
+from lib.state import ProvisioningState, StateError, RUNTIME_VALUES, \
+    state_file_path
+import lib.ports as ports
+from lib.logger import logger
+log = logger(__name__)
+
+# (section, option) of the ports leased by the daemon
+PORT_VALUES = tuple(value for value in RUNTIME_VALUES
+                    if value[1].endswith('port'))
+
+# seconds between two refreshes of the hg mirrors
+MIRROR_MAX_AGE = 600
+
+
+class DaemonError(Exception):
+    """Generic Daemon error"""
+    pass
+
+
+class WarmPool(object):
+    """a pool of ready to use resources.
+       create() builds a new resource (it may return None if the resource
+       cannot be built), refill() builds resources until the pool has
+       size elements"""
+    def __init__(self, name, size, create):
+        self.name = name
+        self.size = size
+        self.create = create
+        self._items = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def take(self):
+        """returns a resource, None if the pool is empty"""
+        with self._lock:
+            if self._items:
+                return self._items.pop(0)
+        log.debug('{0} pool is empty'.format(self.name))
+        return None
+
+    def put(self, item):
+        """returns an unused resource to the pool"""
+        with self._lock:
+            self._items.append(item)
+
+    def refill(self):
+        """builds the missing resources"""
+        while len(self) < self.size:
+            item = self.create()
+            if item is None:
+                return
+            self.put(item)
+            log.debug('{0} pool: {1}/{2}'.format(self.name, len(self),
+                                                 self.size))
+
+
+def send_request(socket_path, request, timeout=None):
+    """sends request (a dictionary) to the daemon listening on socket_path
+       and returns its reply"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        stream = sock.makefile('rw')
+        stream.write(json.dumps(request) + '\n')
+        stream.flush()
+        reply = stream.readline()
+    except socket.error as error:
+        raise DaemonError('{0}: {1}'.format(socket_path, error))
+    finally:
+        sock.close()
+    if not reply:
+        raise DaemonError('{0}: no reply'.format(socket_path))
+    return json.loads(reply)
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """reads a json request, replies with a json document"""
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            reply = self.server.daemon.handle(request)
+        except ValueError as error:
+            reply = {'status': 'error', 'error': 'bad request: {0}'.format(
+                error)}
+        self.wfile.write(json.dumps(reply) + '\n')
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class StagingDaemon(object):
+    """serves provisioning and teardown requests for the configuration
+       file cfg, keeping warm pools of ports and virtualenvs"""
+    def __init__(self, cfg, socket_path, pool_dir, port_sets=2,
+                 virtualenvs=1, mirror_max_age=MIRROR_MAX_AGE):
+        self.cfg = cfg
+        self.socket_path = socket_path
+        self.pool_dir = pool_dir
+        self.mirror_max_age = mirror_max_age
+        self.ports = WarmPool('ports', port_sets, self._lease_ports)
+        self.virtualenvs = WarmPool('virtualenv', virtualenvs,
+                                    self._build_virtualenv)
+        self._busy = set()
+        self._busy_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+        self._server = None
+        self._venv_id = 0
+
+    def _configuration(self, scan_ports=False):
+        """returns a new Config for cfg; ports are scanned (and reserved)
+           only if scan_ports is True"""
+        values = None
+        if not scan_ports:
+            values = dict.fromkeys(PORT_VALUES, '0')
+        config = Config()
+        config.read_from(self.cfg, values)
+        return config
+
+    def _previous_ports(self, bug, username=None):
+        """returns the ports used by the previous run of an environment"""
+        config = self._configuration()
+        config.set('common', 'tracking_bug', bug)
+        if username:
+            config.set('common', 'username', username)
+        state = ProvisioningState(state_file_path(config))
+        previous = state.previous_values()
+        return [int(previous[value]) for value in PORT_VALUES
+                if value in previous]
+
+    def _lease_ports(self):
+        """scans and reserves a port set, returns a
+           {(section, option): port} dictionary or None if cfg has fixed
+           ports"""
+        try:
+            config = self._configuration(scan_ports=True)
+        except ConfigError as error:
+            log.error('cannot lease ports: {0}'.format(error))
+            return None
+        leased = dict((value, config.get(*value)) for value in PORT_VALUES
+                      if value in config.generated)
+        if not leased:
+            log.debug('ports are set in {0}, nothing to lease'.format(
+                self.cfg))
+            return None
+        return leased
+
+    def _build_virtualenv(self):
+        """creates a relocatable master virtualenv in pool_dir, returns its
+           path or None on failure"""
+        config = self._configuration()
+        self._venv_id += 1
+        path = os.path.join(self.pool_dir, 'venv-{0}-{1}'.format(
+            os.getpid(), self._venv_id))
+        log.info('building virtualenv {0}'.format(path))
+        os.makedirs(path)
+        venv = Virtualenv(config)
+        try:
+            venv.create(path,
+                        config.get_list('master', 'virtualenv_extra_args'))
+            venv.make_relocatable()
+        except VirtualenvError as error:
+            log.error('cannot build virtualenv: {0}'.format(error))
+            # failures must not pile up half built virtualenvs
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        return path
+
+    def _refresh_mirrors(self):
+        """updates the hg mirrors of the repositories in cfg"""
+        config = self._configuration()
+        try:
+            mirror_dir = config.get('common', 'mirror_dir')
+        except ConfigError:
+            return
+        if not mirror_dir:
+            return
+        mirrors = MirrorCache(mirror_dir)
+        for name in config.options('repositories'):
+            try:
+                mirrors.refresh(config.get(name, 'mozilla_repo'),
+                                max_age=self.mirror_max_age)
+            except (ConfigError, MirrorError) as error:
+                log.error('mirror of {0}: {1}'.format(name, error))
+
+    def refill(self):
+        """refills the pools and refreshes the mirrors"""
+        self.ports.refill()
+        self.virtualenvs.refill()
+        self._refresh_mirrors()
+
+    def _refill_loop(self):
+        """refills the pools after every request (or every
+           mirror_max_age seconds)"""
+        while not self._stopped.is_set():
+            try:
+                self.refill()
+            except Exception as error:
+                # the daemon keeps serving with cold pools
+                log.error('refill failed: {0}'.format(error))
+            self._wake_up.wait(self.mirror_max_age)
+            self._wake_up.clear()
+
+    def _reserve(self, name):
+        """marks environment name as busy, raises a DaemonError if a
+           request for it is already running"""
+        with self._busy_lock:
+            if name in self._busy:
+                msg = 'a request for {0} is already running'.format(name)
+                raise DaemonError(msg)
+            self._busy.add(name)
+
+    def _done(self, name):
+        with self._busy_lock:
+            self._busy.discard(name)
+        self._wake_up.set()
+
+    def provision(self, bug, release, version, username=None, resume=False):
+        """creates a staging environment using the warm pools.
+           Returns a dictionary describing the environment"""
+        name = '{0}-{1}'.format(username or get_username(), bug)
+        self._reserve(name)
+        leased = None
+        virtualenv = None
+        try:
+            # reserved by the previous provision of this environment: free
+            # them, so that Config.reuse_values can reserve them again
+            ports.release(*self._previous_ports(bug, username))
+            leased = self.ports.take()
+            environment = Environment(self.cfg, bug, release, version,
+                                      username, resume, leased=leased)
+            config = environment.configuration
+            # the leased ports belong to the environment now; the ones
+            # replaced by the ports of a previous run have been released by
+            # Config.reuse_values
+            leased = None
+            if not os.path.exists(config.get('master', 'basedir')):
+                virtualenv = self.virtualenvs.take()
+            start = time.time()
+            environment.run(virtualenv)
+        finally:
+            if leased:
+                self.ports.put(leased)
+            if virtualenv is not None and os.path.exists(virtualenv):
+                # the pipeline failed before installing the master
+                self.virtualenvs.put(virtualenv)
+            self._done(name)
+        reply = {'environment': name,
+                 'seconds': round(time.time() - start, 1),
+                 'warm_virtualenv': virtualenv is not None}
+        for section, option in PORT_VALUES:
+            reply['{0}_{1}'.format(section, option)] = config.get(section,
+                                                                  option)
+        return reply
+
+    def teardown(self, bug, username=None, max_in_flight=4):
+        """removes a staging environment and releases its ports"""
+        config = self._configuration()
+        config.set('common', 'tracking_bug', bug)
+        if username:
+            config.set('common', 'username', username)
+        name = '{0}-{1}'.format(config.get('common', 'username'), bug)
+        self._reserve(name)
+        try:
+            previous = self._previous_ports(bug, username)
+            summary = Teardown(config).run(max_in_flight)
+        finally:
+            self._done(name)
+        ports.release(*previous)
+        return {'environment': name, 'summary': summary}
+
+    def status(self):
+        """returns the size of the pools and the running requests"""
+        with self._busy_lock:
+            busy = sorted(self._busy)
+        return {'ports': len(self.ports),
+                'virtualenvs': len(self.virtualenvs),
+                'running': busy}
+
+    def handle(self, request):
+        """executes request, returns the reply"""
+        command = request.get('command')
+        try:
+            if command == 'provision':
+                reply = self.provision(request['bug'], request['release'],
+                                       request['version'],
+                                       request.get('username'),
+                                       request.get('resume', False))
+            elif command == 'teardown':
+                reply = self.teardown(request['bug'],
+                                      request.get('username'),
+                                      request.get('jobs', 4))
+            elif command == 'status':
+                reply = self.status()
+            else:
+                raise DaemonError('unknown command: {0}'.format(command))
+        except KeyError as error:
+            msg = 'missing {0} in {1} request'.format(error, command)
+            return {'status': 'error', 'error': msg}
+        except (DaemonError, ConfigError, StateError, PipelineError,
+                TeardownError) as error:
+            log.error('{0} failed: {1}'.format(command, error))
+            return {'status': 'error', 'error': str(error)}
+        reply['status'] = 'ok'
+        return reply
+
+    def serve_forever(self):
+        """listens on socket_path until stop() is called"""
+        if os.path.exists(self.socket_path):
+            try:
+                send_request(self.socket_path, {'command': 'status'},
+                             timeout=5)
+            except DaemonError:
+                # left by a daemon that did not exit cleanly
+                os.remove(self.socket_path)
+            else:
+                msg = 'a daemon is already listening on {0}'.format(
+                    self.socket_path)
+                raise DaemonError(msg)
+        if not os.path.isdir(self.pool_dir):
+            os.makedirs(self.pool_dir)
+        self._server = _Server(self.socket_path, _RequestHandler)
+        self._server.daemon = self
+        refill = threading.Thread(target=self._refill_loop)
+        refill.daemon = True
+        refill.start()
+        log.info('listening on {0}'.format(self.socket_path))
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self.socket_path)
+
+    def stop(self):
+        """stops serving requests"""
+        self._stopped.set()
+        self._wake_up.set()
+        if self._server is not None:
+            self._server.shutdown()
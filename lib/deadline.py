@@ -0,0 +1,282 @@
+"""
+timeouts, run deadline and cancellation.
+Every child process runs with the timeout of its class (TIMEOUTS, or
+common:timeout_<class> in seconds, 0 for no timeout), capped by the time
+left before the deadline of the run (see set_deadline()). The timeouts of
+a configuration (see timeouts()) are in the log context: environments
+provisioned by the same process keep their own. sh commands run with
+run_command() or command_lines(): on timeout they get SIGTERM, and GRACE
+seconds to roll back, like the other processes (see watch()).
+cancel() (Ctrl-C or the deadline, see lib.pipeline) stops the run: the
+watched child processes (see watch()) are terminated and no new one is
+started, timeout() and check() raise CancelledError. Other children,
+e.g. the background removals of lib.teardown, keep running. Steps record
+their state and journal entries only when they complete, so a cancelled
+run can be resumed.
+"""
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.config import ConfigError
+from lib.logger import logger, current_context
+log = logger(__name__)
+
+# seconds, by class of operation
+TIMEOUTS = {'ssh': 900,        # ssh hg.mozilla.org clone/edit
+            'clone': 3600,     # hg and git clone, pull, push, identify
+            'pip': 1800,       # virtualenv and pip install
+            'setup': 900,      # setup.py
+            'command': 600}    # anything else (hg commit, make...)
+# seconds between SIGTERM and SIGKILL, hg rolls back its transactions
+GRACE = 5
+
+_deadline = None
+_reason = None
+# pids of the processes in watch()
+_watched = set()
+_lock = threading.Lock()
+
+
+class CancelledError(Exception):
+    """Generic cancellation error: Ctrl-C or the run deadline"""
+    pass
+
+
+class CommandTimeoutError(Exception):
+    """a child process ran longer than the timeout of its class"""
+    pass
+
+
+def timeouts(configuration):
+    """returns {class: seconds} from common:timeout_<class>, TIMEOUTS for
+       the classes without an option. Run the commands of configuration
+       in context(timeouts=...) (see lib.logger)"""
+    result = dict(TIMEOUTS)
+    for kind in TIMEOUTS:
+        try:
+            value = configuration.get('common', 'timeout_{0}'.format(kind))
+        except ConfigError:
+            continue
+        if value:
+            result[kind] = float(value)
+    return result
+
+
+def set_deadline(seconds):
+    """the run is cancelled seconds from now, None or 0 removes the
+       deadline"""
+    global _deadline
+    if seconds:
+        log.info('run deadline: {0}'.format(time.strftime(
+            '%H:%M:%S', time.localtime(time.time() + seconds))))
+        _deadline = time.time() + seconds
+    else:
+        _deadline = None
+
+
+def reset():
+    """removes the deadline and the cancellation, for the next run"""
+    global _deadline, _reason
+    _deadline = None
+    _reason = None
+
+
+def remaining():
+    """returns the seconds left before the deadline, None without one"""
+    deadline = _deadline
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
+
+
+def cancelled():
+    """returns the reason of the cancellation, None if the run goes on.
+       Cancels the run when the deadline has passed"""
+    if _reason is None and remaining() == 0:
+        cancel('deadline exceeded')
+    return _reason
+
+
+def check():
+    """raises a CancelledError if the run has been cancelled"""
+    reason = cancelled()
+    if reason is not None:
+        raise CancelledError(reason)
+
+
+def timeout(kind):
+    """returns the timeout of kind (a key of TIMEOUTS) capped by the
+       deadline, None for no timeout. Raises a CancelledError if the run
+       has been cancelled: nothing new starts"""
+    check()
+    kinds = current_context().get('timeouts') or TIMEOUTS
+    seconds = kinds.get(kind, TIMEOUTS['command']) or None
+    left = remaining()
+    if left is not None:
+        seconds = left if seconds is None else min(seconds, left)
+    return seconds
+
+
+def cancel(reason):
+    """cancels the run and terminates the watched processes"""
+    global _reason
+    with _lock:
+        if _reason is not None:
+            return
+        _reason = reason
+        watched = list(_watched)
+    log.error('cancelling the run: {0}'.format(reason))
+    for pid in watched:
+        kill_tree(pid)
+
+
+def descendants(pid):
+    """returns the pids of the processes started by pid (and by their
+       children), children first (linux, from /proc)"""
+    if not os.path.isdir('/proc'):
+        return []
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', name, 'stat')) as stat:
+                # the name, in parentheses, can contain spaces
+                fields = stat.read().rpartition(')')[2].split()
+        except IOError:
+            # already gone
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+    result = []
+    pending = list(children.get(pid, []))
+    while pending:
+        child = pending.pop(0)
+        result.append(child)
+        pending.extend(children.get(child, []))
+    return result
+
+
+def _signal(pids, sig):
+    alive = []
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            continue
+        alive.append(pid)
+    return alive
+
+
+def kill_tree(pid, include_root=True, grace=GRACE):
+    """terminates pid and its descendants: SIGTERM, then SIGKILL after
+       grace seconds to the ones still running"""
+    pids = descendants(pid)
+    if include_root:
+        pids.insert(0, pid)
+    alive = _signal(pids, signal.SIGTERM)
+    end = time.time() + grace
+    while alive and time.time() < end:
+        time.sleep(0.1)
+        alive = [child for child in alive if _running(child)]
+    _signal(alive, signal.SIGKILL)
+
+
+def _running(pid):
+    """returns True if pid is running (zombies are not)"""
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as stat:
+            state = stat.read().rpartition(')')[2].split()[0]
+    except IOError:
+        return False
+    return state != 'Z'
+
+
+def _reap(process):
+    """waits for a killed process (sh raises on its exit code)"""
+    try:
+        process.wait()
+    except Exception:
+        pass
+
+
+@contextmanager
+def watch(process, kind, name=None):
+    """context manager: kills process (a subprocess.Popen object or a sh
+       command running in background) and its children if it runs longer
+       than the timeout of kind. Raises a CommandTimeoutError on timeout,
+       a CancelledError if the run has been cancelled meanwhile"""
+    if name is None:
+        name = kind
+    try:
+        seconds = timeout(kind)
+    except CancelledError:
+        kill_tree(process.pid)
+        _reap(process)
+        raise
+    expired = []
+
+    def _expire():
+        log.error('{0}: timed out after {1:.0f}s'.format(name, seconds))
+        expired.append(True)
+        kill_tree(process.pid)
+
+    timer = None
+    if seconds is not None:
+        timer = threading.Timer(seconds, _expire)
+        timer.daemon = True
+        timer.start()
+    with _lock:
+        _watched.add(process.pid)
+    try:
+        # cancelled before it was watched
+        check()
+        yield process
+    except Exception:
+        # the error of a killed process is the timeout or the cancellation
+        if not expired and cancelled() is None:
+            raise
+        if not expired:
+            kill_tree(process.pid)
+            _reap(process)
+    finally:
+        with _lock:
+            _watched.discard(process.pid)
+        if timer is not None:
+            timer.cancel()
+    check()
+    if expired:
+        raise CommandTimeoutError('{0} timed out after {1:.0f}s'.format(
+            name, seconds))
+
+
+def _command_name(command, args):
+    """returns e.g. 'hg pull' for sh.hg called with ('pull', url)"""
+    words = []
+    for arg in args:
+        words.extend(arg if isinstance(arg, (list, tuple)) else [arg])
+    name = os.path.basename(str(command))
+    if words:
+        name = '{0} {1}'.format(name, words[0])
+    return name
+
+
+def run_command(kind, command, *args, **kwargs):
+    """runs command (a sh command) with args and kwargs, watched (see
+       watch()), and returns it once it has completed. Raises a
+       sh.ErrorReturnCode if it fails"""
+    process = command(*args, _bg=True, **kwargs)
+    with watch(process, kind, _command_name(command, args)):
+        process.wait()
+    return process
+
+
+def command_lines(kind, command, *args, **kwargs):
+    """like run_command(), yields the lines of the output of command while
+       it runs"""
+    process = command(*args, _iter=True, **kwargs)
+    with watch(process, kind, _command_name(command, args)):
+        for line in process:
+            yield line
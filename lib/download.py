@@ -1,6 +1,9 @@
-import urllib2
+import shutil
+import socket
+from lib.lazy import lazy_import
 from lib.logger import logger
 log = logger(__name__)
+urllib2 = lazy_import('urllib2')
 
 
 class DownloadError(Exception):
@@ -8,18 +11,48 @@ class DownloadError(Exception):
     pass
 
 
-def download(url, dst):
-    """A simple file dowloader. Gets the content of url and writes it to dst"""
+def open_url(url):
+    """opens url and returns the response object without reading it,
+       so callers can consume the content as a stream (line by line or
+       in chunks). Remember to close() the response when done.
+    """
     request = urllib2.Request(url)
     try:
-        log.debug('downloading {0} to {1}'.format(url, dst))
-        response = urllib2.urlopen(request)
-        # now write the response to dst
-        with open(dst, 'wb') as dst_file:
-            dst_file.write(response.read())
+        log.debug('opening {0}'.format(url))
+        return urllib2.urlopen(request)
     except urllib2.HTTPError as error:
         log.error('Cannot download {0}, HTTP error: {1}'.format(url, error.code))
         raise DownloadError(error)
     except urllib2.URLError as error:
         log.error('Cannot download {0}, URL error: {1}'.format(url, error.reason))
         raise DownloadError(error)
+
+
+def head(url, timeout=None):
+    """sends a HEAD request for url, returns the http status code.
+       Raises a DownloadError if url is unreachable or the server replies
+       with an error"""
+    request = urllib2.Request(url)
+    request.get_method = lambda: 'HEAD'
+    try:
+        log.debug('HEAD {0}'.format(url))
+        response = urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as error:
+        raise DownloadError('{0}: HTTP error {1}'.format(url, error.code))
+    except (urllib2.URLError, socket.error) as error:
+        raise DownloadError('{0}: {1}'.format(url, getattr(error, 'reason',
+                                                          error)))
+    response.close()
+    return response.getcode()
+
+
+def download(url, dst):
+    """A simple file dowloader. Gets the content of url and writes it to dst"""
+    log.debug('downloading {0} to {1}'.format(url, dst))
+    response = open_url(url)
+    try:
+        # now write the response to dst
+        with open(dst, 'wb') as dst_file:
+            shutil.copyfileobj(response, dst_file)
+    finally:
+        response.close()
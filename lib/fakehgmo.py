@@ -0,0 +1,69 @@
+"""
+a local stand-in for ssh hg.mozilla.org, used by the benchmarks (see
+lib.benchmark). User repositories are directories under user_dir, mozilla
+repositories directories under root:
+
+    fakehgmo.py <root> <user_dir> hg.mozilla.org clone <dst> <src>
+    fakehgmo.py <root> <user_dir> hg.mozilla.org edit <dst> delete YES
+
+clone creates user_dir/dst as a copy of root/src, edit deletes user_dir/dst.
+Like hg.mozilla.org, a failing command exits with 1.
+This module is executed as the ssh command: it does not import lib.
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+HOST = 'hg.mozilla.org'
+
+
+def fail(msg, exit_code=1):
+    """prints msg on stderr, returns exit_code"""
+    sys.stderr.write('{0}\n'.format(msg))
+    return exit_code
+
+
+def clone(root, user_dir, dst, src):
+    """creates user_dir/dst as a copy of root/src"""
+    src_dir = os.path.join(root, src)
+    dst_dir = os.path.join(user_dir, dst)
+    if not os.path.isdir(os.path.join(src_dir, '.hg')):
+        return fail('{0}: no such repository'.format(src))
+    if os.path.exists(dst_dir):
+        return fail('{0}: repository already exists'.format(dst))
+    parent = os.path.dirname(dst_dir)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    # the copy happens on the server: no working directory
+    return subprocess.call(('hg', 'clone', '--noupdate', '--quiet',
+                            src_dir, dst_dir))
+
+
+def delete(user_dir, dst):
+    """deletes user_dir/dst"""
+    dst_dir = os.path.join(user_dir, dst)
+    if not os.path.isdir(dst_dir):
+        return fail('{0}: no such repository'.format(dst))
+    shutil.rmtree(dst_dir)
+    return 0
+
+
+def main(argv):
+    """runs the ssh command in argv, returns the exit code"""
+    if len(argv) < 3:
+        return fail('usage: fakehgmo.py root user_dir host command...', 255)
+    root, user_dir, host = argv[:3]
+    command = argv[3:]
+    if host != HOST:
+        return fail('{0}: unknown host'.format(host), 255)
+    if len(command) == 3 and command[0] == 'clone':
+        return clone(root, user_dir, command[1], command[2])
+    if len(command) == 4 and command[0] == 'edit' and \
+            command[2:] == ['delete', 'YES']:
+        return delete(user_dir, command[1])
+    return fail('unsupported command: {0}'.format(' '.join(command)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,190 @@
+"""
+historical step timings.
+The duration of every span of a run (see lib.trace) is stored in a sqlite
+database, keyed by category, step, repository, configuration name and
+host. The history gives an estimate of the remaining time of a run (the
+median of the previous runs) and flags the steps that got slower than
+their trailing baseline.
+"""
+import os
+import socket
+import sqlite3
+import time
+
+from lib.config import ConfigError
+from lib.lazy import lazy_import
+from lib.logger import logger
+log = logger(__name__)
+# loads ctypes, once per run
+uuid = lazy_import('uuid')
+
+# number of previous runs used as baseline
+BASELINE_RUNS = 10
+# a baseline needs at least this number of samples
+MIN_SAMPLES = 3
+# steps shorter than this (in seconds) are never regressions
+MIN_SECONDS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timings (
+    run TEXT,
+    finished REAL,
+    config TEXT,
+    host TEXT,
+    category TEXT,
+    step TEXT,
+    repo TEXT,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS timings_key
+    ON timings (config, host, category, step, repo, finished);
+"""
+
+
+def history_file_path(configuration):
+    """returns common:history_db or ~/.staging_history.db"""
+    try:
+        path = configuration.get('common', 'history_db')
+    except ConfigError:
+        path = None
+    if not path:
+        path = '~/.staging_history.db'
+    return os.path.expanduser(path)
+
+
+def median(values):
+    """returns the median of values, None if values is empty"""
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class TimingHistory(object):
+    """step timings of the runs of config (a configuration name) on this
+       host"""
+    def __init__(self, path, config, host=None):
+        self.path = path
+        self.config = config
+        self.host = host or socket.gethostname()
+        self.run_id = uuid.uuid4().hex
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        connection = self._connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # a connection per call: steps record from different threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, timings):
+        """stores timings, a list of (category, step, repo, seconds), as
+           the timings of this run"""
+        now = time.time()
+        rows = [(self.run_id, now, self.config, self.host, category, step,
+                 repo or '', seconds)
+                for category, step, repo, seconds in timings]
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    rows)
+        finally:
+            connection.close()
+
+    def record_spans(self, events, environment=None):
+        """stores the spans in events (see lib.trace.events()), only the
+           ones of environment if set. Failed spans (errors, cancelled
+           steps) are skipped: they would pull down the baselines"""
+        timings = []
+        for event in events:
+            if event.get('ph') != 'X':
+                continue
+            args = event.get('args', {})
+            if environment and args.get('environment') != environment:
+                continue
+            if 'error' in args:
+                continue
+            timings.append((event['cat'], event['name'], args.get('repo'),
+                            event['dur'] / 1e6))
+        self.record(timings)
+        return timings
+
+    def baseline(self, category, step, repo=None, runs=BASELINE_RUNS):
+        """returns the median duration of step in the previous runs, None
+           if there are less than MIN_SAMPLES of them"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT seconds FROM timings WHERE config = ? AND host = ? '
+                'AND category = ? AND step = ? AND repo = ? AND run != ? '
+                'ORDER BY finished DESC LIMIT ?',
+                (self.config, self.host, category, step, repo or '',
+                 self.run_id, runs)).fetchall()
+        finally:
+            connection.close()
+        if len(rows) < MIN_SAMPLES:
+            return None
+        return median(row[0] for row in rows)
+
+    def baselines(self, category, runs=BASELINE_RUNS):
+        """returns {step: median duration in the previous runs} for the
+           steps of category (without repository) with at least
+           MIN_SAMPLES runs, in a single query"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT step, seconds FROM timings WHERE config = ? '
+                'AND host = ? AND category = ? AND repo = ? AND run != ? '
+                'ORDER BY finished DESC',
+                (self.config, self.host, category, '',
+                 self.run_id)).fetchall()
+        finally:
+            connection.close()
+        samples = {}
+        for step, seconds in rows:
+            values = samples.setdefault(step, [])
+            if len(values) < runs:
+                values.append(seconds)
+        return dict((step, median(values))
+                    for step, values in samples.items()
+                    if len(values) >= MIN_SAMPLES)
+
+    def estimate(self, category):
+        """returns a function: step name => expected seconds (or None),
+           for the steps of category (e.g. 'pipeline', see Pipeline.eta).
+           The baselines are loaded once: the pipeline calls it after
+           every step"""
+        return self.baselines(category).get
+
+    def regressions(self, timings, threshold=0.5):
+        """returns the list of (category, step, repo, seconds, baseline) of
+           timings that are more than threshold (0.5 = 50%) slower than
+           their baseline"""
+        slow = []
+        for category, step, repo, seconds in timings:
+            baseline = self.baseline(category, step, repo)
+            if baseline is None or seconds - baseline < MIN_SECONDS:
+                continue
+            if seconds > baseline * (1 + threshold):
+                slow.append((category, step, repo, seconds, baseline))
+        return slow
+
+    def report_regressions(self, timings, threshold=0.5):
+        """logs the regressions in timings, returns them"""
+        slow = self.regressions(timings, threshold)
+        for category, step, repo, seconds, baseline in slow:
+            name = step if not repo else '{0} ({1})'.format(step, repo)
+            log.warning('{0}: {1:.1f}s, {2:.0f}% slower than usual '
+                        '({3:.1f}s)'.format(name, seconds,
+                                            100 * (seconds / baseline - 1),
+                                            baseline))
+        return slow
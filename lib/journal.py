@@ -0,0 +1,114 @@
+"""
+checkpoint journal.
+An append-only file (one json object per line) listing the steps completed
+by a run: remote repository created, tagged and pushed, patch pushed...
+When a run is interrupted (e.g. a transient ssh failure), the next run can
+resume: completed steps are verified and skipped.
+"""
+import json
+import os
+import threading
+import time
+
+from lib.config import ConfigError
+from lib.logger import logger
+log = logger(__name__)
+
+
+class JournalError(Exception):
+    """Generic Journal error"""
+    pass
+
+
+def journal_file_path(configuration):
+    """returns the path of the journal: common:journal_file or
+       common:root/.staging_journal"""
+    try:
+        path = configuration.get('common', 'journal_file')
+    except ConfigError:
+        path = None
+    if not path:
+        path = os.path.join(configuration.get('common', 'root'),
+                            '.staging_journal')
+    return path
+
+
+class Journal(object):
+    """append-only journal of completed steps.
+       resume=True loads the steps completed by the previous run,
+       otherwise a new journal is started"""
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = {}
+        # steps can be recorded by different threads
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if resume:
+            self._load()
+        elif os.path.exists(path):
+            log.debug('starting a new journal: {0}'.format(path))
+            os.remove(path)
+
+    def _load(self):
+        """reads the completed steps from the journal"""
+        if not os.path.exists(self.path):
+            log.info('nothing to resume, {0} does not exist'.format(self.path))
+            return
+        line = '\n'
+        with open(self.path) as journal:
+            for lineno, line in enumerate(journal, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a run killed while writing leaves a truncated line
+                    log.debug('{0}:{1}: skipping corrupted entry'.format(
+                        self.path, lineno))
+                    continue
+                self.completed[entry['step']] = entry
+        if not line.endswith('\n'):
+            # do not append the next entry to a truncated line
+            with open(self.path, 'a') as journal:
+                journal.write('\n')
+        log.info('resuming: {0} completed steps'.format(len(self.completed)))
+
+    def is_completed(self, step, requires=()):
+        """returns True if step has been completed after all the steps
+           in requires (a step re-executed invalidates its dependents)"""
+        entry = self.completed.get(step)
+        if entry is None:
+            return False
+        for required in requires:
+            required = self.completed.get(required)
+            if required is None or required['time'] > entry['time']:
+                return False
+        return True
+
+    def record(self, step, **details):
+        """appends step to the journal"""
+        entry = dict(details)
+        entry['step'] = step
+        entry['time'] = time.time()
+        line = '{0}\n'.format(json.dumps(entry, sort_keys=True))
+        with self._lock:
+            with open(self.path, 'a') as journal:
+                journal.write(line)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.completed[step] = entry
+        log.debug('journal: {0} completed'.format(step))
+
+    def run(self, step, function, verify=None, requires=(), **details):
+        """runs function and records step, unless step is already completed.
+           verify is an optional callable: if it returns False, a step
+           completed in the journal is executed again.
+           See is_completed() for requires"""
+        if self.is_completed(step, requires):
+            if verify is None or verify():
+                log.info('{0}: already completed, skipping'.format(step))
+                return False
+            log.info('{0}: completed but verification failed'.format(step))
+        function()
+        self.record(step, **details)
+        return True
@@ -0,0 +1,36 @@
+"""
+lazy imports: the module is imported the first time one of its attributes
+is used, e.g.
+
+    sh = lazy_import('sh')
+    ...
+    sh.hg('clone', url, dst_dir)
+
+sh is slow to import and most command line runs need it late, if at all
+(e.g. --help, a failed preflight, a configuration error).
+"""
+import importlib
+
+
+class LazyModule(object):
+    """stands for the module name until one of its attributes is used"""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        # only called for the attributes the proxy itself does not have
+        module = self._module
+        if module is None:
+            # import_module holds the import lock: threads are safe
+            module = importlib.import_module(self._name)
+            self._module = module
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return '<lazy module {0}>'.format(self._name)
+
+
+def lazy_import(name):
+    """returns a proxy of the module name, see LazyModule"""
+    return LazyModule(name)
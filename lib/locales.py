@@ -1,9 +1,9 @@
 """
 download the list of locales
 """
-import os
-from tempfile import NamedTemporaryFile
-from lib.download import download, DownloadError
+import httplib
+
+from lib.download import open_url, DownloadError
 from lib.logger import logger
 log = logger(__name__)
 
@@ -15,26 +15,80 @@ class NoLocalesError(Exception):
     pass
 
 
-def get_shipped_locales(locales_url):
-    """ returns a tuple containing the list of shipped locales
-        taken from locales_url
+class ShippedLocale(object):
+    """a single shipped-locales entry: a locale and, optionally, the list of
+       platforms it ships on (e.g. 'ja linux win32').
+       An entry with no platforms ships everywhere.
+    """
+    def __init__(self, locale, platforms=None):
+        self.locale = locale
+        if platforms is None:
+            platforms = ()
+        self.platforms = tuple(platforms)
+
+    def ships_on(self, platform):
+        """returns True if this locale ships on platform"""
+        if not self.platforms:
+            return True
+        return platform in self.platforms
+
+    def __eq__(self, other):
+        if not isinstance(other, ShippedLocale):
+            return NotImplemented
+        return (self.locale, self.platforms) == (other.locale, other.platforms)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return ' '.join((self.locale,) + self.platforms)
+
+    def __repr__(self):
+        return 'ShippedLocale({0!r}, {1!r})'.format(self.locale,
+                                                    self.platforms)
+
+
+def parse_shipped_locales(lines, platform=None):
+    """parses shipped-locales lines, one entry at a time.
+       lines can be any iterable (a file, an http response, a list...)
+       en-US is skipped; if platform is set, only locales shipping on
+       platform are returned.
+    """
+    for line in lines:
+        tokens = line.split()
+        # removing empty lines and line = en-US
+        if not tokens or tokens[0] == 'en-US':
+            continue
+        entry = ShippedLocale(tokens[0], tokens[1:])
+        if platform is None or entry.ships_on(platform):
+            yield entry
+
+
+def get_shipped_locale_entries(locales_url, platform=None):
+    """returns a tuple of ShippedLocale objects taken from locales_url.
+       The http response is parsed while it's read, nothing is written
+       on disk.
     """
-    locales = []
-    # need to set delete=False because otherwise this file
-    # gets deleted just after the download as soon it gets closed
-    temp_locales = NamedTemporaryFile(delete=False)
     try:
-        download(locales_url, temp_locales)
+        response = open_url(locales_url)
     except DownloadError as error:
         log.error("Unable to get locales list")
         raise NoLocalesError(error)
-    with open(temp_locales) as locales_file:
-        for line in locales_file.readlines():
-            line = line.strip()
-            # removing empty lines and line = en-US
-            if line and line != 'en-US':
-                locales.append(line.strip())
-    log.debug('locales: {0}'.format(locales))
-    # removing temp file
-    os.remove(temp_locales)
-    return tuple(locales)
+    try:
+        entries = tuple(parse_shipped_locales(response, platform))
+    except (IOError, httplib.HTTPException) as error:
+        # read while parsing: socket.timeout, IncompleteRead...
+        log.error("Unable to read locales list")
+        raise NoLocalesError(error)
+    finally:
+        response.close()
+    log.debug('locales: {0}'.format(entries))
+    return entries
+
+
+def get_shipped_locales(locales_url, platform=None):
+    """ returns a tuple containing the list of shipped locales
+        taken from locales_url
+    """
+    entries = get_shipped_locale_entries(locales_url, platform)
+    return tuple(entry.locale for entry in entries)
@@ -1,11 +1,52 @@
 """Log manager
    import this module if you need to log
+   Handlers (see logging.ini) run in a background thread: logging from
+   worker threads only puts the record in a bounded queue.
+   Scripts call setup() once, when they start: importing the library
+   does not configure logging (nor open log/debug.log) and does not
+   import logging.config, so --help, the tests and the benchmarks start
+   faster. Until setup() runs, the records of the library are discarded.
 """
-import logging.config
+import atexit
+import logging
 import os.path
 
+from lib.loghandlers import start_queue, context, current_context
+
 logging_conf = os.path.join(os.path.dirname(__file__), '..', 'logging.ini')
-logging.config.fileConfig(logging_conf)
+
+# records waiting to be written, when the queue is full logging blocks
+QUEUE_SIZE = 10000
+
+__all__ = ['logger', 'setup', 'context', 'current_context']
+
+_listener = None
+
+# no "No handlers could be found" warning before setup()
+logging.getLogger('lib').addHandler(logging.NullHandler())
+
+
+def setup(conf=logging_conf):
+    """configures logging from conf (logging.ini) and moves the handlers
+       in a background thread; calling it again does nothing"""
+    global _listener
+    if _listener is not None:
+        return
+    import logging.config
+    logging.config.fileConfig(conf, disable_existing_loggers=False)
+    root = logging.getLogger()
+    # the root level is raised to the lowest level of the handlers:
+    # records below it are discarded by isEnabledFor(), before they are
+    # created. debug_file (logging.ini) keeps the DEBUG records; without
+    # it, the debug calls of the hot paths (per line, per file, per
+    # command), which pass their arguments instead of calling format(),
+    # cost nothing
+    levels = [handler.level for handler in root.handlers]
+    if levels:
+        root.setLevel(max(root.level, min(levels)))
+    _listener = start_queue(root, QUEUE_SIZE)
+    # runs before logging.shutdown (atexit is last in, first out)
+    atexit.register(_listener.stop)
 
 
 def logger(name):
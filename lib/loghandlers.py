@@ -0,0 +1,133 @@
+"""
+logging handlers (see lib.logger and logging.ini)
+
+ * QueueHandler and QueueListener: worker threads put records in a bounded
+   queue, a background thread formats and writes them
+ * JsonLinesHandler: one json document per record, including the context
+   of the record (repo, step, bug...) set with context()
+"""
+import json
+import logging
+import threading
+import Queue
+from contextlib import contextmanager
+
+_local = threading.local()
+
+# put in the queue to stop QueueListener
+_STOP = object()
+
+
+def current_context():
+    """returns a copy of the log context of the current thread"""
+    return dict(getattr(_local, 'context', {}))
+
+
+@contextmanager
+def context(**fields):
+    """adds fields (e.g. repo='tools', step='patch') to the context of the
+       records logged by the current thread, inside the with block.
+       Threads do not inherit the context: pass current_context() to
+       the new thread"""
+    previous = getattr(_local, 'context', {})
+    _local.context = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+class QueueHandler(logging.Handler):
+    """puts records in a queue, see QueueListener"""
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        """makes the record safe to be handled in another thread: the
+           message is merged with its arguments and the log context of
+           the current thread is attached"""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # formatting the traceback requires the exception objects
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        record.context = current_context()
+        return record
+
+    def emit(self, record):
+        try:
+            # blocks when the queue is full: producers slow down instead
+            # of using unbounded memory
+            self.queue.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """handles the records of a queue in a background thread, passing
+       them to handlers (respecting their levels)"""
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        """handles the records left in the queue and stops the thread"""
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+
+class JsonLinesHandler(logging.FileHandler):
+    """writes a json document per line: time, level, logger, message and
+       the log context (see context())"""
+    def format(self, record):
+        document = {'time': record.created,
+                    'level': record.levelname,
+                    'logger': record.name,
+                    'thread': record.threadName,
+                    'message': record.getMessage()}
+        fields = getattr(record, 'context', None)
+        if fields is None:
+            # synchronous logging: we are in the thread that logged
+            fields = current_context()
+        document.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        return json.dumps(document, sort_keys=True)
+
+
+def start_queue(logger, size):
+    """moves the handlers of logger behind a queue of size records,
+       returns the QueueListener"""
+    handlers = list(logger.handlers)
+    queue = Queue.Queue(size)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(queue))
+    listener = QueueListener(queue, handlers)
+    listener.start()
+    return listener
@@ -0,0 +1,55 @@
+"""
+the list of files to patch for a staging release.
+The manifest is built once per run from the [staging_files] section and it
+can be shared between Patch objects.
+"""
+import os
+
+from lib.logger import logger
+log = logger(__name__)
+
+# staging files needed by every release type
+COMMON_TYPES = ('common_files', 'l10n')
+
+
+class StagingManifest(object):
+    """files to patch for the given release types (e.g. firefox, fennec)"""
+    def __init__(self, configuration, release_types):
+        types = []
+        for release_type in tuple(release_types) + COMMON_TYPES:
+            if release_type not in types:
+                types.append(release_type)
+        self.release_types = tuple(types)
+        paths = []
+        for release_type in self.release_types:
+            for path in configuration.get_list('staging_files', release_type):
+                # get_list keeps empty values between new lines
+                path = path.strip()
+                if not path:
+                    continue
+                path = os.path.normpath(path)
+                if path not in paths:
+                    paths.append(path)
+        self.paths = tuple(paths)
+        # directory => file names, so each directory is listed only once
+        self._directories = {}
+        for path in self.paths:
+            dirname, filename = os.path.split(path)
+            self._directories.setdefault(dirname, set()).add(filename)
+        log.debug('staging manifest: {0}'.format(self.paths))
+
+    def existing(self, checkout_dir):
+        """returns the sorted list of absolute paths of the manifest files
+           that exist in checkout_dir"""
+        found = []
+        for dirname, filenames in self._directories.items():
+            directory = os.path.join(checkout_dir, dirname)
+            try:
+                present = set(os.listdir(directory))
+            except OSError as error:
+                log.debug('cannot list {0}: {1}'.format(directory, error))
+                continue
+            for filename in filenames & present:
+                found.append(os.path.join(directory, filename))
+        found.sort()
+        return found
@@ -1,11 +1,17 @@
 """creates and cofigures a staging master"""
 import os
-import sh
+import shutil
 import subprocess
-from lib.venv import Virtualenv
+from lib.venv import Virtualenv, VirtualenvError
+from lib.capture import OutputCapture
 from lib.repositories import Repository, RepositoryError
+from lib.state import section_values, requirements_fingerprint, \
+    file_fingerprint
+import lib.deadline as deadline
+from lib.lazy import lazy_import
 from lib.logger import logger
 log = logger(__name__)
+sh = lazy_import('sh')
 
 
 class MasterError(Exception):
@@ -22,16 +28,98 @@ class Master(object):
                                                        'buildbot_configs_repo')
         self.venv = None
 
-    def install(self):
-        """installs buildbot master"""
-        self._prepare_dirs()
+    def install(self, state=None, virtualenv=None):
+        """installs buildbot master
+           if state (a ProvisioningState) is provided, steps with the same
+           inputs of the previous run are skipped
+           virtualenv is the path of an optional pre-built, relocatable,
+           virtualenv: it becomes the master basedir
+        """
+        if state is not None:
+            self._install_incremental(state, virtualenv)
+            return
+        if virtualenv is not None:
+            self._adopt_virtualenv(virtualenv)
+        else:
+            self._prepare_dirs()
         log.info('installing buildbot master')
-        self.virtualenv()
+        if virtualenv is not None:
+            self._attach_virtualenv()
+        else:
+            self.virtualenv()
         self.install_buildbot()
         self.deps()
         self.master()
         self.master_makefile()
 
+    def _install_incremental(self, state, virtualenv=None):
+        """installs buildbot master, re-running only the steps whose
+           inputs have changed"""
+        conf = self.configuration
+        log.info('installing buildbot master')
+        prepare_dirs = self._prepare_dirs
+        create_virtualenv = self.virtualenv
+        if virtualenv is not None:
+            prepare_dirs = lambda: self._adopt_virtualenv(virtualenv)
+            create_virtualenv = self._attach_virtualenv
+        state.run('master:dirs', [self.basedir], prepare_dirs,
+                  verify=lambda: os.path.isdir(self.basedir))
+        venv_inputs = [section_values(conf, 'virtualenv'),
+                       conf.get_list('master', 'virtualenv_extra_args')]
+        state.run('master:virtualenv', venv_inputs, create_virtualenv,
+                  requires=('master:dirs',), verify=self._has_virtualenv)
+        if self.venv is None:
+            self.venv = Virtualenv(conf)
+            self.venv.attach(self.basedir)
+        state.run('master:repositories', self._repositories_inputs(),
+                  self._clone_repositories, requires=('master:dirs',),
+                  verify=self._has_repositories)
+        buildbot_inputs = [section_values(conf, 'master'),
+                           file_fingerprint(conf.get('master',
+                                                     'json_template'))]
+        state.run('master:buildbot', buildbot_inputs, self._setup_buildbot,
+                  requires=('master:virtualenv', 'master:repositories'))
+        req = [line.strip() for line in
+               conf.get_list('master', 'virtualenv_requirements')]
+        state.run('master:deps', requirements_fingerprint(req), self.deps,
+                  requires=('master:virtualenv', 'master:repositories'))
+        state.run('master:create', conf.get_list('master', 'create_master'),
+                  self.master, requires=('master:buildbot', 'master:deps'))
+        makefile_inputs = [conf.get('master', 'buildbot_configs_dir'),
+                           self.basedir]
+        state.run('master:makefile', makefile_inputs, self.master_makefile,
+                  requires=('master:repositories',))
+
+    def _has_virtualenv(self):
+        """returns True if the master virtualenv python exists"""
+        venv = Virtualenv(self.configuration)
+        venv.attach(self.basedir)
+        return os.path.exists(venv._python_path())
+
+    def _has_repositories(self):
+        """returns True if all the master repositories are cloned"""
+        for repo in self.configuration.get_list('master', 'repositories'):
+            dst_dir = os.path.join(self.basedir,
+                                   self._to_canonical_name(repo))
+            if not os.path.isdir(os.path.join(dst_dir, '.hg')):
+                return False
+        return True
+
+    def _repositories_inputs(self):
+        """returns the master repositories and their remote revisions"""
+        conf = self.configuration
+        clone_from = conf.get('master', 'clone_from')
+        inputs = []
+        for name in conf.get_list('master', 'repositories'):
+            repo = Repository(conf, name)
+            try:
+                revision = repo.remote_revision(clone_from=clone_from)
+            except RepositoryError as error:
+                log.error(error)
+                raise MasterError(error)
+            inputs.append((name, repo.url(clone_from), revision))
+        return inputs
+
     def master(self):
         """make master target"""
         config = self.configuration
@@ -39,10 +127,11 @@ class Master(object):
         cmd = [line.strip() for line in cmd]
         cwd = os.path.join(self.basedir, 'buildbot-configs')
         script = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE)
-        while True:
-            log.debug(script.stdout.readline().strip())
-            if script.poll() is not None:
-                break
+        returncode = OutputCapture('create master').feed_process(script,
+                                                                'command')
+        if returncode != 0:
+            msg = 'create master failed: exit code {0}'.format(returncode)
+            raise MasterError(msg)
 
     def _prepare_dirs(self):
         """creates required directories
@@ -56,6 +145,31 @@ class Master(object):
             log.debug(msg)
             raise MasterError(msg)
 
+    def _adopt_virtualenv(self, virtualenv):
+        """moves a pre-built virtualenv to basedir
+           rises a MasterError if basedir already exists"""
+        if os.path.exists(self.basedir):
+            msg = 'Cannot create: {0} (already exists)'.format(self.basedir)
+            log.debug(msg)
+            raise MasterError(msg)
+        log.info('using pre-built virtualenv {0}'.format(virtualenv))
+        parent = os.path.dirname(self.basedir)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        try:
+            # same filesystem: instant, otherwise a copy
+            shutil.move(virtualenv, self.basedir)
+        except (OSError, IOError) as error:
+            msg = 'Cannot move {0} to {1} ({2})'.format(virtualenv,
+                                                       self.basedir, error)
+            log.debug(msg)
+            raise MasterError(msg)
+
+    def _attach_virtualenv(self):
+        """uses the virtualenv in basedir"""
+        self.venv = Virtualenv(self.configuration)
+        self.venv.attach(self.basedir)
+
     def _to_canonical_name(self, repo_name):
         """transforms user's repository name in standard repository names
            e.g. tools-9999 => tools
@@ -81,15 +195,16 @@ class Master(object):
 
     def start(self):
         """starts a master instance"""
-        sh.make('start', _cwd=self.basedir)
+        deadline.run_command('command', sh.make, 'start', _cwd=self.basedir)
 
     def stop(self):
         """stops a master instance"""
-        sh.make('stops', _cwd=self.basedir)
+        deadline.run_command('command', sh.make, 'stops', _cwd=self.basedir)
 
     def checkconfig(self):
         """checks master configuration"""
-        sh.make('checkconfig', _cwd=self.basedir)
+        deadline.run_command('command', sh.make, 'checkconfig',
+                             _cwd=self.basedir)
 
     def _clone_hg_repo(self, name, dst_dir, branch='default'):
         """clone repository name to dst_dir
@@ -99,6 +214,10 @@ class Master(object):
         try:
             repo = Repository(conf, name)
             clone_from = conf.get('master', 'clone_from')
+            if os.path.isdir(os.path.join(dst_dir, '.hg')):
+                # already cloned by a previous run
+                repo.refresh_locally(dst_dir, branch)
+                return
             repo.clone_locally(dst_dir, branch, clone_from)
         except RepositoryError as error:
             log.error(error)
@@ -109,7 +228,11 @@ class Master(object):
         conf = self.configuration
         extra_args = conf.get_list('master', 'virtualenv_extra_args')
         venv = Virtualenv(conf)
-        venv.create(self.basedir, extra_args)
+        try:
+            venv.create(self.basedir, extra_args)
+        except VirtualenvError as error:
+            log.error(error)
+            raise MasterError(error)
         self.venv = venv
 
     def deps(self):
@@ -120,11 +243,20 @@ class Master(object):
         venv = self.venv
         if len(req) == 1:
             req = req[0]
-        venv.install_dependencies(req)
+        try:
+            venv.install_dependencies(req)
+        except VirtualenvError as error:
+            log.error(error)
+            raise MasterError(error)
 
     def install_buildbot(self):
         """make intall-buildbot target"""
         self._clone_repositories()
+        self._setup_buildbot()
+
+    def _setup_buildbot(self):
+        """generates master json, installs buildbot in the virtualenv and
+           adds buildbotcustom and tools to its PYTHONPATH"""
         conf = self.configuration
         json_template = conf.get('master', 'json_template')
         dst_json = conf.get('master', 'dst_json')
@@ -134,7 +266,11 @@ class Master(object):
         args = [option.strip() for option in args]
         setup_py = conf.get('master', 'setup_py')
         venv = self.venv
-        venv.setup_py(setup_py, args)
+        try:
+            venv.setup_py(setup_py, args)
+        except VirtualenvError as error:
+            log.error(error)
+            raise MasterError(error)
         # Get buildbotcustom and the build/tools library into PYTHONPATH
         # ln -sf $(BASEDIR)/buildbotcustom $(SITE_PACKAGES)/buildbotcustom
         site_packages = conf.get('master', 'site_packages')
@@ -145,7 +281,7 @@ class Master(object):
         # echo $BASEDIR/tools/lib/python > SITE_PACKAGES/build-tools-lib.pth
         pth_file = conf.get('master', 'pth_file')
         tools_python = conf.get('master', 'tools_python')
-        with open(pth_file, 'a') as p_file:
+        with open(pth_file, 'w') as p_file:
             p_file.write(tools_python)
 
     def master_makefile(self):
@@ -162,6 +298,9 @@ class Master(object):
         # add windows support?
         # this should be a function not a method, create a base lib
         log.debug('creating symlink: {0} => {1}'.format(src, dst))
+        if os.path.islink(dst):
+            # left by a previous run
+            os.remove(dst)
         os.symlink(src, dst)
 
 
@@ -0,0 +1,322 @@
+"""
+micro-benchmarks of the in-process hot paths: patch_map, the rewrite of
+the buildbot-configs files (Patch._update_file), generate_master_json,
+Config read_from/get_list/write_to on every config/*.ini, tag_name,
+to_mozilla and ports.available_in_range.
+Inputs are fixed; every benchmark runs warmup samples, then repeat timed
+samples, and reports min, median, mean, standard deviation and max of a
+call. A calibration loop is timed before every sample: compare() uses
+the minimums (the least noisy statistic) relative to the calibration of
+the same benchmark, so results of different hosts, or of a busy host,
+are comparable.
+Debug logging is disabled while timing, it's the I/O of another thread.
+
+import_times() measures the start up of the command line tools instead:
+the import of their modules, in a new interpreter (min of some runs,
+without the interpreter start up). python 2.7 has no -X importtime.
+"""
+import glob
+import logging
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from lib.config import Config, ConfigError
+from lib.patch import Patch, patch_map
+from lib.master import generate_master_json
+from lib.repositories import tag_name, to_mozilla
+from lib.history import median
+from lib.benchmark import MASTER_JSON_TEMPLATE, REPO_DIR
+import lib.ports as ports
+from lib.logger import logger
+log = logger(__name__)
+
+# default baseline, see benchmark.py micro
+BASELINE = os.path.join(REPO_DIR, 'tests', 'microbench_baseline.json')
+WARMUP = 3
+REPEAT = 20
+# a minimum this much slower (0.25 = 25%) than the baseline is a regression
+THRESHOLD = 0.25
+
+USERNAME = 'bench'
+TRACKING_BUG = '1000000'
+VERSION = '33.0b1'
+# files rewritten by the patch benchmark and lines in each of them
+PATCHED_FILES = 8
+PATCHED_LINES = 800
+# masters in the production-masters.json template
+MASTERS = 100
+
+# milliseconds allowed to import the modules of the command line tools,
+# see import_times(); sh and logging.config are imported when needed
+IMPORT_BUDGET = {'lib.config': 30,
+                 'lib.staging': 60,
+                 'lib.daemon': 70,
+                 'lib.benchmark': 100}
+IMPORT_REPEAT = 7
+
+
+class Case(object):
+    """a micro-benchmark: a sample times number calls of function,
+       setup (if any) runs before every sample, teardown after it; they
+       are not timed"""
+    def __init__(self, name, function, number=1, setup=None, teardown=None):
+        self.name = name
+        self.function = function
+        self.number = number
+        self.setup = setup
+        self.teardown = teardown
+
+    def sample(self):
+        """returns the seconds of a call of function"""
+        if self.setup is not None:
+            self.setup()
+        function = self.function
+        start = timeit.default_timer()
+        for _ in xrange(self.number):
+            function()
+        seconds = (timeit.default_timer() - start) / self.number
+        if self.teardown is not None:
+            self.teardown()
+        return seconds
+
+    def run(self, warmup=WARMUP, repeat=REPEAT, calibration=None):
+        """returns the summary of repeat samples, after warmup samples.
+           If calibration (a Case) is set, it's sampled before every
+           sample and its minimum is added to the summary"""
+        for _ in xrange(warmup):
+            self.sample()
+        samples = []
+        calibrations = []
+        for _ in xrange(repeat):
+            if calibration is not None:
+                calibrations.append(calibration.sample())
+            samples.append(self.sample())
+        result = summary(samples)
+        if calibrations:
+            result['calibration'] = min(calibrations)
+        return result
+
+
+def summary(samples):
+    """returns the statistics of samples (seconds)"""
+    mean = sum(samples) / len(samples)
+    variance = sum((sample - mean) ** 2 for sample in samples)
+    if len(samples) > 1:
+        variance /= len(samples) - 1
+    return {'samples': len(samples),
+            'min': min(samples),
+            'median': median(samples),
+            'mean': mean,
+            'stdev': math.sqrt(variance),
+            'max': max(samples)}
+
+
+def _calibration():
+    total = 0
+    for number in xrange(10000):
+        total += number * number
+    return total
+
+
+def release_config(name, lines=PATCHED_LINES):
+    """returns the (fixed) text of a buildbot-configs release file: mostly
+       plain settings, every tenth line a repository path"""
+    repos = ('build/tools', 'build/buildbot', 'build/buildbotcustom',
+             'build/mozharness', 'build/partner-repacks',
+             'build/compare-locales', 'build/buildbot-configs',
+             'releases/mozilla-beta', 'users/stage-ffxbld',
+             'raw-file/default/build/tools')
+    text = ['# {0}\n'.format(name)]
+    for line in xrange(lines):
+        if line % 10:
+            text.append("releaseConfig['setting_{0}'] = {1}\n".format(
+                line, line * 7))
+        else:
+            text.append("releaseConfig['repo_{0}'] = '{1}'\n".format(
+                line, repos[(line // 10) % len(repos)]))
+    return ''.join(text)
+
+
+class Suite(object):
+    """the micro-benchmarks, with their fixtures in workdir"""
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.config_files = sorted(glob.glob(os.path.join(REPO_DIR, 'config',
+                                                          '*.ini')))
+        self.config = self._read(os.path.join(REPO_DIR, 'config',
+                                              'staging-beta33.ini'))
+        self.config.set('common', 'username', USERNAME)
+        self.config.set('common', 'tracking_bug', TRACKING_BUG)
+        self.repo_names = self.config.get_list('patch-buildbot-configs',
+                                               'replace')
+        self.originals = os.path.join(workdir, 'originals')
+        self.patched = os.path.join(workdir, 'patched')
+        os.makedirs(self.originals)
+        for index in xrange(PATCHED_FILES):
+            name = 'release-firefox-{0}.py'.format(index)
+            with open(os.path.join(self.originals, name), 'w') as out:
+                out.write(release_config(name))
+        self.template = os.path.join(workdir, 'masters.json.in')
+        with open(self.template, 'w') as out:
+            out.write(MASTER_JSON_TEMPLATE * MASTERS)
+
+    def _read(self, filename):
+        """returns the configuration in filename, its ports released"""
+        reserved = ports.reserved()
+        config = Config()
+        config.read_from(filename)
+        ports.release(*(ports.reserved() - reserved))
+        return config
+
+    def _restore_patched(self):
+        if os.path.exists(self.patched):
+            shutil.rmtree(self.patched)
+        shutil.copytree(self.originals, self.patched)
+
+    def _patch_files(self):
+        # same loops as Patch.update_configs
+        patch = Patch(self.config, ['firefox'], 'patch-buildbot-configs')
+        repos = patch_map(self.repo_names, USERNAME, TRACKING_BUG)
+        files = [os.path.join(self.patched, name)
+                 for name in sorted(os.listdir(self.patched))]
+        for repo in repos:
+            mozilla_repo, user_repo = repos[repo]
+            for filename in files:
+                patch._update_file(filename, mozilla_repo, user_repo)
+
+    def _config_cases(self, filename):
+        name = os.path.basename(filename)
+        config = self._read(filename)
+        options = []
+        for section in config.sections():
+            for option in config.options(section):
+                try:
+                    config.get_list(section, option)
+                except ConfigError:
+                    # e.g. broken interpolations in unused options
+                    continue
+                options.append((section, option))
+        dst = os.path.join(self.workdir, name)
+
+        def _get_lists():
+            for section, option in options:
+                config.get_list(section, option)
+
+        return [Case('config.read_from {0}'.format(name),
+                     lambda: self._read(filename)),
+                Case('config.get_list {0}'.format(name), _get_lists,
+                     number=10),
+                Case('config.write_to {0}'.format(name),
+                     lambda: config.write_to(dst), number=10)]
+
+    def cases(self):
+        """returns the list of Case"""
+        user_repo = 'https://hg.mozilla.org/users/{0}_mozilla.com/' \
+                    'tools-{1}'.format(USERNAME, TRACKING_BUG)
+        master_json = os.path.join(self.workdir, 'masters.json')
+        http_base = int(self.config.get('port_ranges', 'master_http'))
+        range_size = int(self.config.get('port_ranges', 'range_size'))
+        cases = [
+            Case('patch_map', lambda: patch_map(self.repo_names, USERNAME,
+                                                TRACKING_BUG),
+                 number=1000),
+            Case('patch._update_file', self._patch_files,
+                 setup=self._restore_patched),
+            Case('generate_master_json',
+                 lambda: generate_master_json(self.config, self.template,
+                                              master_json),
+                 number=10),
+            Case('tag_name', lambda: tag_name(VERSION, ['firefox', 'fennec']),
+                 number=10000),
+            Case('to_mozilla', lambda: to_mozilla(user_repo, TRACKING_BUG),
+                 number=10000),
+            Case('ports.available_in_range',
+                 lambda: ports.available_in_range(http_base,
+                                                  http_base + range_size)),
+        ]
+        for filename in self.config_files:
+            cases.extend(self._config_cases(filename))
+        return cases
+
+
+def run(names=None, warmup=WARMUP, repeat=REPEAT):
+    """runs the micro-benchmarks (the ones whose name contains any of
+       names, if set), returns the report"""
+    workdir = tempfile.mkdtemp(prefix='staging-microbench-')
+    calibration = Case('calibration', _calibration, number=10)
+    results = {}
+    logging.disable(logging.DEBUG)
+    try:
+        for case in Suite(workdir).cases():
+            if names and not any(name in case.name for name in names):
+                continue
+            results[case.name] = case.run(warmup, repeat, calibration)
+            log.info('{0}: median {1:.6f}s'.format(
+                case.name, results[case.name]['median']))
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(workdir)
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'warmup': warmup,
+            'repeat': repeat,
+            'benchmarks': results}
+
+
+def compare(baseline, report, threshold=THRESHOLD):
+    """returns the list of (name, baseline minimum, minimum, change in
+       percent, regression) of the benchmarks in baseline and report.
+       The minimums of report are scaled by the calibration, if both
+       have it"""
+    old = baseline['benchmarks']
+    new = report['benchmarks']
+    rows = []
+    for name in sorted(new):
+        if name not in old:
+            continue
+        scale = 1.0
+        if old[name].get('calibration') and new[name].get('calibration'):
+            scale = old[name]['calibration'] / new[name]['calibration']
+        before = old[name]['min']
+        after = new[name]['min'] * scale
+        change = 100.0 * (after - before) / before if before else 0.0
+        rows.append((name, before, after, change,
+                     change > threshold * 100))
+    return rows
+
+
+def _import_seconds(module):
+    """returns the seconds to start python and import module (None: just
+       start python)"""
+    code = 'import {0}'.format(module) if module else 'pass'
+    start = timeit.default_timer()
+    subprocess.check_call((sys.executable, '-c', code), cwd=REPO_DIR)
+    return timeit.default_timer() - start
+
+
+def import_times(modules=None, repeat=IMPORT_REPEAT):
+    """returns a dictionary module: milliseconds of the import of module
+       in a new interpreter (IMPORT_BUDGET modules by default)"""
+    modules = sorted(modules or IMPORT_BUDGET)
+    startup = min(_import_seconds(None) for _ in xrange(repeat))
+    times = {}
+    for module in modules:
+        seconds = min(_import_seconds(module) for _ in xrange(repeat))
+        times[module] = max(seconds - startup, 0.0) * 1000
+    return times
+
+
+def over_budget(times, budget=IMPORT_BUDGET):
+    """returns the list of (module, milliseconds, budget) of times over
+       their budget"""
+    return [(module, times[module], budget[module])
+            for module in sorted(times)
+            if module in budget and times[module] > budget[module]]
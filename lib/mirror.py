@@ -0,0 +1,80 @@
+"""
+local mirrors of remote hg repositories.
+A mirror is a bare clone (no working directory) refreshed at most once per
+process; checkouts are cloned from the mirror and then pulled from their
+own repository, so only the changesets missing from the mirror travel on
+the network. Mirrors can be shared by several staging environments.
+"""
+import os
+import re
+import threading
+import time
+
+from lib.capture import OutputCapture
+
+import lib.deadline as deadline
+from lib.lazy import lazy_import
+from lib.logger import logger
+log = logger(__name__)
+sh = lazy_import('sh')
+
+# url => lock, url => time of the last refresh by this process
+_locks = {}
+_locks_lock = threading.Lock()
+_refreshed = {}
+
+
+class MirrorError(Exception):
+    """Generic Mirror error"""
+    pass
+
+
+def _lock_for(url):
+    """returns the lock protecting the mirror of url"""
+    with _locks_lock:
+        return _locks.setdefault(url, threading.Lock())
+
+
+class MirrorCache(object):
+    """mirrors of remote repositories, stored in basedir"""
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+    def path(self, url):
+        """returns the local path of the mirror of url"""
+        name = url.split('://', 1)[-1]
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('_')
+        return os.path.join(self.basedir, name)
+
+    def refresh(self, url, max_age=None):
+        """creates or updates the mirror of url and returns its path.
+           The mirror is updated once per process or, if max_age is set,
+           when the last update is older than max_age seconds"""
+        path = self.path(url)
+        with _lock_for(url):
+            last = _refreshed.get(url)
+            if last is not None and \
+               (max_age is None or time.time() - last < max_age):
+                return path
+            if os.path.isdir(os.path.join(path, '.hg')):
+                log.info('updating mirror of {0}'.format(url))
+                cmd = ('pull', url)
+                cwd = path
+            else:
+                log.info('creating mirror of {0}'.format(url))
+                if not os.path.isdir(self.basedir):
+                    os.makedirs(self.basedir)
+                cmd = ('clone', '--noupdate', url, path)
+                cwd = self.basedir
+            try:
+                with OutputCapture('hg {0}'.format(cmd[0])) as output:
+                    for line in deadline.command_lines('clone', sh.hg, cmd,
+                                                       _cwd=cwd):
+                        output.feed(line)
+            except sh.ErrorReturnCode as error:
+                msg = 'mirror failed: hg {0} - {1}'.format(' '.join(cmd),
+                                                          error)
+                log.debug(msg)
+                raise MirrorError(msg)
+            _refreshed[url] = time.time()
+        return path
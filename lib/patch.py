@@ -1,46 +1,91 @@
 """Updates user's repository configuration files"""
 
+import functools
 import os
 import shutil
 import tempfile
+import threading
 import time
-from lib.logger import logger
+from lib.logger import logger, context, current_context
 from lib.repositories import Repository
 from lib.download import download, DownloadError
 from lib.master import generate_master_json
 from lib.config import ConfigError
+from lib.workingcopy import WorkingCopy, WorkingCopyError
+from lib.manifest import StagingManifest
+from lib.scanner import find_in_tree
+from lib.trace import span
 log = logger(__name__)
 
 
+# steps reported by PatchRunner, in execution order
+PATCH_STEPS = ('clone', 'rewrite', 'audit', 'commit', 'push')
+# seconds hg.mozilla.org needs to publish new user repositories and pushes
+REPLICATION_DELAY = 20
+
+
 class PatchError(Exception):
     """Generic Patch error"""
     pass
 
 
+def timed(step):
+    """decorator: adds the time spent in a Patch method to
+       self.timings[step] and records it as a trace span"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.time()
+            try:
+                with span(step, 'patch', repo=self.name):
+                    return method(self, *args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                self.timings[step] = self.timings.get(step, 0) + elapsed
+        return wrapper
+    return decorator
+
+
 class Patch(object):
     """
     Updates user's repositories so configuration points to the right location
     """
-    def __init__(self, configuration, release_type, name):
+    def __init__(self, configuration, release_type, name, manifest=None):
         assert isinstance(release_type, (list, tuple))
         self.release_type = list(release_type)
+        # manifest can be shared between patches, see StagingManifest
+        self.manifest = manifest
         self.name = name
         # this property references a repo object
         self.repository = None
         self.tokens = None
         self.configuration = configuration
         self.dst_dir = None
+        self.working_copy = None
+        # step => seconds, see timed()
+        self.timings = {}
 
+    @timed('clone')
     def clone(self, repository, branch):
         """clone repository locally"""
-        self._create_temp_dir()
-        log.debug('temporary directory: {0}'.format(self.dst_dir))
         repo = Repository(self.configuration, repository)
+        working_copies = self._working_copies_dir()
+        if working_copies:
+            self._open_working_copy(working_copies, repository, branch)
+            if self.working_copy.exists():
+                log.info('refreshing: {0}'.format(repository))
+                repo.refresh_locally(self.dst_dir, branch=branch)
+                self.repository = repo
+                return
+        else:
+            self._create_temp_dir()
+        log.debug('working directory: {0}'.format(self.dst_dir))
         log.info('cloning: {0}'.format(repository))
         # release runner reads from production branch and commits to default
         repo.clone_locally(self.dst_dir, branch=branch, clone_from='user')
         self.repository = repo
 
+    @timed('rewrite')
     def update_configs(self):
         """
         updates user repository to use just created repositories
@@ -59,25 +104,72 @@ class Patch(object):
                 # for every file...
                 self._update_file(conf_in, mozilla_repo, user_repo)
 
+    @timed('audit')
+    def audit(self):
+        """checks that no mozilla repository from patch_map is still
+           referenced in the working copy (all of it, not just the staging
+           files) and raises a PatchError if any is found"""
+        conf = self.configuration
+        username = conf.get('common', 'username')
+        bug = conf.get('common', 'tracking_bug')
+        repo_names = conf.get_list(self.name, 'replace')
+        # mozilla repo => patch_map keys
+        sources = {}
+        for name, (mozilla_repo, user_repo) in patch_map(repo_names, username,
+                                                         bug).items():
+            sources.setdefault(mozilla_repo, []).append(name)
+        try:
+            exclude = conf.get_list(self.name, 'audit_exclude')
+        except ConfigError:
+            exclude = []
+        log.info('auditing {0}'.format(self.dst_dir))
+        # raw-file lines are not patched, see _update_file
+        hits = find_in_tree(self.dst_dir, sources.keys(), exclude=exclude,
+                            skip_lines_with='raw-file')
+        for filename, lineno, match, line in hits:
+            filename = os.path.relpath(filename, self.dst_dir)
+            names = ', '.join(sorted(sources[match]))
+            log.error('{0}:{1}: {2} - {3}'.format(filename, lineno, names,
+                                                  line))
+        if hits:
+            msg = 'audit failed: {0} references to mozilla repositories'
+            msg = '{0} left in {1}'.format(msg.format(len(hits)),
+                                           self.dst_dir)
+            raise PatchError(msg)
+
+    def _audit_enabled(self):
+        """returns True if the audit option of this patch is set"""
+        try:
+            audit = self.configuration.get(self.name, 'audit')
+        except ConfigError:
+            return False
+        return audit.strip().lower() in ('1', 'yes', 'true', 'on')
+
     def _update_file(self, filename, src, dst):
-        log.debug('patching: {0}'.format(filename))
+        log.debug('patching: %s', filename)
         out = []
         with open(filename, 'r') as f_in:
             for line in f_in:
                 if src in line:
                     if 'raw-file' not in line:
                         log.debug(line)
-                        log.debug('{0} => {1}'.format(src, dst))
+                        log.debug('%s => %s', src, dst)
                         line = line.replace(src, dst)
                     log.debug(line)
                 out.append(line)
 
         # write file before
-        log.debug('writing changes to: {0}'.format(filename))
-        with open(filename, 'w') as out_f:
+        log.debug('writing changes to: %s', filename)
+        # replaced, not modified in place: the checkout may be hard linked
+        # to a snapshot (see lib.snapshot)
+        temp_path = '{0}.patching'.format(filename)
+        with open(temp_path, 'w') as out_f:
             for line in out:
                 out_f.write(line)
+        shutil.copymode(filename, temp_path)
+        os.rename(temp_path, filename)
 
+    @timed('commit')
     def commit_changes(self):
         """executes hg commit on the local repository"""
         conf = self.configuration
@@ -87,6 +179,39 @@ class Patch(object):
         repo.commit(commit_msg)
         repo.tag(tag='default')
 
+    def _working_copies_dir(self):
+        """returns the directory where persistent working copies are kept,
+           None if working copies are not enabled for this patch"""
+        try:
+            return self.configuration.get(self.name, 'working_copies') or None
+        except ConfigError:
+            return None
+
+    def _open_working_copy(self, basedir, repository, branch):
+        """locks the working copy for repository/branch and uses it as
+           dst_dir"""
+        # a previous clone() may still hold a working copy
+        self._release_working_copy()
+        working_copy = WorkingCopy(basedir, repository, branch)
+        try:
+            working_copy.acquire()
+        except WorkingCopyError as error:
+            raise PatchError(error)
+        if not working_copy.exists() and os.path.exists(working_copy.path):
+            # left over of a failed clone, start from scratch
+            log.debug('removing stale working copy: {0}'.format(
+                working_copy.path))
+            shutil.rmtree(working_copy.path)
+        self.working_copy = working_copy
+        self.dst_dir = working_copy.path
+        log.debug('using working copy: {0}'.format(self.dst_dir))
+
+    def _release_working_copy(self):
+        """releases the lock on the current working copy, if any"""
+        if self.working_copy is not None:
+            self.working_copy.release()
+            self.working_copy = None
+
     def _create_temp_dir(self):
         """creates a temporary directory"""
         self.dst_dir = tempfile.mkdtemp()
@@ -102,30 +227,27 @@ class Patch(object):
             log.debug('Patch: failed to delete temporary directory')
             log.debug(error)
 
+    @timed('push')
     def push_changes(self):
-        """push changes to remote and deletes temp repo"""
+        """push changes to remote and deletes temp repo (working copies
+           are kept)"""
         log.info('pushing changes to remote')
         repo = self.repository
         repo.push()
-        self._delete_temp_dir()
+        if self.working_copy is not None:
+            # keep the checkout for the next run
+            self._release_working_copy()
+        else:
+            self._delete_temp_dir()
 
     def _files_to_update(self):
         """returns a list of files to update"""
-        config = self.configuration
-        files = self.release_type
-        files.append('common_files')
-        files.append('l10n')
-        staging_files = []
-        for element in files:
-            config_files = config.get_list('staging_files', element)
-            log.debug(config_files)
-            staging_files.extend(config_files)
-        # get the absolute path
-        staging_files = [os.path.join(self.dst_dir, f) for f in staging_files]
-        # remove not existing files
-        staging_files = [f for f in staging_files if os.path.exists(f)]
-        log.debug('files to be patched: {0}'.format(set(staging_files)))
-        return set(staging_files)
+        if self.manifest is None:
+            self.manifest = StagingManifest(self.configuration,
+                                            self.release_type)
+        staging_files = self.manifest.existing(self.dst_dir)
+        log.debug('files to be patched: {0}'.format(staging_files))
+        return staging_files
 
     def _absoulute_path(self, filename):
         """returns the absolute path from the dst_dir"""
@@ -142,6 +264,28 @@ class Patch(object):
             log.debug('{0} has no tokens'.format(self.name))
             self.tokens = []
 
+    def created_steps(self, journal):
+        """returns the journal steps that created the repositories patched
+           by this patch (see Repositories.prepare_user_repos)"""
+        try:
+            repositories = self.configuration.get_list(self.name,
+                                                       'repositories')
+        except ConfigError:
+            repositories = []
+        steps = ['{0}:created'.format(name) for name in repositories]
+        return [step for step in steps if journal.is_completed(step)]
+
+    def wait_for_replication(self):
+        """waits common:replication_delay seconds (default:
+           REPLICATION_DELAY), 0 for local repositories"""
+        try:
+            delay = self.configuration.get('common', 'replication_delay')
+        except ConfigError:
+            delay = None
+        if not delay:
+            delay = REPLICATION_DELAY
+        time.sleep(float(delay))
+
     def fix(self):
         """patches, commits and pushes changes to the repository
            needs to be implemented in a sub-class
@@ -154,14 +298,15 @@ class PatchBuildbotConfigs(Patch):
     def fix(self):
         """clones, updates, commit and pushes the your repo"""
         log.info('running {0}'.format(self.name))
-        # sleep 20 sec
-        time.sleep(20)
+        self.wait_for_replication()
         for branch in ('default', 'production'):
             self.clone('buildbot-configs', branch)
             self.update_configs()
+            if self._audit_enabled():
+                self.audit()
             self.commit_changes()
             # self.push_changes()
-            time.sleep(20)
+            self.wait_for_replication()
 
 
 class PatchTools(Patch):
@@ -169,17 +314,24 @@ class PatchTools(Patch):
     def fix(self):
         """creates production_master.json"""
         log.info('running {0}'.format(self.name))
-        time.sleep(20)
+        self.wait_for_replication()
+        # clone the tools repository
+        # tools has no 'production' branch...
+        self.clone('tools', 'default')
+        self.update_production_masters()
+        # commit the changes
+        self.commit_changes()
+        self.push_changes()
+
+    @timed('rewrite')
+    def update_production_masters(self):
+        """writes production_master.json in the local checkout"""
         conf = self.configuration
         # production master
         pm_json_url = conf.get(self.name, 'src_production_masters_json')
         # get relative production-masters.json dst
         pm_json_dst = conf.get(self.name, 'dst_production_masters_json')
         log.info('*** pm_json_dst = {0}'.format(pm_json_dst))
-
-        # clone the tools repository
-        # tools has no 'production' branch...
-        self.clone('tools', 'default')
         # we need to download src_production_masters_json in a temp file
         # because the file needs some detokenization (generate_master_json
         # does it)
@@ -201,9 +353,65 @@ class PatchTools(Patch):
         # remove temp_pm_json
         os.remove(temp_pm_json)
 
-        # commit the changes
-        self.commit_changes()
-        self.push_changes()
+
+class PatchRunner(object):
+    """runs Patch objects concurrently, each one in its own thread and
+       working directory; patches share the (read only) configuration"""
+    def __init__(self):
+        self.patches = []
+
+    def register(self, patch):
+        """adds a patch to the runner"""
+        self.patches.append(patch)
+
+    def run(self, journal=None):
+        """runs fix() on every registered patch and waits for all of them.
+           Logs the time spent by each patch in each step and raises a
+           PatchError listing every failed patch.
+           With a journal (see lib.journal) patches already pushed are
+           skipped, unless their repositories have been created again"""
+        errors = {}
+        parent_context = current_context()
+
+        def _fix(patch):
+            try:
+                with context(**dict(parent_context, repo=patch.name)):
+                    if journal is None:
+                        patch.fix()
+                        return
+                    journal.run('patch:{0}'.format(patch.name), patch.fix,
+                                requires=patch.created_steps(journal))
+            except Exception as error:
+                # exceptions do not cross thread boundaries, keep them
+                log.debug('{0} failed: {1}'.format(patch.name, error))
+                errors[patch.name] = error
+
+        threads = []
+        for patch in self.patches:
+            thread = threading.Thread(target=_fix, args=(patch,),
+                                      name=patch.name)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        self.report()
+        if errors:
+            msg = ['{0}: {1}'.format(name, errors[name])
+                   for name in sorted(errors)]
+            msg = 'failed patches - {0}'.format('; '.join(msg))
+            log.error(msg)
+            raise PatchError(msg)
+
+    def report(self):
+        """logs the time spent by each patch in each step"""
+        for patch in self.patches:
+            durations = ['{0} {1:.1f}s'.format(step, patch.timings[step])
+                         for step in PATCH_STEPS if step in patch.timings]
+            total = sum(patch.timings.values())
+            log.info('{0}: {1} (total {2:.1f}s)'.format(patch.name,
+                                                        ', '.join(durations),
+                                                        total))
 
 
 def patch_map(repository_names, username, tracking_bug):
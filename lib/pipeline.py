@@ -0,0 +1,214 @@
+"""
+runs the staging release steps as a dependency graph.
+A step starts as soon as all the steps it requires are completed, so
+independent steps (e.g. ship it and the buildbot master) run concurrently.
+Ctrl-C and the run deadline cancel the pipeline (see lib.deadline): the
+running steps are stopped and no other step starts.
+"""
+import threading
+import time
+
+import lib.deadline as deadline
+from lib.logger import logger, context, current_context
+from lib.trace import span
+log = logger(__name__)
+
+# seconds between two checks of the deadline, and of Ctrl-C: a wait
+# without timeout cannot be interrupted
+POLL = 1
+
+
+class PipelineError(Exception):
+    """Generic Pipeline error"""
+    pass
+
+
+class Step(object):
+    """a named unit of work: function is called with no arguments"""
+    def __init__(self, name, function, requires=()):
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+        self.start = None
+        self.end = None
+        self.error = None
+
+    def duration(self):
+        """returns the time spent running this step, in seconds"""
+        if self.start is None or self.end is None:
+            return 0
+        return self.end - self.start
+
+
+class Pipeline(object):
+    """a dependency graph of steps
+       estimate is an optional function: step name => expected duration in
+       seconds (or None), used to log the estimated time to completion"""
+    def __init__(self, max_workers=None, estimate=None):
+        self.max_workers = max_workers
+        self.estimate = estimate
+        self.steps = []
+        self._by_name = {}
+        self.start = None
+        self.end = None
+
+    def add(self, name, function, requires=()):
+        """adds a step; required steps must be added first, so the graph
+           cannot have cycles"""
+        if name in self._by_name:
+            raise PipelineError('duplicated step: {0}'.format(name))
+        for required in requires:
+            if required not in self._by_name:
+                msg = '{0} requires an unknown step: {1}'.format(name,
+                                                                 required)
+                raise PipelineError(msg)
+        step = Step(name, function, requires)
+        self.steps.append(step)
+        self._by_name[name] = step
+        return step
+
+    def step(self, name):
+        """returns the step called name"""
+        return self._by_name[name]
+
+    def run(self):
+        """runs all the steps, as soon as their requirements are met.
+           After a failure, or a cancellation, no new step is started;
+           running steps are waited for and a PipelineError is raised"""
+        condition = threading.Condition()
+        pending = list(self.steps)
+        running = []
+        done = set()
+        failed = []
+
+        # steps run in new threads, they log with the caller's context
+        parent_context = current_context()
+
+        def _run(step):
+            step.start = time.time()
+            log.info('starting: {0}'.format(step.name))
+            try:
+                with context(**dict(parent_context, step=step.name)), \
+                        span(step.name, 'pipeline'):
+                    step.function()
+            except Exception as error:
+                # exceptions do not cross thread boundaries, keep them
+                step.error = error
+            step.end = time.time()
+            condition.acquire()
+            try:
+                running.remove(step)
+                if step.error is None:
+                    log.info('completed: {0} ({1:.1f}s)'.format(
+                        step.name, step.duration()))
+                    done.add(step.name)
+                    remaining = self.eta()
+                    if remaining:
+                        log.info('estimated time to completion: '
+                                 '{0:.0f}s'.format(remaining))
+                else:
+                    log.error('failed: {0} - {1}'.format(step.name,
+                                                         step.error))
+                    failed.append(step)
+                condition.notify()
+            finally:
+                condition.release()
+
+        self.start = time.time()
+        expected = self.eta()
+        if expected:
+            log.info('estimated duration: {0:.0f}s'.format(expected))
+        condition.acquire()
+        try:
+            while pending or running:
+                if not failed and deadline.cancelled() is None:
+                    for step in list(pending):
+                        if self.max_workers and \
+                           len(running) >= self.max_workers:
+                            break
+                        if all(name in done for name in step.requires):
+                            pending.remove(step)
+                            running.append(step)
+                            thread = threading.Thread(target=_run,
+                                                      args=(step,),
+                                                      name=step.name)
+                            thread.daemon = True
+                            thread.start()
+                if not running:
+                    # nothing running and nothing that can be started
+                    break
+                try:
+                    condition.wait(POLL)
+                except KeyboardInterrupt:
+                    # running steps fail as their child processes end
+                    deadline.cancel('interrupted')
+        finally:
+            condition.release()
+        self.end = time.time()
+
+        self.report()
+        reason = deadline.cancelled()
+        if reason is not None:
+            skipped = ', '.join(step.name for step in pending) or 'none'
+            msg = 'cancelled: {0} (skipped: {1})'.format(reason, skipped)
+            raise PipelineError(msg)
+        if failed:
+            skipped = ', '.join(step.name for step in pending) or 'none'
+            msg = ['{0}: {1}'.format(step.name, step.error) for step in failed]
+            msg = 'failed steps - {0} (skipped: {1})'.format('; '.join(msg),
+                                                            skipped)
+            raise PipelineError(msg)
+
+    def eta(self, now=None):
+        """returns the estimated seconds to complete the pipeline: the
+           longest chain of unfinished steps, using estimate() for their
+           durations. Returns None without estimates"""
+        if self.estimate is None:
+            return None
+        if now is None:
+            now = time.time()
+        # step name => estimated end, relative to now
+        finish = {}
+        for step in self.steps:
+            if step.end is not None:
+                finish[step.name] = 0
+                continue
+            expected = self.estimate(step.name)
+            if expected is None:
+                return None
+            if step.start is not None:
+                # running
+                finish[step.name] = max(0, expected - (now - step.start))
+                continue
+            ready = max([finish[name] for name in step.requires] or [0])
+            finish[step.name] = ready + expected
+        return max(finish.values() or [0])
+
+    def critical_path(self):
+        """returns the list of completed steps that determined the total
+           run time: starting from the last step to finish, it follows the
+           requirement that completed last"""
+        completed = [step for step in self.steps if step.end is not None]
+        if not completed:
+            return []
+        step = max(completed, key=lambda s: s.end)
+        path = [step]
+        while step.requires:
+            step = max((self._by_name[name] for name in step.requires),
+                       key=lambda s: s.end)
+            path.append(step)
+        path.reverse()
+        return path
+
+    def report(self):
+        """logs the duration of every step and the critical path"""
+        for step in self.steps:
+            if step.start is None:
+                log.info('{0}: not started'.format(step.name))
+                continue
+            log.info('{0}: {1:.1f}s'.format(step.name, step.duration()))
+        path = ['{0} ({1:.1f}s)'.format(step.name, step.duration())
+                for step in self.critical_path()]
+        log.info('critical path: {0}'.format(' -> '.join(path)))
+        if self.start is not None and self.end is not None:
+            log.info('total: {0:.1f}s'.format(self.end - self.start))
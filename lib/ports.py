@@ -3,6 +3,7 @@ this module provides a mechanism to check if a port or a range of ports
 are already in use or it's free
 """
 import socket
+import threading
 
 from lib.logger import logger
 log = logger(__name__)
@@ -39,3 +40,31 @@ def available_in_range(from_port, to_port):
         if not sock.connect_ex(('127.0.0.1', port)) == 0:
             are_free.add(port)
     return are_free
+
+
+# ports picked by this process; several configurations can be read in the
+# same process (see batch.py) and they must not pick the same ports
+_reserved = set()
+_reserved_lock = threading.Lock()
+
+
+def reserve(*ports):
+    """reserves ports for this process; returns False, and reserves
+       nothing, if any of them is already reserved"""
+    with _reserved_lock:
+        if _reserved.intersection(ports):
+            return False
+        _reserved.update(ports)
+        return True
+
+
+def release(*ports):
+    """releases reserved ports"""
+    with _reserved_lock:
+        _reserved.difference_update(ports)
+
+
+def reserved():
+    """returns a set of the ports reserved by this process"""
+    with _reserved_lock:
+        return set(_reserved)
@@ -0,0 +1,282 @@
+"""
+preflight checks.
+Before anything is deleted, created or pushed, verify that the staging
+release can actually be set up: required binaries, reachable mozilla
+repositories and URLs, free ports, required files and writable
+directories. Checks run concurrently and are reported together.
+"""
+import os
+import subprocess
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from lib.config import ConfigError
+from lib.download import head, DownloadError
+from lib.which import which
+import lib.ports as ports
+from lib.logger import logger
+log = logger(__name__)
+
+# seconds, for every network check
+PREFLIGHT_TIMEOUT = 20
+
+# (section, option) of the ports that must be free
+PORTS = (('shipit', 'port'),
+         ('master', 'http_port'),
+         ('master', 'ssh_port'),
+         ('master', 'pb_port'))
+
+# (section, option) of the files that must exist, if set
+REQUIRED_FILES = (('master', 'password_file'),
+                  ('release-runner', 'hg_ssh_key'),
+                  ('release-runner', 'ssh_key'))
+
+# (section, option) of the directories that will be created, if set
+WRITABLE_DIRS = (('common', 'root'),
+                 ('common', 'mirror_dir'),
+                 ('common', 'pip_cache'),
+                 ('common', 'snapshot_dir'))
+
+# kinds of checks, all of them run by default
+CHECKS = ('binaries', 'virtualenv', 'repositories', 'git', 'urls', 'ports',
+          'files', 'dirs')
+# the checks needed to create and patch the user repositories only
+REPOSITORY_CHECKS = ('binaries', 'repositories', 'urls')
+
+
+class PreflightError(Exception):
+    """Generic Preflight error"""
+    pass
+
+
+def run_command(cmd, timeout=PREFLIGHT_TIMEOUT):
+    """runs cmd, killing it after timeout seconds.
+       Raises a PreflightError if cmd fails"""
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+    except OSError as error:
+        raise PreflightError('{0}: {1}'.format(cmd[0], error))
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    try:
+        output = process.communicate()[0]
+    finally:
+        timer.cancel()
+    if process.returncode < 0:
+        raise PreflightError('timed out after {0}s'.format(timeout))
+    if process.returncode != 0:
+        lines = output.strip().splitlines() or ['exit code {0}'.format(
+            process.returncode)]
+        raise PreflightError(lines[-1])
+    return output
+
+
+def writable_ancestor(path):
+    """returns True if path, or its first existing ancestor, is a
+       writable directory"""
+    path = os.path.abspath(os.path.expanduser(path))
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.path.isdir(path) and os.access(path, os.W_OK | os.X_OK)
+
+
+class Preflight(object):
+    """checks a configuration before the staging setup changes anything.
+       state is the ProvisioningState of the previous run (if any): ports
+       reused from it belong to this environment and are not checked.
+       checks is the list of the kinds of checks to run (see CHECKS)"""
+    def __init__(self, configuration, state=None, timeout=PREFLIGHT_TIMEOUT,
+                 checks=CHECKS):
+        self.configuration = configuration
+        self.timeout = timeout
+        self.kinds = tuple(checks)
+        self.previous_values = {}
+        if state is not None:
+            self.previous_values = state.previous_values()
+
+    def _get(self, section, option):
+        """returns section:option, None if it is not set"""
+        try:
+            return self.configuration.get(section, option) or None
+        except ConfigError:
+            return None
+
+    def check_binary(self, *names):
+        """one of names must be in PATH"""
+        for name in names:
+            path = which(name)
+            if path:
+                return path
+        raise PreflightError('not found in PATH')
+
+    def check_hg_repo(self, url):
+        """url must be a reachable hg repository"""
+        cmd = ('hg', 'identify', '--config', 'ui.interactive=false', url)
+        return run_command(cmd, self.timeout).strip()
+
+    def check_git_repo(self, url):
+        """url must be a reachable git repository"""
+        cmd = ('git', 'ls-remote', url, 'HEAD')
+        return run_command(cmd, self.timeout).split()[0]
+
+    def check_url(self, url):
+        """url must be reachable"""
+        try:
+            return head(url, self.timeout)
+        except DownloadError as error:
+            raise PreflightError(error)
+
+    def check_user_repo(self, name):
+        """the user repository must be under common:hg_user_repo"""
+        conf = self.configuration
+        user_repo = conf.get(name, 'user_repo')
+        expected = '{0}/{1}'.format(conf.get('common', 'hg_user_repo'),
+                                    conf.get(name, 'dst_repo_name'))
+        if user_repo.rstrip('/') != expected:
+            msg = '{0} is not the repository created by ssh clone ({1})'
+            raise PreflightError(msg.format(user_repo, expected))
+
+    def check_port(self, port):
+        """port must be free"""
+        if ports.in_use(int(port)):
+            raise PreflightError('port {0} is in use'.format(port))
+
+    def check_file(self, path):
+        """path must exist"""
+        if not os.path.isfile(os.path.expanduser(path)):
+            raise PreflightError('{0} does not exist'.format(path))
+
+    def check_writable(self, path):
+        """path must be creatable or writable"""
+        if not writable_ancestor(path):
+            raise PreflightError('{0} is not writable'.format(path))
+
+    def checks(self):
+        """returns the list of checks as (description, function, args)"""
+        conf = self.configuration
+        checks = []
+        kinds = self.kinds
+        if 'virtualenv' in kinds:
+            virtualenvs = conf.get_list('virtualenv', 'binaries')
+            checks.append(('binary: {0}'.format('|'.join(virtualenvs)),
+                           self.check_binary, virtualenvs))
+        local = self._get('common', 'transport') == 'local'
+        binaries = []
+        if 'binaries' in kinds:
+            binaries = ['hg'] if local else ['hg', 'ssh']
+        if 'git' in kinds:
+            binaries.append('git')
+        for name in binaries:
+            checks.append(('binary: {0}'.format(name), self.check_binary,
+                           [name]))
+        user_repo = self._get('common', 'hg_user_repo')
+        if 'repositories' in kinds:
+            for name in conf.options('repositories'):
+                url = conf.get(name, 'mozilla_repo')
+                checks.append(('hg: {0}'.format(url), self.check_hg_repo,
+                               [url]))
+                checks.append(('user repo: {0}'.format(name),
+                               self.check_user_repo, [name]))
+            if local:
+                # user repositories are directories
+                checks.append(('writable: {0}'.format(user_repo),
+                               self.check_writable, [user_repo]))
+        shipit_repo = self._get('shipit', 'repository')
+        if shipit_repo and 'git' in kinds:
+            checks.append(('git: {0}'.format(shipit_repo),
+                           self.check_git_repo, [shipit_repo]))
+        if 'urls' in kinds:
+            checks.extend(self._url_checks(local, user_repo))
+        if 'ports' in kinds:
+            checks.extend(self._port_checks())
+        if 'files' in kinds:
+            checks.extend(self._file_checks())
+        if 'dirs' in kinds:
+            for section, option in WRITABLE_DIRS:
+                path = self._get(section, option)
+                if path:
+                    checks.append(('writable: {0}'.format(path),
+                                   self.check_writable, [path]))
+        return checks
+
+    def _url_checks(self, local, user_repo):
+        """returns the checks of the locales, user repositories (unless
+           local) and production masters json urls"""
+        conf = self.configuration
+        urls = [self._get('locales', 'url')]
+        if not local:
+            urls.append(user_repo)
+        for section in conf.sections():
+            if conf.has_option(section, 'src_production_masters_json'):
+                urls.append(self._get(section,
+                                      'src_production_masters_json'))
+        return [('url: {0}'.format(url), self.check_url, [url])
+                for url in sorted(set(url for url in urls if url))]
+
+    def _port_checks(self):
+        """returns the checks of the ports not reused from the previous
+           run"""
+        checks = []
+        for section, option in PORTS:
+            port = self._get(section, option)
+            previous = self.previous_values.get((section, option))
+            if not port or port == previous:
+                continue
+            checks.append(('port: {0}:{1}'.format(section, option),
+                           self.check_port, [port]))
+        return checks
+
+    def _file_checks(self):
+        """returns the checks of the required files"""
+        checks = []
+        files = []
+        for section, option in REQUIRED_FILES:
+            path = self._get(section, option)
+            if path and path not in files:
+                files.append(path)
+                checks.append(('file: {0}'.format(path), self.check_file,
+                               [path]))
+        return checks
+
+    def run(self, max_in_flight=16):
+        """runs all the checks concurrently and logs a report.
+           Returns the list of (description, error, seconds), raises a
+           PreflightError if any check failed"""
+        def _check(check):
+            description, function, args = check
+            start = time.time()
+            try:
+                function(*args)
+                error = None
+            except PreflightError as exc:
+                error = str(exc)
+            return description, error, time.time() - start
+
+        checks = self.checks()
+        start = time.time()
+        pool = ThreadPool(max(1, min(max_in_flight, len(checks))))
+        try:
+            results = pool.map(_check, checks)
+        finally:
+            pool.close()
+            pool.join()
+        failed = [result for result in results if result[1] is not None]
+        log.info('preflight: {0} checks, {1} failed in {2:.1f}s'.format(
+            len(results), len(failed), time.time() - start))
+        for description, error, seconds in results:
+            if error is None:
+                log.debug('  ok    {0} ({1:.1f}s)'.format(description,
+                                                         seconds))
+            else:
+                log.error('  FAIL  {0}: {1}'.format(description, error))
+        if failed:
+            msg = 'preflight failed: {0}'.format(
+                ', '.join(description for description, error, seconds
+                          in failed))
+            raise PreflightError(msg)
+        return results
@@ -1,12 +1,14 @@
 """creates and configures release runner"""
 import os
-import sh
 import stat
 from lib.venv import Virtualenv, VirtualenvError
-from lib.repositories import Repository
+from lib.repositories import Repository, RepositoryError
+from lib.state import section_values, requirements_fingerprint
 
+from lib.lazy import lazy_import
 from lib.logger import logger
 log = logger(__name__)
+sh = lazy_import('sh')
 
 
 class ReleaseRunnerError(Exception):
@@ -24,13 +26,51 @@ class ReleaseRunner(object):
         self.activate_path = None
         self.python_path = None
 
-    def install(self):
-        """installs buildbot master"""
+    def install(self, state=None):
+        """installs buildbot master
+           if state (a ProvisioningState) is provided, steps with the same
+           inputs of the previous run are skipped
+        """
         log.info('installing release runner')
-        self._clone()
-        self.create_virtualenv()
-        self._create_startup_file()
-        self.create_ini_file()
+        if state is None:
+            self._clone()
+            self.create_virtualenv()
+            self._create_startup_file()
+            self.create_ini_file()
+            return
+        conf = self.configuration
+        state.run('release-runner:clone', self._repositories_inputs(),
+                  self._clone)
+        venv_inputs = [section_values(conf, 'virtualenv'),
+                       requirements_fingerprint(self.requirements,
+                                                self.basedir)]
+        state.run('release-runner:virtualenv', venv_inputs,
+                  self.create_virtualenv, requires=('release-runner:clone',))
+        if self.activate_path is None:
+            venv = Virtualenv(conf)
+            venv.attach(self.basedir)
+            self._set_paths(venv)
+        startup_inputs = section_values(conf, 'release-runner',
+                                        ('startup', 'startup_path', 'basedir'))
+        state.run('release-runner:startup', startup_inputs,
+                  self._create_startup_file,
+                  requires=('release-runner:virtualenv',))
+        # release runner ini is a copy of the whole configuration
+        state.run('release-runner:ini', str(conf), self.create_ini_file)
+
+    def _repositories_inputs(self):
+        """returns the release runner repositories and their revisions"""
+        conf = self.configuration
+        inputs = []
+        for name in conf.get_list('release-runner', 'repositories'):
+            repo = Repository(conf, name)
+            try:
+                revision = repo.remote_revision()
+            except RepositoryError as error:
+                log.error(error)
+                raise ReleaseRunnerError(error)
+            inputs.append((name, repo.url(), revision))
+        return inputs
 
     def _clone(self):
         """clones buildbot-configs into target_dir"""
@@ -39,6 +79,10 @@ class ReleaseRunner(object):
         for repo in repos:
             repo_ = Repository(config, repo)
             target_dir = os.path.join(self.basedir, repo)
+            if os.path.isdir(os.path.join(target_dir, '.hg')):
+                # cloned by a previous run
+                repo_.refresh_locally(target_dir)
+                continue
             repo_.clone_locally(target_dir)
 
     def _create_startup_file(self):
@@ -84,6 +128,10 @@ class ReleaseRunner(object):
             msg = 'cannot create virtualenv: {0}'.format(error.message)
             log.error(msg)
             raise ReleaseRunnerError(msg)
+        self._set_paths(venv)
+
+    def _set_paths(self, venv):
+        """stores the activate and python paths of venv"""
         self.activate_path = venv._activate_path()
         self.python_path = venv._python_path()
 
@@ -7,14 +7,31 @@ Please not that this module can be very dangerous
 """
 
 import os
-from sh import ssh, hg
-from sh import ErrorReturnCode_1, ErrorReturnCode
 from lib.locales import get_shipped_locales, NoLocalesError
+from lib.config import ConfigError
+from lib.mirror import MirrorCache, MirrorError
+from lib.transport import SshTransport, TransportError, transport_for
+from lib.capture import OutputCapture
+from lib.trace import traced
+import lib.budget as budget
+import lib.deadline as deadline
 import shutil
 import tempfile
+import time
+from multiprocessing.pool import ThreadPool
 
-from lib.logger import logger
+from lib.lazy import lazy_import
+from lib.logger import logger, context, current_context
 log = logger(__name__)
+sh = lazy_import('sh')
+
+# users release repos do not end with tracking bug number
+RELEASE_REPOS = ('mozilla-aurora', 'mozilla-beta')
+# push log: changeset, first line of the description and touched files,
+# hg log --stat appends the diffstat
+PUSH_SUMMARY_TEMPLATE = '{node|short} {desc|firstline}\nfiles: {files}\n'
+# push_log = patch: stop logging the outgoing diff after this many bytes
+PUSH_LOG_MAX_BYTES = 65536
 
 
 class RepositoryError(Exception):
@@ -22,57 +39,49 @@ class RepositoryError(Exception):
 
 
 class LocaleRepository(object):
-    """manages locale repository"""
-    def __init__(self, locale):
+    """manages locale repository
+       transport is a lib.transport.Transport (default: ssh)"""
+    def __init__(self, locale, transport=None):
         self.locale = locale
-
-    def _exec_ssh_cmd(self, cmd, ignore_exit_code_1=False):
-        try:
-            for line in ssh(cmd, _iter=True):
-                log.debug(line.strip())
-        except ErrorReturnCode_1:
-            if ignore_exit_code_1:
-                log.debug('ignoring exit code = 1')
-            else:
-                msg = 'error executing {0}'.format(' '.join(cmd))
-                log.debug(msg)
-                raise RepositoryError(msg)
-        except ErrorReturnCode:
-            log.debug(msg)
-            raise RepositoryError(msg)
+        self.transport = transport or SshTransport()
 
     def delete(self):
         locale = self.locale
         log.debug('deleting user repository {0}'.format(locale))
-        cmd = ("hg.mozilla.org", "edit", locale,  "delete", "YES")
-        log.debug('cmd: {0}'.format(' '.join(cmd)))
         try:
-            self._exec_ssh_cmd(cmd, ignore_exit_code_1=True)
-        except RepositoryError:
+            if not self.transport.remote_delete(locale):
+                log.debug('{0} does not exist'.format(locale))
+        except TransportError as error:
             log.debug('failed to delete user repository: {0}'.format(locale))
+            log.debug(error)
 
     def create(self):
         locale = self.locale
         log.debug('creating user repository {0}'.format(locale))
-        cmd = ('hg.mozilla.org', 'clone',
-               locale, 'l10n-central/{0}'.format(locale))
-        log.debug('cmd: {0}'.format(' '.join(cmd)))
         try:
-            self._exec_ssh_cmd(cmd)
-        except RepositoryError:
+            self.transport.remote_clone(locale,
+                                        'l10n-central/{0}'.format(locale))
+        except TransportError as error:
             log.debug('failed to clone {0}'.format(locale))
+            log.debug(error)
 
 
 class Repository(object):
     """Clones hg.m.o repositories into user's one
        manages checkouts and user's repository deletion
+       remote operations go through transport (a lib.transport.Transport,
+       default: the one of common:transport)
     """
-    def __init__(self, configuration, name):
+    def __init__(self, configuration, name, transport=None):
         self.configuration = configuration
         self.name = name
         self.bug = configuration.get('common', 'tracking_bug')
         self.local_checkout_dir = None
+        if transport is None:
+            transport = transport_for(configuration)
+        self.transport = transport
 
+    @traced('ssh clone', 'repository', repo='name')
     def create_repo(self):
         """creates a reposiory as
            a copy of https://hg.mozilla.org/build/self.name/
@@ -91,11 +100,15 @@ class Repository(object):
 #            raise RepositoryError(msg)
         # added more robust check on pushing rather than cloning...
 
-        cmd = ('hg.mozilla.org', 'clone', dst_repo_name,  src_repo_name)
         log.info('cloning {0} to {1}'.format(src_repo_name, dst_repo_name))
-        log.debug('running ssh {0}'.format(' '.join(cmd)))
-        ssh(cmd)
+        try:
+            with budget.slot(budget.NETWORK):
+                self.transport.remote_clone(dst_repo_name, src_repo_name)
+        except TransportError as error:
+            log.error(error)
+            raise RepositoryError(error)
 
+    @traced('ssh delete', 'repository', repo='name')
     def delete_user_repo(self, i_am_brave=False):
         """delete user's remote repository"""
         conf = self.configuration
@@ -105,49 +118,158 @@ class Repository(object):
             msg = "{0}, its name does not end with {1}".format(msg, self.bug)
             log.error(msg)
             raise RepositoryError(msg)
-        cmd = ("hg.mozilla.org", "edit", dst_repo_name,  "delete", "YES")
         log.info('deleting {0}'.format(dst_repo_name))
-        log.debug('running ssh {0}'.format(' '.join(cmd)))
-        output = []
         try:
-            for line in ssh(cmd, _iter=True):
-                out = line.strip()
-                log.debug(out)
-                output.append(out)
-        except ErrorReturnCode_1:
-            log.debug('trying to delete a non existing repo... pass')
-        except ErrorReturnCode:
-            msg = 'bad exit code executing {0}'.format(' '.join(cmd))
-            log.error(msg)
-            raise RepositoryError(msg)
+            with budget.slot(budget.NETWORK):
+                deleted = self.transport.remote_delete(dst_repo_name)
+            if not deleted:
+                log.debug('trying to delete a non existing repo... pass')
+        except TransportError as error:
+            log.error(error)
+            raise RepositoryError(error)
 
-    def clone_locally(self, dst_dir, branch='default', clone_from='user'):
-        """clones the repo into dst_dir"""
+    def url(self, clone_from='user'):
+        """returns the url of the mozilla or of the user repository"""
         conf = self.configuration
-        repo = conf.get(self.name, 'mozilla_repo')
         if clone_from != 'mozilla':
-            repo = conf.get(self.name, 'user_repo')
+            return conf.get(self.name, 'user_repo')
+        return conf.get(self.name, 'mozilla_repo')
+
+    def remote_revision(self, branch='default', clone_from='user'):
+        """returns the current revision of branch in the remote repository"""
+        try:
+            return self.transport.remote_revision(self.url(clone_from),
+                                                  branch)
+        except TransportError as error:
+            log.debug(error)
+            raise RepositoryError(error)
+
+    def exists_remotely(self, clone_from='user'):
+        """returns True if the remote repository exists"""
+        try:
+            self.remote_revision(clone_from=clone_from)
+        except RepositoryError:
+            return False
+        return True
+
+    def is_release_repo(self):
+        """returns True for release repositories, their user repository
+           name does not end with the tracking bug number"""
+        return self.name in RELEASE_REPOS
+
+    def recreate_user_repo(self):
+        """deletes the user repository, if any, and creates it again"""
+        self.delete_user_repo(i_am_brave=self.is_release_repo())
+        self.create_repo()
+
+    def tag_user_repo(self):
+        """clones the user repository in a temporary directory, tags it
+           and pushes the tag"""
+        dst_dir = tempfile.mkdtemp()
+        try:
+            self.clone_locally(dst_dir, clone_from='user')
+            self.tag()
+            self.push()
+        finally:
+            shutil.rmtree(dst_dir)
+
+    @traced('hg clone', 'repository', repo='name')
+    def clone_locally(self, dst_dir, branch='default', clone_from='user'):
+        """clones the repo into dst_dir"""
+        repo = self.url(clone_from)
         cmd = ('clone', repo, dst_dir)
-        log.debug('running sh {0}'.format(' '.join(cmd)))
+        log.debug('running sh %s', ' '.join(cmd))
         self.local_checkout_dir = dst_dir
-        hg_cmd = ('clone', '-b', branch, repo, dst_dir)
+        mirror_dir = self._mirror_dir()
+        if mirror_dir:
+            self._clone_from_mirror(mirror_dir, repo, dst_dir, branch)
+            return
         try:
-            for line in hg(hg_cmd, _iter=True):
-                log.debug(line.strip())
-        except ErrorReturnCode as error:
-            msg = 'clone failed'
-            msg = '{0}: hg {1}'.format(msg, ' '.join(cmd))
-            msg = '{0} - error: {1}'.format(msg, error)
-            log.debug(msg)
+            with budget.slot(budget.NETWORK):
+                self.transport.local_clone(repo, dst_dir, branch)
+        except TransportError as error:
+            log.debug(error)
             raise RepositoryError('clone failed')
 
+    def _mirror_dir(self):
+        """returns common:mirror_dir, None if mirrors are not enabled"""
+        try:
+            return self.configuration.get('common', 'mirror_dir') or None
+        except ConfigError:
+            return None
+
+    def _clone_from_mirror(self, mirror_dir, repo, dst_dir, branch):
+        """clones the local mirror of the mozilla repository into dst_dir,
+           then pulls the missing changesets from repo.
+           User repositories are copies of mozilla's, so only the staging
+           changes are downloaded"""
+        mozilla_repo = self.configuration.get(self.name, 'mozilla_repo')
+        try:
+            with budget.slot(budget.NETWORK):
+                mirror = MirrorCache(mirror_dir).refresh(mozilla_repo)
+        except MirrorError as error:
+            raise RepositoryError(error)
+        # (command, working directory)
+        commands = (
+            (('clone', '--noupdate', mirror, dst_dir), None),
+            (('pull', repo), dst_dir),
+            (('update', '--clean', '-r', branch), dst_dir),
+        )
+        for cmd, cwd in commands:
+            log.debug('running hg %s', ' '.join(cmd))
+            try:
+                with budget.slot(budget.NETWORK), \
+                        OutputCapture('hg {0}'.format(cmd[0])) as output:
+                    for line in deadline.command_lines('clone', sh.hg, cmd,
+                                                       _cwd=cwd):
+                        output.feed(line)
+            except sh.ErrorReturnCode as error:
+                msg = 'clone failed: hg {0}'.format(' '.join(cmd))
+                msg = '{0} - error: {1}'.format(msg, error)
+                log.debug(msg)
+                raise RepositoryError('clone failed')
+        # the checkout must point to repo, not to the mirror
+        hg_rc = os.path.join(dst_dir, '.hg', 'hgrc')
+        with open(hg_rc, 'w') as hgrc:
+            hgrc.write('[paths]\ndefault = {0}\n'.format(repo))
+
+    def refresh_locally(self, dst_dir, branch='default'):
+        """brings an existing checkout in dst_dir to the remote state of
+           branch: pulls, strips local only changesets left by a previous
+           run, updates with --clean and purges untracked files"""
+        self.local_checkout_dir = dst_dir
+        # (command, ignore errors)
+        commands = (
+            (('pull',), False),
+            # nothing to strip is an error for hg, that's fine
+            (('--config', 'extensions.strip=', 'strip', '--no-backup',
+              '-r', 'outgoing()'), True),
+            (('update', '--clean', '-r', branch), False),
+            (('--config', 'extensions.purge=', 'purge', '--all'), False),
+        )
+        for cmd, ignore_errors in commands:
+            log.debug('running hg %s in %s', ' '.join(cmd), dst_dir)
+            # the output is logged when an error is raised, not when it's
+            # ignored
+            with OutputCapture('hg {0}'.format(' '.join(cmd))) as output:
+                try:
+                    for line in deadline.command_lines('clone', sh.hg, cmd,
+                                                       _cwd=dst_dir):
+                        output.feed(line)
+                except sh.ErrorReturnCode as error:
+                    msg = 'refresh failed: hg {0}'.format(' '.join(cmd))
+                    log.debug('{0} - error: {1}'.format(msg, error))
+                    if not ignore_errors:
+                        raise RepositoryError(msg)
+
     def commit(self, commit_message):
         """commit local changes"""
         try:
             cmd = ('commit', '-m', commit_message)
-            for line in hg(cmd, _cwd=self.local_checkout_dir):
+            for line in deadline.command_lines('command', sh.hg, cmd,
+                                               _cwd=self.local_checkout_dir):
                 log.debug(line.strip())
-        except ErrorReturnCode as error:
+        except sh.ErrorReturnCode as error:
             msg = 'commit failed: {0}'.format(error)
             raise RepositoryError(msg)
 
@@ -178,35 +300,120 @@ class Repository(object):
             for line in configfile:
                 log.debug(line.strip())
 
+    def outgoing(self):
+        """returns the list of changesets (full hashes) that are in the local
+           checkout and not in the remote repository"""
+        cmd = ('outgoing', '--quiet', '--template', '{node}\n')
+        try:
+            lines = deadline.run_command('clone', sh.hg, cmd,
+                                         _cwd=self.local_checkout_dir,
+                                         _tty_out=False)
+        except sh.ErrorReturnCode_1:
+            # hg outgoing exits with 1 when there is nothing to push
+            return []
+        except sh.ErrorReturnCode as error:
+            msg = 'outgoing failed: {0}'.format(error)
+            log.debug(msg)
+            raise RepositoryError(msg)
+        return [line.strip() for line in lines if line.strip()]
+
+    def _push_log_settings(self):
+        """returns (mode, max bytes) for the push log
+           mode is 'summary' (changesets, files and diffstat) or 'patch'
+           (full diff, capped at max bytes)"""
+        conf = self.configuration
+        try:
+            mode = conf.get('common', 'push_log').strip() or 'summary'
+        except ConfigError:
+            mode = 'summary'
+        try:
+            max_bytes = int(conf.get('common', 'push_log_max_bytes'))
+        except (ConfigError, ValueError):
+            max_bytes = PUSH_LOG_MAX_BYTES
+        return mode, max_bytes
+
+    def _log_outgoing(self, changesets):
+        """logs the changesets that are about to be pushed.
+           It runs hg log on the local checkout, so there's no need to ask
+           the remote repository again"""
+        mode, max_bytes = self._push_log_settings()
+        if mode == 'patch':
+            options = ('log', '-p', '--color', 'never')
+        else:
+            options = ('log', '--stat', '--template', PUSH_SUMMARY_TEMPLATE)
+        logged_bytes = 0
+        # many -r options, but not too many for a single command line
+        for start in range(0, len(changesets), 200):
+            revisions = []
+            for changeset in changesets[start:start + 200]:
+                revisions.extend(('-r', changeset))
+            cmd = options + tuple(revisions)
+            for line in deadline.command_lines('command', sh.hg, cmd,
+                                               _cwd=self.local_checkout_dir,
+                                               _tty_out=False):
+                if mode == 'patch' and logged_bytes >= max_bytes:
+                    # keep reading, hg needs to terminate
+                    continue
+                logged_bytes += len(line)
+                log.debug(line.rstrip())
+        if mode == 'patch' and logged_bytes >= max_bytes:
+            log.debug('... outgoing patch truncated at {0} bytes'.format(
+                max_bytes))
+
+    @traced('hg push', 'repository', repo='name')
     def push(self):
         """pushes local changes to the remote repository"""
         self._update_hgrc()
         try:
             # logging what is about to be pushed
-            cmd = ('out', '-p', '--color', 'never')
-            for line in hg(cmd, _cwd=self.local_checkout_dir):
-                log.debug(line.strip())
+            changesets = self.outgoing()
+            if not changesets:
+                log.info('{0}: nothing to push'.format(self.name))
+                return
+            log.info('{0}: pushing {1} changesets'.format(self.name,
+                                                          len(changesets)))
+            self._log_outgoing(changesets)
             # and now log the push command
-            for line in hg('push', _cwd=self.local_checkout_dir):
-                log.debug(line.strip())
-        except ErrorReturnCode as error:
+            self.transport.push(self.local_checkout_dir)
+        except TransportError as error:
+            log.debug(error)
+            raise RepositoryError(error)
+        except sh.ErrorReturnCode as error:
             msg = 'push failed: {0}'.format(error)
             log.debug(msg)
             raise RepositoryError(msg)
 
+    def release_tag(self):
+        """returns the tag of the release, see tag_name"""
+        conf = self.configuration
+        products = conf.get_list('common', 'staging_release')
+        version = conf.get('common', 'version')
+        return tag_name(version, products)
+
+    def has_tag(self, tag='default'):
+        """returns True if the user repository has tag (the tag of the
+           release by default)"""
+        if tag == 'default':
+            tag = self.release_tag()
+        try:
+            self.transport.remote_revision(self.url(), tag)
+        except TransportError as error:
+            log.debug(error)
+            return False
+        return True
+
+    @traced('hg tag', 'repository', repo='name')
     def tag(self, tag='default'):
         """tags a repository with tag, if tag is not provided,
            it will use tag_name function do determine the tag"""
-        conf = self.configuration
         if tag == 'default':
-            products = conf.get_list('common', 'staging_release')
-            version = conf.get('common', 'version')
-            tag = tag_name(version, products)
+            tag = self.release_tag()
         try:
             cmd = ('tag', '-f', tag)
-            for line in hg(cmd, _cwd=self.local_checkout_dir):
+            for line in deadline.command_lines('command', sh.hg, cmd,
+                                               _cwd=self.local_checkout_dir):
                 log.debug(line.strip())
-        except ErrorReturnCode as error:
+        except sh.ErrorReturnCode as error:
             msg = 'tag failed: {0}'.format(error)
             log.debug(msg)
             raise RepositoryError(msg)
@@ -217,28 +424,56 @@ class Repositories(object):
     def __init__(self, configuration):
         self.configuration = configuration
 
-    def prepare_user_repos(self):
-        """runs delete, create, clone and tag on every repository"""
+    def inputs(self):
+        """returns the inputs of prepare_user_repos: the repositories names
+           and the current revision of the mozilla repositories"""
+        conf = self.configuration
+        inputs = []
+        for name in conf.options('repositories'):
+            repo = Repository(conf, name)
+            inputs.append((name,
+                           conf.get(name, 'src_repo_name'),
+                           conf.get(name, 'dst_repo_name'),
+                           repo.remote_revision(clone_from='mozilla')))
+        return inputs
+
+    def prepare_user_repos(self, journal=None, max_in_flight=None):
+        """runs delete, create, clone and tag on every repository
+           if journal (a lib.journal.Journal) is provided, completed steps
+           are recorded and, when resuming, verified and skipped.
+           At most max_in_flight repositories are prepared at the same
+           time, by default the size of the network pool of the budget
+           (one at a time without a budget)
+        """
         conf = self.configuration
         repos = conf.options('repositories')
-        for repo in repos:
-            am_i_brave = False
+        if max_in_flight is None:
+            max_in_flight = budget.limit(budget.NETWORK) or 1
+        parent_context = current_context()
+
+        def _prepare(repo):
             log.info(repo)
             repo = Repository(conf, repo)
-            if repo.name in ('mozilla-aurora', 'mozilla-beta'):
-                # users release repos do not end with tracking bug number
-                am_i_brave = True
-            repo.delete_user_repo(i_am_brave=am_i_brave)
-            repo.create_repo()
-            if 'mozilla' not in repo.name:
-                # skip release repository
-                dst_dir = tempfile.mkdtemp()
-                repo.clone_locally(dst_dir, clone_from='user')
-                repo.tag()
-                repo.push()
-                shutil.rmtree(dst_dir)
-            else:
-                log.info('skip tagging of: {0}'.format(repo.name))
+            with context(**dict(parent_context, repo=repo.name)):
+                created = '{0}:created'.format(repo.name)
+                self._run(journal, created, repo.recreate_user_repo,
+                          verify=repo.exists_remotely)
+                if 'mozilla' not in repo.name:
+                    # skip release repository
+                    pushed = '{0}:tagged-pushed'.format(repo.name)
+                    self._run(journal, pushed, repo.tag_user_repo,
+                              verify=repo.has_tag,
+                              requires=(created,))
+                else:
+                    log.info('skip tagging of: {0}'.format(repo.name))
+
+        pool = ThreadPool(max(1, min(max_in_flight, len(repos) or 1)))
+        try:
+            # the first error is raised, after every repository is done
+            pool.map(_prepare, repos)
+        finally:
+            pool.close()
+            pool.join()
         # locales
         log.info('cloning locales repositiories')
         locales_url = conf.get('locales', 'url')
@@ -256,18 +491,49 @@ class Repositories(object):
 #            loc.delete()
 #            loc.create()
 
-    def delete_all_repos(self):
-        """runs delete, create, clone and tag on every repository"""
+    def _run(self, journal, step, function, verify=None, requires=()):
+        """runs function, through journal if it's not None"""
+        if journal is None:
+            function()
+            return
+        journal.run(step, function, verify=verify, requires=requires)
+
+    def delete_all_repos(self, max_in_flight=4):
+        """deletes every user repository, running at most max_in_flight
+           ssh commands at the same time.
+           Returns a list of (repository, seconds, error) tuples, error is
+           None for deleted repositories"""
         conf = self.configuration
-        repos = conf.options('repositories')
-        for repo in repos:
-            am_i_brave = False
-            log.info(repo)
-            repo = Repository(conf, repo)
-            if repo.name in ('mozilla-aurora', 'mozilla-beta'):
-                # users release repos do not end with tracking bug number
-                am_i_brave = True
-            repo.delete_user_repo(i_am_brave=am_i_brave)
+        repos = [Repository(conf, name)
+                 for name in conf.options('repositories')]
+        parent_context = current_context()
+
+        def _delete(repo):
+            start = time.time()
+            try:
+                with context(**dict(parent_context, repo=repo.name)):
+                    repo.delete_user_repo(i_am_brave=repo.is_release_repo())
+                error = None
+            except RepositoryError as err:
+                error = err
+            return (repo.name, time.time() - start, error)
+
+        start = time.time()
+        pool = ThreadPool(max(1, min(max_in_flight, len(repos) or 1)))
+        try:
+            results = pool.map(_delete, repos)
+        finally:
+            pool.close()
+            pool.join()
+        for name, seconds, error in results:
+            if error is None:
+                log.info('deleted {0} ({1:.1f}s)'.format(name, seconds))
+            else:
+                log.error('failed to delete {0}: {1}'.format(name, error))
+        deleted = len([result for result in results if result[2] is None])
+        log.info('deleted {0}/{1} repositories in {2:.1f}s'.format(
+            deleted, len(results), time.time() - start))
+        return results
 #        # locales
 #        log.info('cloning locales repositiories')
 #        locales_url = conf.get('locales', 'url')
@@ -0,0 +1,188 @@
+"""
+fast scanning of local checkouts.
+Directories are pruned before descending into them and file contents are
+searched with mmap, so there's no need to split every file into lines.
+Scanning is spread across a pool of worker processes, as many as the cpu
+pool of the budget allows (see lib.budget).
+"""
+import mmap
+import multiprocessing
+import os
+import re
+
+import lib.budget as budget
+from lib.logger import logger
+log = logger(__name__)
+
+
+def is_excluded(name, exclude):
+    """returns True if name contains any of the words in exclude"""
+    for word in exclude:
+        if word in name:
+            return True
+    return False
+
+
+def walk_files(top, suffixes=None, exclude=()):
+    """yields the files under top, ending with any of suffixes (all files if
+       suffixes is None). Directories and files with a name containing any
+       of the words in exclude are skipped; excluded directories are not
+       even visited.
+    """
+    if suffixes is not None:
+        suffixes = tuple(suffixes)
+    for root, dirs, files in os.walk(top):
+        # prune dirs in place, os.walk will not descend into them
+        dirs[:] = [d for d in dirs if d != '.hg' and not is_excluded(d, exclude)]
+        for filename in files:
+            if suffixes is not None and not filename.endswith(suffixes):
+                continue
+            if is_excluded(filename, exclude):
+                continue
+            yield os.path.join(root, filename)
+
+
+def _map_file(filename):
+    """returns a read only mmap of filename, None if the file is empty"""
+    with open(filename, 'rb') as src:
+        try:
+            return mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file, cannot be mapped
+            return None
+
+
+def _line_at(data, position):
+    """returns the line of data containing position"""
+    start = data.rfind(b'\n', 0, position) + 1
+    end = data.find(b'\n', position)
+    if end == -1:
+        end = len(data)
+    return data[start:end]
+
+
+def file_contains(filename, needle, skip_lines_with=None):
+    """returns True if filename contains needle. If skip_lines_with is set,
+       occurrences of needle on lines containing skip_lines_with are ignored
+    """
+    try:
+        data = _map_file(filename)
+    except (IOError, OSError) as error:
+        log.debug('cannot read %s: %s', filename, error)
+        return False
+    if data is None:
+        return False
+    try:
+        position = data.find(needle)
+        while position != -1:
+            if skip_lines_with is None:
+                return True
+            if skip_lines_with not in _line_at(data, position):
+                return True
+            position = data.find(needle, position + 1)
+        return False
+    finally:
+        data.close()
+
+
+def _map(function, jobs, processes=None):
+    """returns [function(job) for job in jobs], computed by a pool of
+       processes (the size of the cpu pool of the budget, or the cpu count,
+       if None); processes=1 runs in this process. Every process holds a
+       slot of the cpu pool, so there are at most as many processes as
+       slots in the cpu pool"""
+    if processes is None:
+        processes = budget.limit(budget.CPU) or multiprocessing.cpu_count()
+    if processes == 1 or len(jobs) < 2:
+        return [function(job) for job in jobs]
+    with budget.slot(budget.CPU, processes) as processes:
+        if processes == 1:
+            return [function(job) for job in jobs]
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunksize = max(1, len(jobs) // (processes * 4))
+            return pool.map(function, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _file_contains(args):
+    """pool helper: returns filename if it contains the needle"""
+    filename, needle, skip_lines_with = args
+    if file_contains(filename, needle, skip_lines_with):
+        return filename
+
+
+def scan_tree(top, needle, suffixes=None, exclude=(), skip_lines_with=None,
+              processes=None):
+    """returns the sorted list of files under top containing needle.
+       see walk_files and file_contains for the other parameters.
+       processes: number of worker processes, defaults to the size of the
+       cpu pool (see _map); use 1 to scan in the current process.
+    """
+    jobs = [(filename, needle, skip_lines_with)
+            for filename in walk_files(top, suffixes, exclude)]
+    log.debug('scanning %d files in %s', len(jobs), top)
+    results = _map(_file_contains, jobs, processes)
+    return sorted(result for result in results if result)
+
+
+def compile_patterns(patterns):
+    """returns a single regular expression matching any of patterns
+       (literal strings). Longer patterns are tried first, so the
+       longest match wins"""
+    patterns = sorted(set(patterns), key=len, reverse=True)
+    return re.compile(b'|'.join(re.escape(pattern) for pattern in patterns))
+
+
+def find_in_file(filename, regex, skip_lines_with=None):
+    """returns a list of (filename, line number, match, line) for every
+       match of regex in filename. Lines containing skip_lines_with are
+       ignored"""
+    hits = []
+    try:
+        data = _map_file(filename)
+    except (IOError, OSError) as error:
+        log.debug('cannot read %s: %s', filename, error)
+        return hits
+    if data is None:
+        return hits
+    try:
+        lineno = 1
+        last = 0
+        for match in regex.finditer(data):
+            position = match.start()
+            lineno += data[last:position].count(b'\n')
+            last = position
+            line = _line_at(data, position)
+            if skip_lines_with is not None and skip_lines_with in line:
+                continue
+            hits.append((filename, lineno, match.group(0), line.strip()))
+    finally:
+        data.close()
+    return hits
+
+
+def _find_in_file(args):
+    """pool helper for find_in_file"""
+    filename, pattern, skip_lines_with = args
+    return find_in_file(filename, re.compile(pattern), skip_lines_with)
+
+
+def find_in_tree(top, patterns, suffixes=None, exclude=(),
+                 skip_lines_with=None, processes=None):
+    """returns a sorted list of (filename, line number, match, line) for
+       every occurrence of any of patterns in the files under top.
+       see walk_files and scan_tree for the other parameters.
+    """
+    pattern = compile_patterns(patterns).pattern
+    jobs = [(filename, pattern, skip_lines_with)
+            for filename in walk_files(top, suffixes, exclude)]
+    log.debug('searching %d files in %s', len(jobs), top)
+    results = _map(_find_in_file, jobs, processes)
+    hits = []
+    for result in results:
+        hits.extend(result)
+    hits.sort()
+    return hits
@@ -1,11 +1,16 @@
 """creates and configures ship it"""
 import os
 from lib.venv import Virtualenv, VirtualenvError
-from sh import git
+from lib.state import section_values, requirements_fingerprint
+import lib.budget as budget
+import lib.deadline as deadline
+from lib.capture import OutputCapture
 import stat
 
+from lib.lazy import lazy_import
 from lib.logger import logger
 log = logger(__name__)
+sh = lazy_import('sh')
 
 
 class ShipitError(Exception):
@@ -23,12 +28,50 @@ class Shipit(object):
         self.activate_path = None
         self.python_path = None
 
-    def install(self):
-        """installs buildbot master"""
+    def install(self, state=None):
+        """installs buildbot master
+           if state (a ProvisioningState) is provided, steps with the same
+           inputs of the previous run are skipped
+        """
         log.info('installing ship it')
-        self._clone(self.basedir)
-        self.create_virtualenv()
-        self._create_startup_file()
+        if state is None:
+            self._clone(self.basedir)
+            self.create_virtualenv()
+            self._create_startup_file()
+            return
+        conf = self.configuration
+        clone_inputs = [self.repository, self.basedir, self._remote_revision()]
+        state.run('shipit:clone', clone_inputs,
+                  lambda: self._clone(self.basedir),
+                  verify=lambda: os.path.isdir(os.path.join(self.basedir,
+                                                            '.git')))
+        venv_inputs = [section_values(conf, 'virtualenv'),
+                       requirements_fingerprint(self.requirements,
+                                                self.basedir)]
+        state.run('shipit:virtualenv', venv_inputs, self.create_virtualenv,
+                  requires=('shipit:clone',))
+        if self.activate_path is None:
+            venv = Virtualenv(conf)
+            venv.attach(self.basedir)
+            self._set_paths(venv)
+        state.run('shipit:startup', section_values(conf, 'shipit'),
+                  self._create_startup_file, requires=('shipit:virtualenv',))
+
+    def _remote_revision(self):
+        """returns the current revision of the ship it repository"""
+        try:
+            output = deadline.run_command('clone', sh.git, 'ls-remote',
+                                          self.repository, 'HEAD',
+                                          _tty_out=False)
+        except sh.ErrorReturnCode as error:
+            msg = 'cannot get ship it revision: {0}'.format(error)
+            log.error(msg)
+            raise ShipitError(msg)
+        # <revision>\tHEAD
+        fields = str(output).split()
+        if not fields:
+            return None
+        return fields[0]
 
     def create_virtualenv(self):
         """creates a virtualenv for ship it
@@ -46,15 +89,30 @@ class Shipit(object):
             log.error(msg)
             raise ShipitError(msg)
 
+        self._set_paths(venv)
+
+    def _set_paths(self, venv):
+        """stores the activate and python paths of venv"""
         self.activate_path = venv._activate_path()
         self.python_path = venv._python_path()
 
     def _clone(self, target_dir):
         """clones buildbot-configs into target_dir"""
+        if os.path.isdir(os.path.join(target_dir, '.git')):
+            # cloned by a previous run
+            log.info('updating {0}'.format(self.repository))
+            git_cmd = ('pull', '--ff-only')
+            with OutputCapture('git pull') as output:
+                for line in deadline.command_lines('clone', sh.git, git_cmd,
+                                                   _cwd=target_dir):
+                    output.feed(line)
+            return
         log.info('cloning {0}'.format(self.repository))
         git_cmd = ('clone', self.repository, target_dir)
-        for line in git(git_cmd, _iter=True):
-            log.debug(line.strip())
+        with budget.slot(budget.NETWORK), \
+                OutputCapture('git clone') as output:
+            for line in deadline.command_lines('clone', sh.git, git_cmd):
+                output.feed(line)
 
     def _create_startup_file(self):
         startup = self.configuration.get('shipit', 'startup')
@@ -0,0 +1,279 @@
+"""
+snapshots of a provisioned staging root (common:root).
+A snapshot is a copy of the whole tree (master, ship it, release runner,
+startup scripts, state file) taken right after the provisioning; restoring
+it resets the staging environment without provisioning it again.
+
+Trees are copied with reflinks (cp --reflink=always) where the filesystem
+supports them; otherwise files are hard linked, except the ones that are
+modified in place (MUTABLE_FILES, e.g. the ship it sqlite database) which
+are copied. Programs replacing files (hg, pip, python writing .pyc, the
+patches of lib.patch) never modify the snapshot.
+
+On restore, paths and runtime values (ports, ship it password) embedded in
+generated files (REWRITE_FILES) are replaced with the ones of the current
+configuration.
+"""
+import fnmatch
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+
+from lib.config import ConfigError
+from lib.state import ProvisioningState, RUNTIME_VALUES, state_file_path
+from lib.teardown import remove_in_background
+from lib.logger import logger
+log = logger(__name__)
+
+# files modified in place, never hard linked: databases, logs, the journal
+# (appended by --resume, see lib.journal), the startup scripts and the pth
+# file of the master (written again by the provisioning)
+MUTABLE_FILES = ('*.db', '*.sqlite', '*.log', '*.pid', 'twistd.*',
+                 '.staging_journal', '*.sh', '*.pth')
+
+# generated files that embed paths, ports and passwords
+REWRITE_FILES = ('*.sh', '*.ini', '*.json', '*.cfg', '*.tac', '*.pth',
+                 '*/bin/*', 'Makefile')
+
+METADATA = 'snapshot.json'
+
+
+class SnapshotError(Exception):
+    """Generic Snapshot error"""
+    pass
+
+
+def _matches(path, patterns):
+    """returns True if path (or its basename) matches any of patterns"""
+    name = os.path.basename(path)
+    for pattern in patterns:
+        if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def reflink_tree(src, dst):
+    """copies src to dst with reflinks, returns False if the filesystem
+       (or cp) does not support them"""
+    devnull = open(os.devnull, 'w')
+    try:
+        returncode = subprocess.call(('cp', '-a', '--reflink=always',
+                                      src, dst),
+                                     stdout=devnull, stderr=devnull)
+    except OSError:
+        returncode = 1
+    finally:
+        devnull.close()
+    if returncode != 0:
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        return False
+    return True
+
+
+def link_tree(src, dst, mutable=MUTABLE_FILES):
+    """creates a hard link farm of src in dst; files matching mutable
+       are copied"""
+    for dirpath, dirnames, filenames in os.walk(src):
+        relative = os.path.relpath(dirpath, src)
+        target = os.path.normpath(os.path.join(dst, relative))
+        os.makedirs(target)
+        shutil.copystat(dirpath, target)
+        for name in list(dirnames):
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                # os.walk does not descend into symlinks to directories
+                os.symlink(os.readlink(path), os.path.join(target, name))
+                dirnames.remove(name)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            dst_path = os.path.join(target, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), dst_path)
+            elif _matches(os.path.join(relative, name), mutable):
+                shutil.copy2(path, dst_path)
+            else:
+                os.link(path, dst_path)
+
+
+def clone_tree(src, dst):
+    """copies src to dst, with reflinks if possible, hard links otherwise.
+       Returns the method used: 'reflink' or 'hardlink'"""
+    if reflink_tree(src, dst):
+        return 'reflink'
+    link_tree(src, dst)
+    return 'hardlink'
+
+
+def rewrite_file(path, replacements):
+    """applies replacements, a list of (compiled regex, value), to path.
+       The file is replaced, not modified in place, so hard links to the
+       snapshot are preserved. Returns True if path has been changed"""
+    with open(path, 'rb') as src:
+        content = src.read()
+    if b'\0' in content[:8192]:
+        # binary file
+        return False
+    new_content = content
+    for regex, value in replacements:
+        new_content = regex.sub(value, new_content)
+    if new_content == content:
+        return False
+    temp_path = '{0}.rewrite'.format(path)
+    with open(temp_path, 'wb') as dst:
+        dst.write(new_content)
+    shutil.copymode(path, temp_path)
+    os.rename(temp_path, path)
+    return True
+
+
+def rewrite_tree(top, replacements, patterns=REWRITE_FILES):
+    """rewrites the files in top matching patterns, returns the list of
+       rewritten files"""
+    rewritten = []
+    for dirpath, dirnames, filenames in os.walk(top):
+        if '.hg' in dirnames:
+            dirnames.remove('.hg')
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path) or \
+               not _matches(os.path.relpath(path, top), patterns):
+                continue
+            if rewrite_file(path, replacements):
+                rewritten.append(path)
+    return rewritten
+
+
+def snapshot_dir(configuration):
+    """returns common:snapshot_dir or <common:root>.snapshots"""
+    try:
+        path = configuration.get('common', 'snapshot_dir')
+    except ConfigError:
+        path = None
+    if not path:
+        root = os.path.realpath(configuration.get('common', 'root'))
+        path = '{0}.snapshots'.format(root)
+    return path
+
+
+class Snapshot(object):
+    """a snapshot of common:root, stored in common:snapshot_dir
+       (default: <root>.snapshots)"""
+    def __init__(self, configuration, name):
+        self.configuration = configuration
+        self.name = name
+        self.root = os.path.realpath(configuration.get('common', 'root'))
+        self.path = os.path.join(snapshot_dir(configuration), name)
+        self.tree = os.path.join(self.path, 'tree')
+
+    def exists(self):
+        """returns True if the snapshot has been saved"""
+        return os.path.exists(os.path.join(self.path, METADATA))
+
+    def _check_location(self):
+        """raises a SnapshotError if the snapshot is inside common:root"""
+        if os.path.realpath(self.path).startswith(self.root + os.sep):
+            msg = 'snapshot_dir cannot be inside {0}'.format(self.root)
+            log.error(msg)
+            raise SnapshotError(msg)
+
+    def _runtime_values(self):
+        """returns the runtime values of the configuration as
+           {'section:option': value}"""
+        values = {}
+        for section, option in RUNTIME_VALUES:
+            try:
+                values['{0}:{1}'.format(section, option)] = \
+                    self.configuration.get(section, option)
+            except ConfigError:
+                continue
+        return values
+
+    def save(self):
+        """takes a snapshot of common:root"""
+        self._check_location()
+        if self.exists():
+            msg = 'snapshot {0} already exists'.format(self.path)
+            raise SnapshotError(msg)
+        if not os.path.isdir(self.root):
+            raise SnapshotError('{0} does not exist'.format(self.root))
+        start = time.time()
+        os.makedirs(self.path)
+        log.info('saving {0} to {1}'.format(self.root, self.path))
+        method = clone_tree(self.root, self.tree)
+        metadata = {'root': self.root,
+                    'created': time.time(),
+                    'method': method,
+                    'runtime_values': self._runtime_values()}
+        with open(os.path.join(self.path, METADATA), 'w') as json_file:
+            json.dump(metadata, json_file, indent=2, sort_keys=True)
+        log.info('snapshot saved ({0}) in {1:.1f}s'.format(
+            method, time.time() - start))
+
+    def metadata(self):
+        """returns the metadata of the snapshot"""
+        try:
+            with open(os.path.join(self.path, METADATA)) as json_file:
+                return json.load(json_file)
+        except (IOError, ValueError) as error:
+            msg = 'cannot read snapshot {0}: {1}'.format(self.path, error)
+            raise SnapshotError(msg)
+
+    def replacements(self):
+        """returns the list of (regex, value) that rewrite the snapshot
+           paths and runtime values into the current ones"""
+        metadata = self.metadata()
+        replacements = []
+        if metadata['root'] != self.root:
+            regex = re.compile(re.escape(metadata['root'].encode('utf-8')))
+            replacements.append((regex, self.root.encode('utf-8')))
+        current = self._runtime_values()
+        for key, old_value in metadata['runtime_values'].items():
+            new_value = current.get(key)
+            if not old_value or new_value is None or new_value == old_value:
+                continue
+            log.debug('{0}: {1} => {2}'.format(key, old_value, new_value))
+            # whole values only: port 8914 must not match 18914
+            regex = r'(?<![\w]){0}(?![\w])'.format(
+                re.escape(old_value.encode('utf-8')))
+            replacements.append((re.compile(regex),
+                                 new_value.encode('utf-8')))
+        return replacements
+
+    def restore(self):
+        """replaces common:root with the snapshot.
+           Returns the list of rewritten files"""
+        if not self.exists():
+            raise SnapshotError('no such snapshot: {0}'.format(self.path))
+        self._check_location()
+        replacements = self.replacements()
+        start = time.time()
+        if os.path.exists(self.root):
+            log.info('removing {0}'.format(self.root))
+            remove_in_background(self.root)
+        log.info('restoring {0} to {1}'.format(self.path, self.root))
+        method = clone_tree(self.tree, self.root)
+        rewritten = []
+        if replacements:
+            rewritten = rewrite_tree(self.root, replacements)
+            for path in rewritten:
+                log.debug('rewritten: {0}'.format(path))
+        # the next provisioning run starts from the restored state
+        state = ProvisioningState(state_file_path(self.configuration))
+        state.save_runtime_values(self.configuration)
+        log.info('snapshot restored ({0}, {1} files rewritten) '
+                 'in {2:.1f}s'.format(method, len(rewritten),
+                                      time.time() - start))
+        return rewritten
+
+
+def list_snapshots(configuration):
+    """returns the names of the snapshots in snapshot_dir"""
+    path = snapshot_dir(configuration)
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path)
+                  if os.path.exists(os.path.join(path, name, METADATA)))
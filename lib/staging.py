@@ -0,0 +1,163 @@
+"""
+a staging environment: configuration, provisioning state, journal and the
+pipeline that creates it (see stage.py and batch.py)
+"""
+import os
+import sqlite3
+
+from lib.config import Config, ConfigError
+from lib.repositories import Repositories
+from lib.patch import PatchBuildbotConfigs, PatchTools, PatchRunner
+from lib.manifest import StagingManifest
+from lib.master import Master
+from lib.shipit import Shipit
+from lib.releaserunner import ReleaseRunner
+from lib.pipeline import Pipeline
+from lib.preflight import Preflight
+from lib.state import ProvisioningState, state_file_path, section_values
+from lib.journal import Journal, journal_file_path
+from lib.capture import set_capture_size
+from lib.history import TimingHistory, history_file_path
+import lib.deadline as deadline
+import lib.trace as trace
+from lib.logger import logger, context
+log = logger(__name__)
+
+
+def staging_pipeline(config, state, journal, virtualenv=None,
+                     preflight=True, estimate=None):
+    """returns the staging release Pipeline for config
+       state is the ProvisioningState of the previous runs, journal the
+       checkpoint Journal of this run, virtualenv an optional pre-built
+       master virtualenv (see lib.daemon). If preflight is True, nothing
+       runs until the preflight checks pass. estimate is passed to
+       Pipeline"""
+    relese_type = config.get_list('common', 'staging_release')
+    manifest = StagingManifest(config, relese_type)
+    patch_runner = PatchRunner()
+    patch_runner.register(PatchBuildbotConfigs(config, relese_type,
+                                               'patch-buildbot-configs',
+                                               manifest))
+    patch_runner.register(PatchTools(config, relese_type, 'patch-tools',
+                                     manifest))
+    repositories = Repositories(config)
+    master = Master(config)
+    shipit = Shipit(config)
+    release_runner = ReleaseRunner(config)
+
+    def prepare_repositories():
+        state.run('repositories', repositories.inputs(),
+                  lambda: repositories.prepare_user_repos(journal))
+
+    def patch_repositories():
+        inputs = [relese_type, section_values(config, 'staging_files')]
+        inputs.extend(section_values(config, patch.name)
+                      for patch in patch_runner.patches)
+        state.run('patch', inputs, lambda: patch_runner.run(journal),
+                  requires=('repositories',))
+
+    pipeline = Pipeline(estimate=estimate)
+    checked = ()
+    if preflight:
+        pipeline.add('preflight', Preflight(config, state).run)
+        checked = ('preflight',)
+    pipeline.add('repositories', prepare_repositories, requires=checked)
+    pipeline.add('patch', patch_repositories, requires=('repositories',))
+    # master and release runner clone the patched user repositories
+    pipeline.add('master', lambda: master.install(state, virtualenv),
+                 requires=('patch',))
+    pipeline.add('release-runner', lambda: release_runner.install(state),
+                 requires=('patch',))
+    # ship it comes from git.mozilla.org, it does not need user repos
+    pipeline.add('shipit', lambda: shipit.install(state), requires=checked)
+    return pipeline
+
+
+class Environment(object):
+    """a staging environment for a tracking bug (and a user)"""
+    def __init__(self, cfg, bug, release, version, username=None,
+                 resume=False, options=None, leased=None):
+        """reads the configuration file cfg; options is an optional
+           {(section, option): value} dictionary of values to override,
+           leased a dictionary of runtime values (ports) generated elsewhere.
+           Raises a StateError if the provisioning state is unreadable"""
+        config = Config()
+        config.read_from(cfg, leased)
+        config.set('common', 'tracking_bug', bug)
+        config.set('common', 'staging_release', release)
+        config.set('common', 'version', version)
+        if username:
+            config.set('common', 'username', username)
+        if options:
+            for (section, option), value in options.items():
+                config.set(section, option, value)
+        # steps completed by a previous run with the same inputs are skipped
+        state = ProvisioningState(state_file_path(config))
+        config.reuse_values(state.previous_values())
+        state.save_runtime_values(config)
+        log.debug(config)
+        try:
+            capture_kb = config.get('common', 'capture_kb')
+        except ConfigError:
+            capture_kb = None
+        if capture_kb:
+            set_capture_size(int(capture_kb) * 1024)
+        self.name = '{0}-{1}'.format(config.get('common', 'username'), bug)
+        # configuration name, e.g. staging-beta33
+        self.config_name = os.path.splitext(os.path.basename(cfg))[0]
+        self.configuration = config
+        self.state = state
+        self.journal = Journal(journal_file_path(config), resume=resume)
+
+    def pipeline(self, virtualenv=None, preflight=True, estimate=None):
+        """returns the pipeline that creates this environment"""
+        return staging_pipeline(self.configuration, self.state, self.journal,
+                                virtualenv, preflight, estimate)
+
+    def run(self, virtualenv=None, preflight=True, history=True):
+        """creates this environment, see pipeline().
+           With history, step timings are stored in the timing history
+           (common:history_db), the history estimates the remaining time
+           and slow steps are reported at the end"""
+        config = self.configuration
+        bug = config.get('common', 'tracking_bug')
+        # common:timeout_<class>, see lib.deadline
+        timeouts = deadline.timeouts(config)
+        timings = None
+        if history:
+            try:
+                timings = TimingHistory(history_file_path(config),
+                                        self.config_name)
+            except (sqlite3.Error, OSError) as error:
+                log.error('timing history disabled: {0}'.format(error))
+        if timings is None:
+            with context(bug=bug, environment=self.name, timeouts=timeouts):
+                self.pipeline(virtualenv, preflight).run()
+            return
+        try:
+            estimate = timings.estimate('pipeline')
+        except sqlite3.Error as error:
+            log.error('no time estimate: {0}'.format(error))
+            estimate = None
+        run = timings.run_id
+        # the timings come from the trace spans of this run
+        with context(bug=bug, environment=self.name, run=run,
+                     timeouts=timeouts), trace.recording(run):
+            try:
+                self.pipeline(virtualenv, preflight, estimate).run()
+            finally:
+                self._record_timings(timings)
+
+    def _record_timings(self, timings):
+        """stores the timings of this run and reports the slow steps"""
+        try:
+            threshold = self.configuration.get('common',
+                                               'regression_threshold')
+        except ConfigError:
+            threshold = None
+        threshold = float(threshold or 50) / 100
+        try:
+            recorded = timings.record_spans(trace.events(timings.run_id))
+            timings.report_regressions(recorded, threshold)
+        except sqlite3.Error as error:
+            log.error('cannot update the timing history: {0}'.format(error))
@@ -0,0 +1,171 @@
+"""
+provisioning state.
+Every provisioning step records a fingerprint of its inputs (configuration
+values, upstream revisions, requirement files...) in a state file under
+common:root. When the setup runs again, steps with an unchanged fingerprint
+are skipped, so changing a single value does not require a full rebuild.
+The state file also keeps the values generated at runtime (ship it password
+and ports) so they do not change between runs.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from lib.config import ConfigError
+from lib.trace import span
+from lib.logger import logger
+log = logger(__name__)
+
+# values generated by Config at runtime, reused by the next run
+RUNTIME_VALUES = (('shipit', 'password'),
+                  ('shipit', 'port'),
+                  ('master', 'http_port'),
+                  ('master', 'ssh_port'),
+                  ('master', 'pb_port'))
+
+
+class StateError(Exception):
+    """Generic provisioning state error"""
+    pass
+
+
+def fingerprint(inputs):
+    """returns a sha1 hex digest of inputs (anything json can serialize)"""
+    data = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def file_fingerprint(path):
+    """returns the sha1 of path content, None if path does not exist"""
+    if not os.path.isfile(path):
+        return None
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(65536), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def section_values(configuration, section, options=None):
+    """returns a {option: value} dictionary of the interpolated values of
+       section (only options, if set)"""
+    if options is None:
+        options = configuration.options(section)
+    return dict((option, configuration.get(section, option))
+                for option in options)
+
+
+def requirements_fingerprint(requirements, basedir=None):
+    """returns a list of (requirement, hash) where hash is the file
+       fingerprint for requirements files (relative to basedir) and None
+       for package names"""
+    if not isinstance(requirements, list):
+        requirements = [requirements]
+    result = []
+    for requirement in requirements:
+        path = requirement
+        if basedir and not os.path.isabs(path):
+            path = os.path.join(basedir, path)
+        result.append((requirement, file_fingerprint(path)))
+    return result
+
+
+def state_file_path(configuration):
+    """returns the path of the state file: common:state_file or
+       common:root/.staging_state.json"""
+    try:
+        path = configuration.get('common', 'state_file')
+    except ConfigError:
+        path = None
+    if not path:
+        path = os.path.join(configuration.get('common', 'root'),
+                            '.staging_state.json')
+    return path
+
+
+class ProvisioningState(object):
+    """fingerprints of the completed steps, stored in a json file"""
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+        self.runtime_values = {}
+        # steps can run in different threads (see lib.pipeline)
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """reads the state file, if it exists"""
+        if not os.path.exists(self.path):
+            log.debug('no provisioning state in {0}'.format(self.path))
+            return
+        try:
+            with open(self.path) as state_file:
+                state = json.load(state_file)
+        except (IOError, ValueError) as error:
+            msg = 'cannot read {0}: {1}'.format(self.path, error)
+            log.debug(msg)
+            raise StateError(msg)
+        self.fingerprints = state.get('fingerprints', {})
+        self.runtime_values = state.get('runtime_values', {})
+
+    def save(self):
+        """writes the state file (atomically)"""
+        with self._lock:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            state = {'fingerprints': self.fingerprints,
+                     'runtime_values': self.runtime_values}
+            temp_path = '{0}.tmp'.format(self.path)
+            with open(temp_path, 'w') as state_file:
+                json.dump(state, state_file, indent=2, sort_keys=True)
+            os.rename(temp_path, self.path)
+
+    def previous_values(self):
+        """returns the runtime values of the previous run, as
+           {(section, option): value}, see Config.reuse_values"""
+        values = {}
+        for key, value in self.runtime_values.items():
+            section, sep, option = key.partition(':')
+            values[(section, option)] = value
+        return values
+
+    def save_runtime_values(self, configuration):
+        """stores the runtime values of configuration for the next run"""
+        with self._lock:
+            for section, option in RUNTIME_VALUES:
+                try:
+                    value = configuration.get(section, option)
+                except ConfigError:
+                    continue
+                key = '{0}:{1}'.format(section, option)
+                self.runtime_values[key] = value
+            self.save()
+
+    def has(self, step):
+        """returns True if step has been completed in a previous run"""
+        return step in self.fingerprints
+
+    def run(self, step, inputs, function, requires=(), verify=None):
+        """runs function unless step has already been completed with the
+           same inputs. The fingerprints of the required steps are part of
+           the fingerprint, so a change in a step re-runs its dependents.
+           verify is an optional callable: if it returns False the step is
+           executed again (e.g. its output has been deleted)"""
+        with self._lock:
+            upstream = [self.fingerprints.get(name) for name in requires]
+            current = fingerprint([inputs, upstream])
+            up_to_date = self.fingerprints.get(step) == current
+        if up_to_date:
+            if verify is None or verify():
+                log.info('{0}: up to date, skipping'.format(step))
+                return False
+            log.info('{0}: up to date but verification failed'.format(step))
+        log.debug('{0}: fingerprint {1}'.format(step, current))
+        with span(step, 'state'):
+            function()
+        with self._lock:
+            self.fingerprints[step] = current
+            self.save()
+        return True
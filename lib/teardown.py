@@ -0,0 +1,114 @@
+"""
+removes a staging environment: user repositories and local trees
+(buildbot master, ship it, release runner).
+Local trees are renamed and then deleted by a background process, so the
+teardown does not wait for large directories to be removed.
+"""
+import os
+import subprocess
+import time
+
+from lib.repositories import Repositories
+from lib.state import state_file_path
+from lib.journal import journal_file_path
+from lib.logger import logger
+log = logger(__name__)
+
+# (section, option) of the local trees created by staging_setup.py
+LOCAL_TREES = (('master', 'basedir'),
+               ('shipit', 'basedir'),
+               ('release-runner', 'basedir'))
+
+
+class TeardownError(Exception):
+    """Generic Teardown error"""
+    pass
+
+
+def remove_in_background(path):
+    """renames path, so it can be created again right away, and removes
+       the renamed tree in a detached process.
+       Returns the renamed path"""
+    trash = '{0}.deleting-{1}-{2}'.format(path, os.getpid(), int(time.time()))
+    os.rename(path, trash)
+    log.debug('removing {0} in background'.format(trash))
+    devnull = open(os.devnull, 'w')
+    try:
+        # os.setsid: rm is not killed when we exit (or on ctrl+c)
+        subprocess.Popen(('rm', '-rf', trash), stdout=devnull,
+                         stderr=devnull, close_fds=True,
+                         preexec_fn=os.setsid)
+    finally:
+        devnull.close()
+    return trash
+
+
+class Teardown(object):
+    """removes user repositories and local trees of a configuration"""
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.root = os.path.realpath(configuration.get('common', 'root'))
+
+    def _check_path(self, path):
+        """raises a TeardownError if path is not inside common:root"""
+        real_path = os.path.realpath(path)
+        if real_path == self.root or \
+           not real_path.startswith(self.root + os.sep):
+            msg = "cowardly refusing to delete {0}".format(path)
+            msg = "{0}, it's not inside {1}".format(msg, self.root)
+            log.error(msg)
+            raise TeardownError(msg)
+
+    def remove_local_trees(self):
+        """removes the local trees in background.
+           Returns the list of removed trees"""
+        conf = self.configuration
+        removed = []
+        for section, option in LOCAL_TREES:
+            path = conf.get(section, option)
+            if not os.path.exists(path):
+                log.debug('{0} does not exist, skipping'.format(path))
+                continue
+            self._check_path(path)
+            log.info('removing {0}'.format(path))
+            remove_in_background(path)
+            removed.append(path)
+        return removed
+
+    def remove_state(self, *paths):
+        """removes state files (e.g. provisioning state and journal), the
+           next run starts from scratch"""
+        removed = []
+        for path in paths:
+            if os.path.exists(path):
+                log.info('removing {0}'.format(path))
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    def run(self, max_in_flight=4):
+        """removes repositories, local trees and state files.
+           Returns a list of messages summarizing what has been removed"""
+        conf = self.configuration
+        start = time.time()
+        summary = []
+        # renaming is fast, the actual removal runs in background while
+        # remote repositories are deleted
+        for path in self.remove_local_trees():
+            summary.append('local tree: {0} (removing in background)'.format(
+                path))
+        for path in self.remove_state(state_file_path(conf),
+                                      journal_file_path(conf)):
+            summary.append('state file: {0}'.format(path))
+        results = Repositories(conf).delete_all_repos(max_in_flight)
+        failed = [name for name, seconds, error in results
+                  if error is not None]
+        summary.append('remote repositories: {0} deleted, {1} failed'.format(
+            len(results) - len(failed), len(failed)))
+        summary.append('completed in {0:.1f}s'.format(time.time() - start))
+        for line in summary:
+            log.info(line)
+        if failed:
+            msg = 'failed to delete: {0}'.format(', '.join(sorted(failed)))
+            raise TeardownError(msg)
+        return summary
@@ -0,0 +1,165 @@
+"""
+timing spans, saved as a Chrome trace-event file (chrome://tracing,
+https://ui.perfetto.dev).
+Every span records its wall time, the cpu time of the child processes
+(hg, ssh, pip...) that terminated during the span and their max RSS, as
+reported by getrusage(RUSAGE_CHILDREN). Child resources are process wide:
+spans running at the same time in different threads share them.
+
+Tracing is disabled until enable() is called; disabled spans cost a
+function call. recording() traces a single run, for its timing history,
+without keeping its spans once the run is over.
+"""
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.logger import logger, current_context
+log = logger(__name__)
+
+_events = []
+# thread id => thread name
+_threads = {}
+_lock = threading.Lock()
+_enabled = False
+# enable() was called: the spans are kept until save()
+_kept = False
+# number of recording() blocks running
+_recordings = 0
+_start = time.time()
+
+
+def _start_recording():
+    global _enabled, _start
+    if _enabled:
+        return
+    del _events[:]
+    _threads.clear()
+    _start = time.time()
+    _enabled = True
+
+
+def enable():
+    """starts recording spans (if it's not already recording)"""
+    global _kept
+    with _lock:
+        _kept = True
+        _start_recording()
+
+
+def disable():
+    """stops recording spans"""
+    global _enabled, _kept
+    with _lock:
+        _enabled = False
+        _kept = False
+
+
+@contextmanager
+def recording(run):
+    """context manager: records the spans of the with block, the log
+       context must have run=run (see events()). Unless enable() was
+       called, the spans of run are dropped at the end of the block and
+       the last block stops recording: a long running process (see
+       lib.daemon) does not keep the spans of every run"""
+    global _enabled, _recordings
+    with _lock:
+        _recordings += 1
+        _start_recording()
+    try:
+        yield
+    finally:
+        with _lock:
+            _recordings -= 1
+            if not _kept:
+                _events[:] = [event for event in _events
+                              if event['args'].get('run') != run]
+                if not _recordings:
+                    _enabled = False
+                    _threads.clear()
+
+
+def _children_usage():
+    """returns (cpu seconds, max rss in KB) of the terminated children"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+@contextmanager
+def span(name, category='staging', **args):
+    """records the with block as a span called name, args are saved in
+       the trace (e.g. repo='tools') with the log context (bug,
+       environment, step...)"""
+    if not _enabled:
+        yield
+        return
+    start = time.time()
+    cpu_start, rss_start = _children_usage()
+    error = None
+    try:
+        yield
+    except Exception as exc:
+        error = exc
+        raise
+    finally:
+        end = time.time()
+        cpu_end, rss_end = _children_usage()
+        args = dict(current_context(), **args)
+        args['children_cpu_s'] = round(cpu_end - cpu_start, 3)
+        args['children_max_rss_kb'] = rss_end
+        if error is not None:
+            args['error'] = str(error)
+        thread = threading.current_thread()
+        event = {'name': name,
+                 'cat': category,
+                 'ph': 'X',
+                 'ts': int((start - _start) * 1e6),
+                 'dur': int((end - start) * 1e6),
+                 'pid': os.getpid(),
+                 'tid': thread.ident,
+                 'args': args}
+        with _lock:
+            _events.append(event)
+            _threads[thread.ident] = thread.name
+
+
+def traced(name, category='staging', **attributes):
+    """decorator for methods: records every call as a span.
+       attributes maps span arguments to attributes of self, e.g.
+       @traced('hg clone', repo='name') saves self.name as repo"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            span_args = dict((key, getattr(self, attribute, None))
+                             for key, attribute in attributes.items())
+            with span(name, category, **span_args):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def events(run=None):
+    """returns a copy of the recorded events, including the thread names.
+       With run, only the spans recorded with run in the log context"""
+    with _lock:
+        if run is not None:
+            return [event for event in _events
+                    if event['args'].get('run') == run]
+        names = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                  'tid': ident, 'args': {'name': name}}
+                 for ident, name in _threads.items()]
+        return names + list(_events)
+
+
+def save(path):
+    """writes the recorded spans to path (trace-event json format)"""
+    trace = {'traceEvents': events(),
+             'displayTimeUnit': 'ms',
+             'otherData': {'start': _start}}
+    with open(path, 'w') as trace_file:
+        json.dump(trace, trace_file)
+    log.info('trace saved in {0}'.format(path))
@@ -0,0 +1,152 @@
+"""
+repository transports: how the remote repositories are created, deleted,
+queried, cloned and pushed to.
+
+ * SshTransport (default): ssh hg.mozilla.org clone/edit for the user
+   repositories, hg for everything else
+ * LocalTransport: mozilla and user repositories are directories
+   (common:hg_m_o and common:hg_user_repo), for dry runs and benchmarks
+
+common:transport selects the transport, see transport_for().
+"""
+import os
+import shutil
+
+from lib.config import ConfigError
+from lib.capture import OutputCapture
+import lib.deadline as deadline
+from lib.lazy import lazy_import
+from lib.logger import logger
+log = logger(__name__)
+sh = lazy_import('sh')
+
+HG_M_O = 'hg.mozilla.org'
+
+
+class TransportError(Exception):
+    """Generic Transport error"""
+    pass
+
+
+class Transport(object):
+    """operations on remote repositories. Remote user repositories are
+       named as in hg.mozilla.org (e.g. tools-9999), mozilla repositories
+       by their path (e.g. build/tools).
+       The hg operations are shared; subclasses implement:
+        * remote_clone(dst, src): creates the user repository dst as a
+          copy of the mozilla repository src
+        * remote_delete(dst): deletes the user repository dst, returns
+          False if it does not exist"""
+    def remote_revision(self, url, branch='default'):
+        """returns the current revision of branch in the repository url"""
+        cmd = ('identify', '-r', branch, url)
+        log.debug('running hg %s', ' '.join(cmd))
+        try:
+            revision = deadline.run_command('clone', sh.hg, cmd,
+                                            _tty_out=False)
+        except sh.ErrorReturnCode as error:
+            raise TransportError('identify failed: {0}'.format(error))
+        return str(revision).strip()
+
+    def local_clone(self, url, dst_dir, branch='default'):
+        """clones branch of the repository url in dst_dir"""
+        cmd = ('clone', '-b', branch, url, dst_dir)
+        try:
+            with OutputCapture('hg clone') as output:
+                for line in deadline.command_lines('clone', sh.hg, cmd):
+                    output.feed(line)
+        except sh.ErrorReturnCode as error:
+            msg = 'clone failed: hg {0} - error: {1}'.format(' '.join(cmd),
+                                                             error)
+            raise TransportError(msg)
+
+    def push(self, checkout_dir):
+        """pushes the changes of checkout_dir to its default-push path"""
+        try:
+            for line in deadline.command_lines('clone', sh.hg, 'push',
+                                               _cwd=checkout_dir):
+                log.debug(line.strip())
+        except sh.ErrorReturnCode as error:
+            raise TransportError('push failed: {0}'.format(error))
+
+
+class SshTransport(Transport):
+    """hg.mozilla.org: user repositories are managed with ssh commands"""
+    def __init__(self, host=HG_M_O):
+        self.host = host
+
+    def _ssh(self, cmd):
+        """runs ssh host cmd, logging its output"""
+        cmd = (self.host,) + tuple(cmd)
+        log.debug('running ssh %s', ' '.join(cmd))
+        for line in deadline.command_lines('ssh', sh.ssh, cmd):
+            log.debug(line.strip())
+
+    def remote_clone(self, dst, src):
+        try:
+            self._ssh(('clone', dst, src))
+        except sh.ErrorReturnCode as error:
+            msg = 'ssh clone {0} {1} failed: {2}'.format(dst, src, error)
+            raise TransportError(msg)
+
+    def remote_delete(self, dst):
+        try:
+            self._ssh(('edit', dst, 'delete', 'YES'))
+        except sh.ErrorReturnCode_1:
+            # hg.mozilla.org: the repository does not exist
+            return False
+        except sh.ErrorReturnCode as error:
+            raise TransportError('ssh edit {0} delete failed: {1}'.format(
+                dst, error))
+        return True
+
+
+class LocalTransport(Transport):
+    """mozilla repositories are in root, user repositories in user_dir"""
+    def __init__(self, root, user_dir):
+        self.root = root
+        self.user_dir = user_dir
+
+    def remote_clone(self, dst, src):
+        src_dir = os.path.join(self.root, src)
+        dst_dir = os.path.join(self.user_dir, dst)
+        if os.path.exists(dst_dir):
+            raise TransportError('{0} already exists'.format(dst_dir))
+        if not os.path.isdir(self.user_dir):
+            os.makedirs(self.user_dir)
+        # no working directory, like the repositories on hg.mozilla.org;
+        # hg hard links the files of local clones
+        cmd = ('clone', '--noupdate', src_dir, dst_dir)
+        try:
+            with OutputCapture('hg clone') as output:
+                for line in deadline.command_lines('clone', sh.hg, cmd):
+                    output.feed(line)
+        except sh.ErrorReturnCode as error:
+            raise TransportError('clone of {0} failed: {1}'.format(src_dir,
+                                                                   error))
+
+    def remote_delete(self, dst):
+        dst_dir = os.path.join(self.user_dir, dst)
+        if not os.path.isdir(dst_dir):
+            return False
+        try:
+            shutil.rmtree(dst_dir)
+        except OSError as error:
+            raise TransportError('cannot delete {0}: {1}'.format(dst_dir,
+                                                                 error))
+        return True
+
+
+def transport_for(configuration):
+    """returns the transport of configuration: common:transport is ssh
+       (default) or local"""
+    try:
+        name = configuration.get('common', 'transport') or 'ssh'
+    except ConfigError:
+        name = 'ssh'
+    if name == 'ssh':
+        return SshTransport()
+    if name == 'local':
+        return LocalTransport(configuration.get('common', 'hg_m_o'),
+                              configuration.get('common', 'hg_user_repo'))
+    raise ConfigError('unknown transport: {0}'.format(name))
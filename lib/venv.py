@@ -1,5 +1,9 @@
 import os
 from lib.which import which
+from lib.config import ConfigError
+import lib.budget as budget
+from lib.capture import OutputCapture
+from lib.trace import traced
 import subprocess
 
 from lib.logger import logger
@@ -48,6 +52,11 @@ class Virtualenv(object):
     def _pip_path(self):
         return self._get_path('pip')
 
+    def attach(self, dst_dir):
+        """uses the virtualenv already created in dst_dir"""
+        self.basedir = dst_dir
+
+    @traced('virtualenv create', 'virtualenv')
     def create(self, dst_dir, extra_args=None):
         """creates a virtualenv in dst_dir and installs
            the required packages from requirements_file
@@ -60,21 +69,34 @@ class Virtualenv(object):
 
         cmd = [self._executable()] + extra_args + [self.basedir]
         log.info('creating virtualenv')
+        with budget.slot(budget.CPU):
+            try:
+                venv = subprocess.Popen(cmd, cwd=self.basedir,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+            except OSError as error:
+                log.debug('Error executing:')
+                log.debug('cmd: {0}'.format(' '.join(cmd)))
+                log.debug('cwd: {0}'.format(self.basedir))
+                raise VirtualenvError(error)
+
+            returncode = OutputCapture('virtualenv').feed_process(venv, 'pip')
+        if returncode != 0:
+            msg = 'virtualenv failed: exit code {0}'.format(returncode)
+            raise VirtualenvError(msg)
+
+    def make_relocatable(self):
+        """makes the virtualenv relocatable, so it can be moved (e.g. a
+           virtualenv pre-built by the staging daemon)"""
+        cmd = [self._executable(), '--relocatable', self.basedir]
+        log.debug('running {0}'.format(' '.join(cmd)))
         try:
-            venv = subprocess.Popen(cmd, cwd=self.basedir,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT)
-        except OSError as error:
-            log.debug('Error executing:')
-            log.debug('cmd: {0}'.format(' '.join(cmd)))
-            log.debug('cwd: {0}'.format(self.basedir))
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call(cmd, stdout=devnull,
+                                      stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError) as error:
             raise VirtualenvError(error)
 
-        while True:
-            log.debug(venv.stdout.readline().strip())
-            if venv.poll() is not None:
-                break
-
     def setup_py(self, setup_py_path, options):
         """runs setup.py in the current virtualenv, using options"""
         log.info('running: {0} {1}'.format(setup_py_path, ' '.join(options)))
@@ -84,20 +106,43 @@ class Virtualenv(object):
         log.debug('executing: {0} in {1}'.format(' '.join(cmd), cwd))
         setup = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE,
                                  stderr=subprocess.STDOUT)
-        while True:
-            log.debug(setup.stdout.readline().strip())
-            if setup.poll() is not None:
-                break
-
+        output = OutputCapture('setup.py {0}'.format(' '.join(options)))
+        returncode = output.feed_process(setup, 'setup')
+        if returncode != 0:
+            msg = 'setup.py {0} failed: exit code {1}'.format(
+                ' '.join(options), returncode)
+            raise VirtualenvError(msg)
+
+    @traced('pip install', 'virtualenv', basedir='basedir')
     def _install(self, install_cmd):
         cmd = [self._pip_path()] + install_cmd
         log.debug('running {0} cwd={1}'.format(' '.join(cmd), self.basedir))
-        pip = subprocess.Popen(cmd, cwd=self.basedir, stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT)
-        while True:
-            log.debug(pip.stdout.readline().strip())
-            if pip.poll() is not None:
-                break
+        with budget.slot(budget.CPU):
+            pip = subprocess.Popen(cmd, cwd=self.basedir,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   env=self._pip_env())
+            output = OutputCapture('pip {0}'.format(install_cmd[0]))
+            returncode = output.feed_process(pip, 'pip')
+        if returncode != 0:
+            msg = 'pip {0} failed: exit code {1}'.format(install_cmd[0],
+                                                        returncode)
+            raise VirtualenvError(msg)
+
+    def _pip_env(self):
+        """returns the environment for pip: if common:pip_cache is set,
+           downloads and wheels are cached there (and shared between
+           virtualenvs)"""
+        env = dict(os.environ)
+        try:
+            pip_cache = self.configuration.get('common', 'pip_cache')
+        except ConfigError:
+            pip_cache = None
+        if pip_cache:
+            # old pip versions use PIP_DOWNLOAD_CACHE, new ones PIP_CACHE_DIR
+            env['PIP_DOWNLOAD_CACHE'] = pip_cache
+            env['PIP_CACHE_DIR'] = pip_cache
+        return env
 
     def install_dependency(self, dependency):
         if os.path.exists(dependency):
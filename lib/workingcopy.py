@@ -0,0 +1,65 @@
+"""
+persistent working copies.
+A working copy is a local checkout of a (repository, branch) pair that is
+kept between runs, so it can be refreshed with a pull instead of being
+cloned from scratch every time. Working copies are used under a file lock,
+so two runs cannot patch the same checkout at the same time.
+"""
+import fcntl
+import os
+
+from lib.logger import logger
+log = logger(__name__)
+
+
+class WorkingCopyError(Exception):
+    """Generic WorkingCopy error"""
+    pass
+
+
+class WorkingCopy(object):
+    """a named, locked, checkout of repository/branch in basedir"""
+    def __init__(self, basedir, repository, branch):
+        self.basedir = basedir
+        self.repository = repository
+        self.branch = branch
+        name = '{0}-{1}'.format(repository, branch)
+        self.path = os.path.join(basedir, name)
+        self.lock_path = '{0}.lock'.format(self.path)
+        self._lock = None
+
+    def exists(self):
+        """returns True if there is a checkout that can be refreshed"""
+        return os.path.isdir(os.path.join(self.path, '.hg'))
+
+    def acquire(self):
+        """takes the lock on this working copy, blocks if another run is
+           using it"""
+        if self._lock is not None:
+            return
+        if not os.path.isdir(self.basedir):
+            try:
+                os.makedirs(self.basedir)
+            except OSError as error:
+                msg = 'Cannot create: {0} ({1})'.format(self.basedir, error)
+                log.debug(msg)
+                raise WorkingCopyError(msg)
+        log.debug('locking working copy: {0}'.format(self.path))
+        lock = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        except IOError as error:
+            lock.close()
+            msg = 'Cannot lock: {0} ({1})'.format(self.lock_path, error)
+            log.debug(msg)
+            raise WorkingCopyError(msg)
+        self._lock = lock
+
+    def release(self):
+        """releases the lock on this working copy"""
+        if self._lock is None:
+            return
+        log.debug('unlocking working copy: {0}'.format(self.path))
+        fcntl.flock(self._lock.fileno(), fcntl.LOCK_UN)
+        self._lock.close()
+        self._lock = None
@@ -4,13 +4,18 @@
 # https://wiki.mozilla.org/ReleaseEngineering/How_To/Setup_Personal_Development_Master#Create_a_build_master
 import os
 from lib.config import Config
-from lib.repositories import Repositories, RepositoryError
-from lib.patch import PatchBuildbotConfigs, PatchTools, PatchError
-from lib.logger import logger
+from lib.repositories import Repositories
+from lib.patch import PatchBuildbotConfigs, PatchTools, PatchRunner
+from lib.patch import PatchError
+from lib.manifest import StagingManifest
+from lib.journal import Journal, journal_file_path
+from lib.preflight import Preflight, PreflightError, REPOSITORY_CHECKS
+from lib.logger import logger, setup as setup_logging
 import argparse
 
 if __name__ == '__main__':
 
+    setup_logging()
     log = logger('staging release')
 
     parser = argparse.ArgumentParser()
@@ -21,6 +26,10 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--release', help=msg, required=True)
     msg = 'username: if not specified, whoami will be used'
     parser.add_argument('-u', '--username', help=msg)
+    msg = 'resume an interrupted run, skipping the completed steps'
+    parser.add_argument('--resume', help=msg, action='store_true')
+    msg = 'skip the preflight checks'
+    parser.add_argument('--skip-preflight', help=msg, action='store_true')
     args = parser.parse_args()
 
     # reading configuration
@@ -37,14 +46,27 @@ if __name__ == '__main__':
     # prepare buildbot-configs and tools to be patched
     # info about patching are inside the patch-<repository> section
     # and we need to pass it to our Patch objects
-    patch_bc = PatchBuildbotConfigs(config, relese_type, 'patch-buildbot-configs')
-    patch_tools = PatchTools(config, relese_type, 'patch-tools')
+    manifest = StagingManifest(config, relese_type)
+    patch_bc = PatchBuildbotConfigs(config, relese_type,
+                                    'patch-buildbot-configs', manifest)
+    patch_tools = PatchTools(config, relese_type, 'patch-tools', manifest)
+    # buildbot-configs and tools are different repositories,
+    # patch them at the same time
+    patch_runner = PatchRunner()
+    patch_runner.register(patch_bc)
+    patch_runner.register(patch_tools)
     repositories = Repositories(config)
+    journal = Journal(journal_file_path(config), resume=args.resume)
     try:
-        # repositories.prepare_user_repos()
-        patch_bc.fix()
-        patch_tools.fix()
+        if not args.skip_preflight:
+            # no master, ship it or release runner here: only the checks
+            # of the repositories
+            Preflight(config, checks=REPOSITORY_CHECKS).run()
+    except PreflightError as error:
+        log.error(error)
+        raise SystemExit(1)
+    try:
+        # repositories.prepare_user_repos(journal)
+        patch_runner.run(journal)
     except PatchError as error:
         log.error('unable to patch user repositories: {0}'.format(error))
-    except RepositoryError as error:
-        log.error('unable to create user repositories: {0}'.format(error))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""saves and restores snapshots of a provisioned staging root"""
+from lib.config import Config
+from lib.snapshot import Snapshot, SnapshotError, list_snapshots
+from lib.state import ProvisioningState, StateError, state_file_path
+from lib.logger import logger, setup as setup_logging
+import argparse
+
+if __name__ == '__main__':
+
+    setup_logging()
+    log = logger('staging release')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--cfg', help='configuration file', required=True)
+    parser.add_argument('-b', '--bug', help='bug tracking id', required=True)
+    msg = 'username: if not specified, whoami will be used'
+    parser.add_argument('-u', '--username', help=msg)
+    parser.add_argument('action', choices=('save', 'restore', 'list'))
+    parser.add_argument('name', help='snapshot name', nargs='?',
+                        default='provisioned')
+    args = parser.parse_args()
+
+    # reading configuration
+    config = Config()
+    config.read_from(args.cfg)
+    config.set('common', 'tracking_bug', args.bug)
+    if args.username:
+        config.set('common', 'username', args.username)
+    # ports and password of the current environment (if any)
+    try:
+        state = ProvisioningState(state_file_path(config))
+    except StateError as error:
+        log.error('unable to read provisioning state: {0}'.format(error))
+        raise SystemExit(1)
+    config.reuse_values(state.previous_values())
+    log.debug(config)
+
+    if args.action == 'list':
+        for name in list_snapshots(config):
+            log.info(name)
+        raise SystemExit(0)
+    snapshot = Snapshot(config, args.name)
+    try:
+        if args.action == 'save':
+            snapshot.save()
+        else:
+            snapshot.restore()
+    except SnapshotError as error:
+        log.error('{0} failed: {1}'.format(args.action, error))
+        raise SystemExit(1)
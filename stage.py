@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""creates, patches and installs everything needed for a staging release:
+   repos_setup.py and staging_setup.py in a single run"""
+# https://wiki.mozilla.org/Release:Release_Automation_on_Mercurial:Staging_Specific_Notes
+# https://wiki.mozilla.org/ReleaseEngineering/How_To/Setup_Personal_Development_Master#Create_a_build_master
+from lib.staging import Environment
+from lib.pipeline import PipelineError
+from lib.state import StateError
+import lib.budget as budget
+import lib.deadline as deadline
+import lib.trace as trace
+from lib.logger import logger, setup as setup_logging
+import argparse
+
+
+if __name__ == '__main__':
+
+    setup_logging()
+    log = logger('staging release')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--cfg', help='configuration file', required=True)
+    parser.add_argument('-b', '--bug', help='bug tracking id', required=True)
+    parser.add_argument('-v', '--version', help='version', required=True)
+    msg = 'staging release comma separated values (e.g: firefox,fennec)'
+    parser.add_argument('-r', '--release', help=msg, required=True)
+    msg = 'username: if not specified, whoami will be used'
+    parser.add_argument('-u', '--username', help=msg)
+    msg = 'resume an interrupted run, skipping the completed steps'
+    parser.add_argument('--resume', help=msg, action='store_true')
+    msg = 'writes a trace-event file (chrome://tracing) of the run'
+    parser.add_argument('--trace', help=msg)
+    msg = 'do not use and update the step timing history'
+    parser.add_argument('--no-history', help=msg, action='store_true')
+    msg = 'skip the preflight checks'
+    parser.add_argument('--skip-preflight', help=msg, action='store_true')
+    msg = 'maximum number of concurrent clones and of concurrent installs ' \
+          '(default: from the cpus, load and memory of the host)'
+    parser.add_argument('-j', '--jobs', help=msg, type=int)
+    msg = 'cancels the run after this many minutes (resume it with --resume)'
+    parser.add_argument('--deadline', help=msg, type=float)
+    args = parser.parse_args()
+
+    try:
+        environment = Environment(args.cfg, args.bug, args.release,
+                                  args.version, args.username, args.resume)
+    except StateError as error:
+        log.error('unable to read provisioning state: {0}'.format(error))
+        raise SystemExit(1)
+    if args.trace:
+        trace.enable()
+    if args.deadline:
+        deadline.set_deadline(args.deadline * 60)
+    budget.adapt(args.jobs)
+    try:
+        environment.run(preflight=not args.skip_preflight,
+                        history=not args.no_history)
+    except PipelineError as error:
+        log.error('staging release setup failed: {0}'.format(error))
+    finally:
+        if args.trace:
+            trace.save(args.trace)
@@ -10,11 +10,13 @@ from lib.config import Config
 from lib.master import Master, MasterError
 from lib.shipit import Shipit, ShipitError
 from lib.releaserunner import ReleaseRunner, ReleaseRunnerError
-from lib.logger import logger
+from lib.state import ProvisioningState, StateError, state_file_path
+from lib.logger import logger, setup as setup_logging
 import argparse
 
 if __name__ == '__main__':
 
+    setup_logging()
     log = logger('staging release')
 
     parser = argparse.ArgumentParser()
@@ -35,15 +37,23 @@ if __name__ == '__main__':
     config.set('common', 'staging_release', args.release)
     if args.username:
         config.set('common', 'username', args.username)
+    # steps completed by a previous run with the same inputs are skipped
+    try:
+        state = ProvisioningState(state_file_path(config))
+    except StateError as error:
+        log.error('unable to read provisioning state: {0}'.format(error))
+        raise SystemExit(1)
+    config.reuse_values(state.previous_values())
+    state.save_runtime_values(config)
     log.debug(config)
     master = Master(config)
     shipit = Shipit(config)
     releaseR = ReleaseRunner(config)
     relese_type = config.get_list('common', 'staging_release')
     try:
-        master.install()
-        shipit.install()
-        releaseR.install()
+        master.install(state)
+        shipit.install(state)
+        releaseR.install(state)
     except MasterError as error:
         log.error('unable to install buildbot master: {0}'.format(error))
     except ShipitError as error:
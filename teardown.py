@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""removes a staging environment: user repositories, buildbot master,
+   ship it and release runner"""
+from lib.config import Config
+from lib.teardown import Teardown, TeardownError
+from lib.logger import logger, setup as setup_logging
+import argparse
+
+if __name__ == '__main__':
+
+    setup_logging()
+    log = logger('staging release')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--cfg', help='configuration file', required=True)
+    parser.add_argument('-b', '--bug', help='bug tracking id', required=True)
+    msg = 'username: if not specified, whoami will be used'
+    parser.add_argument('-u', '--username', help=msg)
+    msg = 'maximum number of concurrent ssh commands (default: 4)'
+    parser.add_argument('-j', '--jobs', help=msg, type=int, default=4)
+    args = parser.parse_args()
+
+    # reading configuration
+    config = Config()
+    config.read_from(args.cfg)
+    config.set('common', 'tracking_bug', args.bug)
+    if args.username:
+        config.set('common', 'username', args.username)
+    log.debug(config)
+    try:
+        Teardown(config).run(max_in_flight=args.jobs)
+    except TeardownError as error:
+        log.error('teardown failed: {0}'.format(error))
@@ -12,7 +12,7 @@ from lib.master import MasterJson
 #from lib.releaserunner import ReleaseRunner, ReleaseRunnerError
 from lib.buildbotconfigs import BuildbotConfigs
 #from lib.buildbotconfigs import BuildbotConfigs, BuildbotConfigsError
-from lib.logger import logger
+from lib.logger import logger, setup as setup_logging
 #import lib.locales as locales
 import argparse
 
@@ -45,6 +45,7 @@ def release_files(configuration):
 
 if __name__ == '__main__':
 
+    setup_logging()
     log = logger('staging release')
 
     parser = argparse.ArgumentParser()
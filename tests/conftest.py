@@ -0,0 +1,39 @@
+import os
+import subprocess
+
+import pytest
+
+from lib.benchmark import Benchmark
+
+
+def _has_mercurial():
+    try:
+        output = subprocess.check_output(('hg', 'version'))
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return 'Mercurial' in output
+
+
+HAS_MERCURIAL = _has_mercurial()
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'hg: the test runs mercurial')
+
+
+def pytest_runtest_setup(item):
+    if item.get_closest_marker('hg') is not None and not HAS_MERCURIAL:
+        pytest.skip('needs mercurial')
+
+
+@pytest.fixture
+def benchmark(tmpdir):
+    """returns a function: transport => a Benchmark of
+       config/staging-beta33.ini in tmpdir, with its overrides written"""
+    def _benchmark(transport='ssh'):
+        result = Benchmark('config/staging-beta33.ini', str(tmpdir.join('w')),
+                           transport=transport)
+        os.makedirs(result.workdir)
+        result.write_overrides()
+        return result
+    return _benchmark
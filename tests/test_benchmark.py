@@ -0,0 +1,71 @@
+import os
+import subprocess
+
+import pytest
+
+from lib.benchmark import (compare, make_repo, repository_contents,
+                           span_summary)
+from lib.fakehgmo import main as fakehgmo
+
+
+def test_fakehgmo(tmpdir):
+    root = str(tmpdir.join('root'))
+    user_dir = str(tmpdir.join('users'))
+    args = [root, user_dir, 'hg.mozilla.org']
+    assert fakehgmo(args + ['edit', 'tools-1', 'delete', 'YES']) == 1
+    assert fakehgmo(args + ['clone', 'tools-1', 'build/tools']) == 1
+    assert fakehgmo(args + ['rm', '-rf', '/']) == 1
+    assert fakehgmo([root, user_dir, 'example.com', 'edit']) == 255
+    tmpdir.join('users', 'tools-1', '.hg').ensure(dir=True)
+    assert fakehgmo(args + ['edit', 'tools-1', 'delete', 'YES']) == 0
+    assert not os.path.exists(os.path.join(user_dir, 'tools-1'))
+
+
+def test_configuration(benchmark):
+    benchmark = benchmark()
+    config = benchmark.configuration()
+    assert config.get('tools', 'mozilla_repo') == os.path.join(
+        benchmark.root, 'build', 'tools')
+    assert config.get('tools', 'user_repo') == os.path.join(
+        benchmark.user_dir, 'tools-1000000')
+    assert config.get('locales', 'url').startswith('file://')
+    contents = repository_contents(config, 'buildbot-configs')
+    assert 'mozilla/staging_config.py' in contents
+    assert "tools_repo_path = 'build/tools'" in contents[
+        'mozilla/staging_config.py']
+
+
+def test_compare():
+    old = {'parameters': {}, 'stages': [
+        {'stage': 'patch', 'wall_s': 10.0, 'repos_per_min': 12.0,
+         'peak_rss_kb': 1000, 'children_peak_rss_kb': 500}]}
+    new = {'parameters': {}, 'stages': [
+        {'stage': 'patch', 'wall_s': 15.0, 'repos_per_min': 8.0,
+         'peak_rss_kb': 1000, 'children_peak_rss_kb': 0},
+        {'stage': 'master', 'wall_s': 1.0}]}
+    rows = compare(old, new)
+    assert rows[0] == ('patch', 'wall_s', 10.0, 15.0, 50.0)
+    assert rows[2] == ('patch', 'peak_rss_kb', 1000, 1000, 0.0)
+    assert len(rows) == 4
+
+
+def test_span_summary():
+    events = [{'ph': 'M', 'name': 'thread_name'},
+              {'ph': 'X', 'cat': 'repository', 'name': 'hg clone',
+               'dur': 1500000},
+              {'ph': 'X', 'cat': 'repository', 'name': 'hg clone',
+               'dur': 500000}]
+    assert span_summary(events) == {
+        'repository:hg clone': {'count': 2, 'seconds': 2.0}}
+
+
+@pytest.mark.hg
+def test_make_repo(tmpdir):
+    path = str(tmpdir.join('tools'))
+    make_repo(path, files=10, file_kb=1, commits=3, branches=('production',),
+              contents={'mozilla/config.py': 'build/tools\n'})
+    branches = subprocess.check_output(('hg', 'branches', '-q'), cwd=path)
+    assert sorted(branches.split()) == ['default', 'production']
+    files = subprocess.check_output(('hg', 'files', '-r', 'default'),
+                                    cwd=path).split()
+    assert len(files) == 12
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+import lib.budget as budget
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    budget.set_budget(None)
+    yield
+    budget.set_budget(None)
+
+
+def test_host_limits():
+    assert budget.host_limits(4) == {budget.CPU: 4, budget.NETWORK: 8}
+    # a busy host
+    assert budget.host_limits(4, load=3.5) == {budget.CPU: 1,
+                                               budget.NETWORK: 2}
+    assert budget.host_limits(32)[budget.NETWORK] == budget.NETWORK_MAX
+    # low memory: 512MB per cpu operation, 256MB per network operation
+    assert budget.host_limits(8, load=0, memory=1024) == {budget.CPU: 2,
+                                                          budget.NETWORK: 4}
+    assert budget.host_limits(8, memory=0) == {budget.CPU: 1,
+                                               budget.NETWORK: 1}
+    assert budget.host_limits(8, maximum=3) == {budget.CPU: 3,
+                                                budget.NETWORK: 3}
+
+
+def test_host_resources(tmpdir):
+    loadavg = tmpdir.join('loadavg')
+    loadavg.write('1.52 0.91 0.42 2/345 6789\n')
+    assert budget.load_average(str(loadavg)) == 1.52
+    meminfo = tmpdir.join('meminfo')
+    meminfo.write('MemTotal:  8000000 kB\nMemFree:  1000000 kB\n'
+                  'MemAvailable:  2048000 kB\n')
+    assert budget.available_memory(str(meminfo)) == 2000
+    assert budget.load_average(str(tmpdir.join('missing'))) is None
+    assert budget.available_memory(str(tmpdir.join('missing'))) is None
+
+
+def test_adapt():
+    budget.adapt(maximum=2)
+    assert 1 <= budget.limit(budget.CPU) <= 2
+    assert 1 <= budget.limit(budget.NETWORK) <= 2
+    budget.set_budget(5)
+    assert budget.limit(budget.CPU) == 5
+    budget.set_budget(None)
+    assert budget.limit(budget.CPU) is None
+
+
+def test_slot_resize():
+    budget.set_budget(1)
+    running = []
+    peak = []
+
+    def _work():
+        with budget.slot(budget.CPU):
+            running.append(1)
+            peak.append(len(running))
+            time.sleep(0.1)
+            running.pop()
+
+    threads = [threading.Thread(target=_work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    # waiting operations start as soon as the pool grows
+    budget.set_budget(4)
+    for thread in threads:
+        thread.join()
+    assert max(peak) > 1
+    assert peak[0] == 1
+
+
+def test_slot_count():
+    with budget.slot(budget.CPU, 3) as held:
+        # no limit
+        assert held == 3
+    budget.set_budget(2)
+    with budget.slot(budget.CPU, 3) as held:
+        # capped at the size of the pool
+        assert held == 2
+        assert budget._limiters[budget.CPU].in_use == 2
+    assert budget._limiters[budget.CPU].in_use == 0
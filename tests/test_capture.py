@@ -0,0 +1,42 @@
+import subprocess
+import pytest
+from lib.capture import RingBuffer, OutputCapture
+
+
+def test_ring_buffer():
+    ring = RingBuffer(10)
+    for line in ('aaaa', 'bbbb', 'cccc', 'dd'):
+        ring.append(line)
+    assert ring.lines() == ['bbbb', 'cccc', 'dd']
+    assert ring.size == 10
+    assert ring.dropped == 1
+    # a single line longer than the buffer is kept
+    ring.append('x' * 20)
+    assert ring.lines() == ['x' * 20]
+
+
+def test_counters():
+    with OutputCapture('test', max_bytes=8) as output:
+        for i in range(100):
+            output.feed('line {0}\n'.format(i))
+    assert output.lines == 100
+    assert output.bytes == sum(len('line {0}\n'.format(i))
+                               for i in range(100))
+    assert output.buffer.lines() == ['line 99']
+
+
+def test_failure_dumps_output(monkeypatch):
+    dumped = []
+    monkeypatch.setattr(OutputCapture, 'failed',
+                        lambda self, reason: dumped.append(reason))
+    with pytest.raises(ValueError):
+        with OutputCapture('test') as output:
+            output.feed('cloning')
+            raise ValueError('timeout')
+    assert len(dumped) == 1
+    process = subprocess.Popen(('sh', '-c', 'echo one; echo two; exit 3'),
+                               stdout=subprocess.PIPE)
+    output = OutputCapture('sh')
+    assert output.feed_process(process) == 3
+    assert output.buffer.lines() == ['one', 'two']
+    assert dumped[-1] == 'exit code 3'
@@ -1,5 +1,6 @@
 from lib.config import generate_random_password
 from lib.config import Config, ConfigError
+import lib.ports as ports
 import pytest
 
 
@@ -20,3 +21,42 @@ def test_config():
         config.read_from('tests/bad_config.ini')
 
     config.read_from('tests/good_config.ini')
+
+
+def test_reuse_values():
+    config = Config()
+    config.read_from('tests/good_config.ini')
+    assert ('shipit', 'password') in config.generated
+    config.reuse_values({('shipit', 'password'): 'PREVIOUS',
+                         ('common', 'tracking_bug'): '1'})
+    assert config.get('shipit', 'password') == 'PREVIOUS'
+    # not generated at runtime, left untouched
+    assert config.get('common', 'tracking_bug') == ''
+
+
+def test_reuse_ports():
+    config = Config()
+    config.read_from('tests/good_config.ini')
+    generated = int(config.get('shipit', 'port'))
+    assert generated in ports.reserved()
+    previous = generated + 1
+    config.reuse_values({('shipit', 'port'): str(previous)})
+    assert config.get('shipit', 'port') == str(previous)
+    assert generated not in ports.reserved()
+    assert previous in ports.reserved()
+    ports.release(previous)
+
+
+def test_reuse_reserved_ports():
+    first = Config()
+    first.read_from('tests/good_config.ini')
+    second = Config()
+    second.read_from('tests/good_config.ini')
+    taken = first.get('shipit', 'port')
+    generated = second.get('shipit', 'port')
+    # the previous run of second used the port first has just picked
+    second.reuse_values({('shipit', 'port'): taken})
+    assert second.get('shipit', 'port') == generated
+    assert int(generated) in ports.reserved()
+    assert int(taken) in ports.reserved()
+    ports.release(int(taken), int(generated))
@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+from lib.daemon import WarmPool, StagingDaemon, send_request
+
+
+def test_warm_pool():
+    created = []
+
+    def create():
+        created.append(len(created))
+        return created[-1]
+
+    pool = WarmPool('numbers', 2, create)
+    assert pool.take() is None
+    pool.refill()
+    assert len(pool) == 2
+    assert pool.take() == 0
+    pool.refill()
+    assert created == [0, 1, 2]
+    pool.put(0)
+    assert len(pool) == 3
+
+
+def test_requests(tmpdir):
+    socket_path = os.path.join(str(tmpdir), 'staging.sock')
+    cfg = os.path.join(os.path.dirname(__file__), 'good_config.ini')
+    daemon = StagingDaemon(cfg, socket_path, str(tmpdir.join('pool')),
+                           port_sets=0, virtualenvs=0)
+    server = threading.Thread(target=daemon.serve_forever)
+    server.start()
+    try:
+        for attempt in range(50):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.1)
+        reply = send_request(socket_path, {'command': 'status'})
+        assert reply == {'status': 'ok', 'ports': 0, 'virtualenvs': 0,
+                         'running': []}
+        reply = send_request(socket_path, {'command': 'reboot'})
+        assert reply['status'] == 'error'
+        reply = send_request(socket_path, {'command': 'provision'})
+        assert 'missing' in reply['error']
+    finally:
+        daemon.stop()
+        server.join()
+    assert not os.path.exists(socket_path)
+
+
+def test_failed_virtualenv_is_removed(tmpdir):
+    cfg = os.path.join(os.path.dirname(__file__), 'good_config.ini')
+    with open(cfg) as src:
+        content = src.read()
+    # a virtualenv executable that always fails
+    failing_cfg = tmpdir.join('failing.ini')
+    failing_cfg.write(content.replace('binaries=virtualenv-2.6,virtualenv',
+                                      'binaries=false'))
+    pool_dir = tmpdir.join('pool')
+    daemon = StagingDaemon(str(failing_cfg), str(tmpdir.join('sock')),
+                           str(pool_dir), port_sets=0, virtualenvs=0)
+    assert daemon._build_virtualenv() is None
+    assert pool_dir.listdir() == []
@@ -0,0 +1,106 @@
+import os
+import subprocess
+import time
+
+import pytest
+import sh
+
+import lib.deadline as deadline
+from lib.capture import OutputCapture
+from lib.config import Config
+from lib.logger import context
+from lib.pipeline import Pipeline, PipelineError
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    deadline.reset()
+    yield
+    deadline.reset()
+
+
+def _timeouts(**timeouts):
+    config = Config()
+    config.add_section('common')
+    for kind, seconds in timeouts.items():
+        config.set('common', 'timeout_{0}'.format(kind), str(seconds))
+    return context(timeouts=deadline.timeouts(config))
+
+
+def test_timeout():
+    assert deadline.timeout('pip') == deadline.TIMEOUTS['pip']
+    with _timeouts(pip=0, ssh=10):
+        assert deadline.timeout('pip') is None
+        assert deadline.timeout('ssh') == 10
+        # another environment has its own timeouts
+        with _timeouts(clone=60):
+            assert deadline.timeout('ssh') == deadline.TIMEOUTS['ssh']
+            assert deadline.timeout('clone') == 60
+        # capped by the deadline
+        deadline.set_deadline(5)
+        assert 4 < deadline.timeout('ssh') <= 5
+        assert 4 < deadline.timeout('pip') <= 5
+
+
+def test_deadline_cancels():
+    deadline.set_deadline(0.1)
+    assert deadline.cancelled() is None
+    time.sleep(0.2)
+    assert deadline.cancelled() == 'deadline exceeded'
+    with pytest.raises(deadline.CancelledError):
+        deadline.timeout('clone')
+
+
+def test_watch_kills_the_process_tree():
+    # the grandchild keeps stdout open: killing the shell is not enough
+    process = subprocess.Popen(('sh', '-c', 'sleep 30 & sleep 30; wait'),
+                               stdout=subprocess.PIPE)
+    start = time.time()
+    with _timeouts(command=1), pytest.raises(deadline.CommandTimeoutError):
+        OutputCapture('sleep').feed_process(process, 'command')
+    assert time.time() - start < 10
+    assert deadline.descendants(process.pid) == []
+
+
+def test_cancel_terminates_watched_children():
+    process = subprocess.Popen(('sleep', '30'))
+    # not watched, e.g. lib.teardown.remove_in_background
+    detached = subprocess.Popen(('sleep', '30'), preexec_fn=os.setsid)
+    try:
+        with pytest.raises(deadline.CancelledError):
+            with deadline.watch(process, 'command'):
+                deadline.cancel('test')
+                process.wait()
+        assert process.returncode < 0
+        assert deadline.cancelled() == 'test'
+        assert detached.poll() is None
+    finally:
+        detached.kill()
+        detached.wait()
+
+
+def test_pipeline_cancelled():
+    executed = []
+    pipeline = Pipeline()
+    pipeline.add('repos', lambda: deadline.cancel('interrupted'))
+    pipeline.add('patch', lambda: executed.append('patch'),
+                 requires=('repos',))
+    with pytest.raises(PipelineError) as error:
+        pipeline.run()
+    assert 'cancelled: interrupted' in str(error.value)
+    assert executed == []
+
+
+def test_sh_command_terminated(tmpdir):
+    terminated = tmpdir.join('terminated')
+    script = 'trap "touch {0}; exit 1" TERM; sleep 30 & wait'.format(
+        terminated)
+    start = time.time()
+    with _timeouts(command=1), pytest.raises(deadline.CommandTimeoutError):
+        for line in deadline.command_lines('command', sh.sh, '-c', script):
+            pass
+    assert time.time() - start < 10
+    # SIGTERM first: the command can clean up
+    assert terminated.check()
+    output = deadline.run_command('command', sh.sh, '-c', 'echo done')
+    assert str(output).strip() == 'done'
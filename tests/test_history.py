@@ -0,0 +1,69 @@
+from lib.history import TimingHistory, median
+from lib.pipeline import Pipeline
+
+
+def test_median():
+    assert median([]) is None
+    assert median([3, 1, 2]) == 2
+    assert median([4, 1, 2, 3]) == 2.5
+
+
+def test_baseline_and_regressions(tmpdir):
+    path = str(tmpdir.join('history.db'))
+    for seconds in (100, 110, 90, 105):
+        history = TimingHistory(path, 'staging-beta33', host='devmaster')
+        history.record([('pipeline', 'patch', None, seconds),
+                        ('repository', 'hg clone', 'tools', 20)])
+    history = TimingHistory(path, 'staging-beta33', host='devmaster')
+    assert history.baseline('pipeline', 'patch') == 102.5
+    assert history.baseline('repository', 'hg clone', 'tools') == 20
+    # other configurations have their own history
+    other = TimingHistory(path, 'staging-esr31', host='devmaster')
+    assert other.baseline('pipeline', 'patch') is None
+    timings = [('pipeline', 'patch', None, 200),
+               ('repository', 'hg clone', 'tools', 24)]
+    history.record(timings)
+    slow = history.regressions(timings, threshold=0.5)
+    assert slow == [('pipeline', 'patch', None, 200, 102.5)]
+
+
+def test_estimate(tmpdir):
+    path = str(tmpdir.join('history.db'))
+    for seconds in (100, 110, 90, 105, 10):
+        history = TimingHistory(path, 'staging-beta33', host='devmaster')
+        history.record([('pipeline', 'patch', None, seconds),
+                        ('pipeline', 'tag', None, 5)])
+    history = TimingHistory(path, 'staging-beta33', host='devmaster')
+    history.record([('pipeline', 'rare', None, 1)])
+    assert history.baselines('pipeline', runs=4) == {'patch': 97.5,
+                                                       'tag': 5}
+    estimate = history.estimate('pipeline')
+    assert estimate('patch') == history.baseline('pipeline', 'patch') == 100
+    assert estimate('rare') is None
+
+
+def test_eta():
+    expected = {'a': 10, 'b': 20, 'c': 5}
+    pipeline = Pipeline(estimate=expected.get)
+    pipeline.add('a', lambda: None)
+    pipeline.add('b', lambda: None, requires=('a',))
+    pipeline.add('c', lambda: None)
+    assert pipeline.eta(now=0) == 30
+    pipeline.step('a').start, pipeline.step('a').end = 0, 12
+    assert pipeline.eta(now=12) == 20
+    pipeline.step('b').start = 12
+    assert pipeline.eta(now=17) == 15
+    assert Pipeline().eta() is None
+
+
+def test_record_spans(tmpdir):
+    history = TimingHistory(str(tmpdir.join('history.db')), 'staging-beta33',
+                            host='devmaster')
+    events = [{'ph': 'M', 'name': 'thread_name'},
+              {'ph': 'X', 'cat': 'pipeline', 'name': 'patch',
+               'dur': 100000000, 'args': {}},
+              {'ph': 'X', 'cat': 'repository', 'name': 'hg clone',
+               'dur': 2000000,
+               'args': {'repo': 'tools', 'error': 'cancelled'}}]
+    assert history.record_spans(events) == [('pipeline', 'patch', None,
+                                             100.0)]
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+from lib.lazy import lazy_import
+from lib.microbench import REPO_DIR, over_budget
+
+# imported when they are needed, not when the library is
+LAZY = ('sh', 'logging.config', 'urllib2', 'uuid')
+
+
+def _imported(module):
+    code = 'import sys, {0}; print(" ".join(sys.modules))'.format(module)
+    output = subprocess.check_output((sys.executable, '-c', code),
+                                     cwd=REPO_DIR)
+    return set(output.split())
+
+
+def test_lazy_modules_are_not_imported():
+    for module in ('lib.staging', 'lib.daemon', 'lib.teardown'):
+        imported = _imported(module)
+        assert [name for name in LAZY if name in imported] == []
+
+
+def test_lazy_import():
+    module = lazy_import('colorsys')
+    assert 'colorsys' in repr(module)
+    assert module.rgb_to_hsv(0, 0, 0) == (0, 0, 0)
+
+
+def test_over_budget():
+    times = {'lib.config': 10.0, 'lib.staging': 90.0, 'lib.other': 1000.0}
+    budget = {'lib.config': 20, 'lib.staging': 60}
+    assert over_budget(times, budget) == [('lib.staging', 90.0, 60)]
@@ -0,0 +1,34 @@
+import os
+from lib.journal import Journal
+
+
+def test_journal_resume(tmpdir):
+    path = os.path.join(str(tmpdir), 'journal')
+    executed = []
+    journal = Journal(path)
+    journal.run('tools:created', lambda: executed.append('created'))
+    # a run killed while writing an entry
+    with open(path, 'a') as corrupted:
+        corrupted.write('{"step": "too')
+
+    journal = Journal(path, resume=True)
+    assert journal.is_completed('tools:created')
+    assert not journal.run('tools:created',
+                           lambda: executed.append('created'))
+    # failed verification: run it again
+    assert journal.run('tools:created', lambda: executed.append('created'),
+                       verify=lambda: False)
+    assert executed == ['created', 'created']
+
+    # without resume, a new journal is started
+    journal = Journal(path)
+    assert not journal.is_completed('tools:created')
+
+
+def test_journal_after_truncated_entry(tmpdir):
+    path = os.path.join(str(tmpdir), 'journal')
+    with open(path, 'w') as corrupted:
+        corrupted.write('{"step": "too')
+    journal = Journal(path, resume=True)
+    journal.record('tools:pushed')
+    assert Journal(path, resume=True).is_completed('tools:pushed')
@@ -0,0 +1,58 @@
+import httplib
+import socket
+
+import pytest
+
+import lib.locales as locales
+from lib.locales import parse_shipped_locales, ShippedLocale
+
+
+SHIPPED_LOCALES = """ach
+en-US
+it
+
+ja linux win32
+ja-JP-mac osx
+"""
+
+
+def test_parse_shipped_locales():
+    lines = SHIPPED_LOCALES.splitlines(True)
+    entries = list(parse_shipped_locales(lines))
+    assert [entry.locale for entry in entries] == ['ach', 'it', 'ja',
+                                                   'ja-JP-mac']
+    assert entries[2] == ShippedLocale('ja', ['linux', 'win32'])
+    assert str(entries[2]) == 'ja linux win32'
+
+
+def test_parse_shipped_locales_platform():
+    lines = SHIPPED_LOCALES.splitlines(True)
+    osx = [e.locale for e in parse_shipped_locales(lines, platform='osx')]
+    assert osx == ['ach', 'it', 'ja-JP-mac']
+    linux = [e.locale for e in parse_shipped_locales(lines, platform='linux')]
+    assert linux == ['ach', 'it', 'ja']
+
+
+class BrokenResponse(object):
+    """an http response failing after the first line"""
+    def __init__(self, error):
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        yield 'ach\n'
+        raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('error', [socket.timeout('timed out'),
+                                   httplib.IncompleteRead('ja'),
+                                   IOError('reset')])
+def test_read_errors(monkeypatch, error):
+    response = BrokenResponse(error)
+    monkeypatch.setattr(locales, 'open_url', lambda url: response)
+    with pytest.raises(locales.NoLocalesError):
+        locales.get_shipped_locales('http://example.com/shipped-locales')
+    assert response.closed
@@ -0,0 +1,68 @@
+import json
+import logging
+import Queue
+from lib.loghandlers import QueueHandler, QueueListener, JsonLinesHandler, \
+    context, current_context
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, level=logging.DEBUG):
+        logging.Handler.__init__(self, level)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _logger(name, handler):
+    log = logging.getLogger(name)
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.addHandler(handler)
+    return log
+
+
+def test_context():
+    assert current_context() == {}
+    with context(bug='1234'):
+        with context(repo='tools'):
+            assert current_context() == {'bug': '1234', 'repo': 'tools'}
+        assert current_context() == {'bug': '1234'}
+    assert current_context() == {}
+
+
+def test_queue():
+    queue = Queue.Queue(2)
+    debug = ListHandler()
+    info = ListHandler(logging.INFO)
+    listener = QueueListener(queue, [debug, info])
+    listener.start()
+    log = _logger('test_queue', QueueHandler(queue))
+    values = []
+    with context(step='patch'):
+        for i in range(10):
+            values.append(i)
+            # the record must not depend on values changing later
+            log.debug('value: %s', values)
+    log.info('done')
+    listener.stop()
+    assert len(debug.records) == 11
+    assert len(info.records) == 1
+    assert debug.records[0].getMessage() == 'value: [0]'
+    assert debug.records[0].context == {'step': 'patch'}
+    assert info.records[0].context == {}
+
+
+def test_json_lines(tmpdir):
+    path = str(tmpdir.join('debug.jsonl'))
+    handler = JsonLinesHandler(path)
+    log = _logger('test_json_lines', handler)
+    with context(repo='tools', bug='1234'):
+        log.info('cloning %s', 'tools')
+    handler.close()
+    with open(path) as jsonl:
+        document = json.loads(jsonl.readline())
+    assert document['message'] == 'cloning tools'
+    assert document['repo'] == 'tools'
+    assert document['bug'] == '1234'
+    assert document['level'] == 'INFO'
@@ -0,0 +1,38 @@
+import os
+from lib.config import Config
+from lib.manifest import StagingManifest
+
+
+def _config():
+    config = Config()
+    config.add_section('staging_files')
+    config.set('staging_files', 'common_files',
+               '\nmozilla/config.py,\nmozilla/staging_config.py,')
+    config.set('staging_files', 'firefox',
+               '\n${common_files},\nmozilla/release-firefox.py,')
+    config.set('staging_files', 'fennec',
+               '\n${common_files},\nmozilla/release-fennec.py,')
+    config.set('staging_files', 'l10n', 'mozilla/l10n-changesets,')
+    return config
+
+
+def test_manifest():
+    manifest = StagingManifest(_config(), ['firefox', 'fennec', 'firefox'])
+    assert manifest.release_types == ('firefox', 'fennec', 'common_files',
+                                      'l10n')
+    assert manifest.paths == ('mozilla/config.py',
+                              'mozilla/staging_config.py',
+                              'mozilla/release-firefox.py',
+                              'mozilla/release-fennec.py',
+                              'mozilla/l10n-changesets')
+
+
+def test_manifest_existing(tmpdir):
+    checkout = str(tmpdir)
+    os.makedirs(os.path.join(checkout, 'mozilla'))
+    for name in ('config.py', 'release-fennec.py', 'unrelated.py'):
+        open(os.path.join(checkout, 'mozilla', name), 'w').close()
+    manifest = StagingManifest(_config(), ['fennec'])
+    expected = [os.path.join(checkout, 'mozilla', 'config.py'),
+                os.path.join(checkout, 'mozilla', 'release-fennec.py')]
+    assert manifest.existing(checkout) == expected
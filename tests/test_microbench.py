@@ -0,0 +1,47 @@
+from lib.microbench import Case, compare, release_config, run, summary
+
+
+def test_summary():
+    result = summary([3.0, 1.0, 2.0])
+    assert result['min'] == 1.0
+    assert result['median'] == 2.0
+    assert result['max'] == 3.0
+    assert result['stdev'] == 1.0
+
+
+def test_case():
+    calls = []
+    case = Case('append', lambda: calls.append(1), number=10,
+                setup=lambda: calls.append('setup'))
+    result = case.run(warmup=1, repeat=2,
+                      calibration=Case('calibration', lambda: None))
+    assert calls.count('setup') == 3
+    assert calls.count(1) == 30
+    assert result['samples'] == 2
+    assert 'calibration' in result
+
+
+def test_release_config_is_fixed():
+    text = release_config('release.py', lines=100)
+    assert text == release_config('release.py', lines=100)
+    assert "'build/tools'" in text
+
+
+def test_compare():
+    baseline = {'benchmarks': {
+        'tag_name': {'min': 1.0, 'calibration': 1.0},
+        'patch_map': {'min': 1.0, 'calibration': 1.0}}}
+    # same code on a host twice as slow
+    report = {'benchmarks': {
+        'tag_name': {'min': 2.0, 'calibration': 2.0},
+        'patch_map': {'min': 3.0, 'calibration': 2.0},
+        'new': {'min': 1.0}}}
+    rows = compare(baseline, report, threshold=0.25)
+    assert rows == [('patch_map', 1.0, 1.5, 50.0, True),
+                    ('tag_name', 1.0, 1.0, 0.0, False)]
+
+
+def test_run():
+    report = run(['tag_name', 'to_mozilla'], warmup=0, repeat=2)
+    assert sorted(report['benchmarks']) == ['tag_name', 'to_mozilla']
+    assert report['benchmarks']['tag_name']['samples'] == 2
@@ -0,0 +1,49 @@
+import time
+import pytest
+from lib.pipeline import Pipeline, PipelineError
+
+
+def test_pipeline_order():
+    executed = []
+    pipeline = Pipeline()
+    pipeline.add('repos', lambda: executed.append('repos'))
+    pipeline.add('patch', lambda: executed.append('patch'),
+                 requires=('repos',))
+    pipeline.add('master', lambda: executed.append('master'),
+                 requires=('patch',))
+    pipeline.run()
+    assert executed == ['repos', 'patch', 'master']
+    path = [step.name for step in pipeline.critical_path()]
+    assert path == ['repos', 'patch', 'master']
+
+
+def test_pipeline_concurrency():
+    pipeline = Pipeline()
+    pipeline.add('repos', lambda: time.sleep(0.2))
+    pipeline.add('shipit', lambda: time.sleep(0.2))
+    pipeline.add('master', lambda: time.sleep(0.1), requires=('repos',))
+    pipeline.run()
+    assert pipeline.end - pipeline.start < 0.5
+    path = [step.name for step in pipeline.critical_path()]
+    assert path == ['repos', 'master']
+
+
+def test_pipeline_failure():
+    executed = []
+
+    def fail():
+        raise ValueError('boom')
+
+    pipeline = Pipeline()
+    pipeline.add('repos', fail)
+    pipeline.add('patch', lambda: executed.append('patch'),
+                 requires=('repos',))
+    with pytest.raises(PipelineError):
+        pipeline.run()
+    assert executed == []
+
+
+def test_pipeline_unknown_requirement():
+    pipeline = Pipeline()
+    with pytest.raises(PipelineError):
+        pipeline.add('patch', lambda: None, requires=('repos',))
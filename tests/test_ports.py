@@ -2,6 +2,7 @@ import socket
 from lib.ports import in_use
 from lib.ports import used_in_range
 from lib.ports import available_in_range
+from lib.ports import reserve, release, reserved
 
 
 def test_in_use():
@@ -32,3 +33,13 @@ def test_available_in_range():
     avail = available_in_range(port, port + 1)
     sock.close()
     assert port not in avail
+
+
+def test_reserve():
+    assert reserve(1, 2)
+    assert not reserve(2, 3)
+    assert 3 not in reserved()
+    release(1, 2)
+    assert reserve(2, 3)
+    release(2, 3)
+    assert not reserved().intersection((1, 2, 3))
@@ -0,0 +1,54 @@
+import os
+import socket
+import pytest
+from lib.config import Config
+from lib.preflight import Preflight, PreflightError, run_command, \
+    writable_ancestor, REPOSITORY_CHECKS
+
+
+def test_run_command():
+    assert run_command(('echo', 'ok')).strip() == 'ok'
+    with pytest.raises(PreflightError):
+        run_command(('false',))
+    with pytest.raises(PreflightError) as error:
+        run_command(('sleep', '5'), timeout=0.2)
+    assert 'timed out' in str(error.value)
+
+
+def test_writable_ancestor(tmpdir):
+    assert writable_ancestor(os.path.join(str(tmpdir), 'a', 'b', 'c'))
+    read_only = tmpdir.mkdir('read_only')
+    os.chmod(str(read_only), 0o500)
+    try:
+        if os.access(str(read_only), os.W_OK):
+            pytest.skip('running as root')
+        assert not writable_ancestor(os.path.join(str(read_only), 'a'))
+    finally:
+        os.chmod(str(read_only), 0o700)
+
+
+def test_check_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    try:
+        with pytest.raises(PreflightError):
+            Preflight(None).check_port(sock.getsockname()[1])
+    finally:
+        sock.close()
+
+
+def test_repository_checks():
+    config = Config()
+    config.read_from('config/staging-beta33.ini')
+    config.set('common', 'tracking_bug', '1000000')
+    every = [check[0] for check in Preflight(config).checks()]
+    assert [name for name in every if name.startswith('port:')]
+    selected = [check[0] for check in
+                Preflight(config, checks=REPOSITORY_CHECKS).checks()]
+    assert set(selected) < set(every)
+    assert 'binary: hg' in selected
+    assert [name for name in selected if name.startswith('hg: ')]
+    for excluded in ('port:', 'file:', 'git', 'binary: git', 'writable:'):
+        assert not [name for name in selected
+                    if name.startswith(excluded)]
@@ -0,0 +1,60 @@
+import os
+from lib.scanner import scan_tree, walk_files, file_contains, find_in_tree
+
+
+def _write(path, content):
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as out:
+        out.write(content)
+
+
+def _tree(top):
+    top = str(top)
+    _write(os.path.join(top, 'mozilla', 'config.py'),
+           "repo = 'build/tools'\n")
+    _write(os.path.join(top, 'mozilla', 'other.py'),
+           "repo = 'build/tools' # test\n")
+    _write(os.path.join(top, 'mozilla', 'empty.py'), '')
+    _write(os.path.join(top, 'mozilla', 'notes.txt'), 'build/tools\n')
+    _write(os.path.join(top, 'seamonkey', 'config.py'), 'build/tools\n')
+    _write(os.path.join(top, 'mozilla-tests', 'config.py'), 'build/tools\n')
+    return top
+
+
+def test_walk_files(tmpdir):
+    top = _tree(tmpdir)
+    files = sorted(walk_files(top, ('.py',), exclude=('test', 'seamonkey')))
+    names = [os.path.relpath(f, top) for f in files]
+    assert names == [os.path.join('mozilla', 'config.py'),
+                     os.path.join('mozilla', 'empty.py'),
+                     os.path.join('mozilla', 'other.py')]
+
+
+def test_file_contains(tmpdir):
+    top = _tree(tmpdir)
+    other = os.path.join(top, 'mozilla', 'other.py')
+    assert file_contains(other, b'build/')
+    assert not file_contains(other, b'build/', skip_lines_with=b'test')
+    assert not file_contains(os.path.join(top, 'mozilla', 'empty.py'),
+                             b'build/')
+
+
+def test_scan_tree(tmpdir):
+    top = _tree(tmpdir)
+    expected = [os.path.join(top, 'mozilla', 'config.py')]
+    for processes in (1, 2):
+        files = scan_tree(top, b'build/', suffixes=('.py',),
+                          exclude=('test', 'seamonkey'),
+                          skip_lines_with=b'test', processes=processes)
+        assert files == expected
+
+
+def test_find_in_tree(tmpdir):
+    top = _tree(tmpdir)
+    hits = find_in_tree(top, [b'build/', b'build/tools'], suffixes=('.py',),
+                        exclude=('test', 'seamonkey'),
+                        skip_lines_with=b'#', processes=2)
+    assert hits == [(os.path.join(top, 'mozilla', 'config.py'), 1,
+                     b'build/tools', b"repo = 'build/tools'")]
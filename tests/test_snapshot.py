@@ -0,0 +1,44 @@
+import os
+import re
+from lib.snapshot import link_tree, rewrite_tree
+
+
+def test_link_tree(tmpdir):
+    src = str(tmpdir.join('src'))
+    os.makedirs(os.path.join(src, 'bin'))
+    mutable = ('kickoff.db', '.staging_journal', 'shipit.sh',
+               'bin/build-tools-lib.pth')
+    for name in ('bin/python',) + mutable:
+        with open(os.path.join(src, name), 'w') as out:
+            out.write(name)
+    os.symlink('bin', os.path.join(src, 'scripts'))
+    dst = str(tmpdir.join('dst'))
+    link_tree(src, dst)
+    assert os.stat(os.path.join(dst, 'bin/python')).st_nlink == 2
+    # modified in place: copied
+    for name in mutable:
+        assert os.stat(os.path.join(dst, name)).st_nlink == 1
+    assert os.readlink(os.path.join(dst, 'scripts')) == 'bin'
+
+
+def test_rewrite_tree(tmpdir):
+    src = str(tmpdir.join('src'))
+    os.makedirs(src)
+    script = os.path.join(src, 'shipit.sh')
+    with open(script, 'w') as out:
+        out.write('cd /old/root\nkickoff-web.py --port=8914 -x 18914\n')
+    untouched = os.path.join(src, 'kickoff-web.py')
+    with open(untouched, 'w') as out:
+        out.write('/old/root 8914\n')
+    dst = str(tmpdir.join('dst'))
+    link_tree(src, dst)
+    replacements = [(re.compile(b'/old/root'), b'/new/root'),
+                    (re.compile(br'(?<![\w])8914(?![\w])'), b'8001')]
+    rewritten = rewrite_tree(dst, replacements)
+    assert rewritten == [os.path.join(dst, 'shipit.sh')]
+    with open(os.path.join(dst, 'shipit.sh')) as result:
+        assert result.read() == \
+            'cd /new/root\nkickoff-web.py --port=8001 -x 18914\n'
+    # the snapshot is not modified
+    with open(script) as original:
+        assert original.read().startswith('cd /old/root')
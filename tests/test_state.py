@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+
+from lib.config import Config
+from lib.journal import Journal
+from lib.state import ProvisioningState, fingerprint
+from lib.venv import Virtualenv, VirtualenvError
+
+
+def test_fingerprint():
+    assert fingerprint({'a': 1, 'b': 2}) == fingerprint({'b': 2, 'a': 1})
+    assert fingerprint(['a']) != fingerprint(['b'])
+
+
+def test_state_run(tmpdir):
+    path = os.path.join(str(tmpdir), 'state.json')
+    executed = []
+    state = ProvisioningState(path)
+    assert state.run('clone', ['rev1'], lambda: executed.append('clone'))
+    assert state.run('ini', ['x'], lambda: executed.append('ini'),
+                     requires=('clone',))
+    assert executed == ['clone', 'ini']
+
+    # same inputs, a new run skips everything
+    state = ProvisioningState(path)
+    assert not state.run('clone', ['rev1'], lambda: executed.append('clone'))
+    assert not state.run('ini', ['x'], lambda: executed.append('ini'),
+                         requires=('clone',))
+    assert executed == ['clone', 'ini']
+
+    # a change in clone re-runs ini too
+    assert state.run('clone', ['rev2'], lambda: executed.append('clone'))
+    assert state.run('ini', ['x'], lambda: executed.append('ini'),
+                     requires=('clone',))
+    assert executed == ['clone', 'ini', 'clone', 'ini']
+
+
+def test_state_failure(tmpdir):
+    path = os.path.join(str(tmpdir), 'state.json')
+    state = ProvisioningState(path)
+
+    def fail():
+        raise ValueError('boom')
+
+    try:
+        state.run('clone', ['rev1'], fail)
+    except ValueError:
+        pass
+    assert not state.has('clone')
+
+
+def test_state_failing_command(tmpdir):
+    config = Config()
+    config.add_section('virtualenv')
+    config.set('virtualenv', 'binaries', 'virtualenv')
+    config.set('virtualenv', 'virtualenv', 'virtualenv')
+    config.set('virtualenv', 'python_path', sys.executable)
+    venv = Virtualenv(config)
+    venv.attach(str(tmpdir))
+    setup_py = tmpdir.join('setup.py')
+    setup_py.write('import sys\nsys.exit(1)\n')
+
+    def install():
+        venv.setup_py(str(setup_py), ['install'])
+
+    path = os.path.join(str(tmpdir), 'state.json')
+    state = ProvisioningState(path)
+    with pytest.raises(VirtualenvError):
+        state.run('master:buildbot', ['x'], install)
+    assert not state.has('master:buildbot')
+    assert not ProvisioningState(path).has('master:buildbot')
+    journal = Journal(os.path.join(str(tmpdir), 'journal'))
+    with pytest.raises(VirtualenvError):
+        journal.run('master:buildbot', install)
+    assert not journal.is_completed('master:buildbot')
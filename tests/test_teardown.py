@@ -0,0 +1,61 @@
+import os
+import time
+
+import pytest
+
+from lib.config import Config
+from lib.repositories import Repositories
+from lib.teardown import Teardown, TeardownError, remove_in_background
+
+
+def test_remove_in_background(tmpdir):
+    tree = os.path.join(str(tmpdir), 'master')
+    os.makedirs(os.path.join(tree, 'buildbot-configs'))
+    trash = remove_in_background(tree)
+    # the original path is available right away
+    assert not os.path.exists(tree)
+    for attempt in range(50):
+        if not os.path.exists(trash):
+            break
+        time.sleep(0.1)
+    assert not os.path.exists(trash)
+
+
+def test_check_path(tmpdir):
+    root = tmpdir.join('root')
+    root.join('master').ensure(dir=True)
+    tmpdir.join('elsewhere').ensure(dir=True)
+    config = Config()
+    config.add_section('common')
+    config.set('common', 'root', str(root))
+    teardown = Teardown(config)
+    teardown._check_path(str(root.join('master')))
+    for path in (str(root),
+                 str(tmpdir.join('elsewhere')),
+                 str(root.join('..', 'elsewhere')),
+                 str(root.join('master', '..', '..', 'elsewhere')),
+                 str(root) + '-other'):
+        with pytest.raises(TeardownError):
+            teardown._check_path(path)
+    # a link inside root to a tree outside of it
+    os.symlink(str(tmpdir.join('elsewhere')), str(root.join('link')))
+    with pytest.raises(TeardownError):
+        teardown._check_path(str(root.join('link')))
+
+
+def test_delete_all_repos(benchmark):
+    benchmark = benchmark('local')
+    config = benchmark.configuration()
+    names = config.options('repositories')
+    user_repos = [os.path.join(benchmark.user_dir,
+                               config.get(name, 'dst_repo_name'))
+                  for name in names]
+    for path in user_repos[1:]:
+        os.makedirs(path)
+    results = Repositories(config).delete_all_repos(max_in_flight=4)
+    assert sorted(name for name, seconds, error in results) == sorted(names)
+    # a missing repository is not an error
+    assert [error for name, seconds, error in results] == \
+        [None] * len(names)
+    for path in user_repos:
+        assert not os.path.exists(path)
@@ -0,0 +1,74 @@
+import json
+import subprocess
+import pytest
+import lib.trace as trace
+from lib.logger import context
+
+
+class Repo(object):
+    name = 'tools'
+
+    @trace.traced('hg clone', 'repository', repo='name')
+    def clone(self):
+        subprocess.call(('true',))
+
+
+def test_disabled():
+    trace.disable()
+    with trace.span('nothing'):
+        pass
+    assert trace.events() == []
+
+
+def test_spans(tmpdir):
+    trace.enable()
+    try:
+        with trace.span('pipeline', 'pipeline'):
+            Repo().clone()
+        with pytest.raises(ValueError):
+            with trace.span('fails'):
+                raise ValueError('bad')
+    finally:
+        trace.disable()
+    path = str(tmpdir.join('trace.json'))
+    trace.save(path)
+    with open(path) as trace_file:
+        events = json.load(trace_file)['traceEvents']
+    spans = dict((event['name'], event) for event in events
+                 if event['ph'] == 'X')
+    assert sorted(spans) == ['fails', 'hg clone', 'pipeline']
+    clone = spans['hg clone']
+    assert clone['args']['repo'] == 'tools'
+    assert 'children_cpu_s' in clone['args']
+    assert clone['ts'] >= spans['pipeline']['ts']
+    assert clone['dur'] <= spans['pipeline']['dur']
+    assert spans['fails']['args']['error'] == 'bad'
+    assert [event for event in events if event['ph'] == 'M']
+
+
+def test_recording():
+    with trace.recording('run1'):
+        with context(run='run1'):
+            with trace.span('clone'):
+                pass
+        with context(run='run2'):
+            with trace.span('other run'):
+                pass
+        assert [event['name'] for event in trace.events('run1')] == \
+            ['clone']
+    # the spans of the run are dropped and recording stops
+    assert trace.events('run1') == []
+    with trace.span('after'):
+        pass
+    assert [event['name'] for event in trace.events()
+            if event['ph'] == 'X'] == ['other run']
+    # spans are kept when tracing was enabled
+    trace.enable()
+    try:
+        with trace.recording('run3'), context(run='run3'):
+            with trace.span('kept'):
+                pass
+        assert [event['name'] for event in trace.events('run3')] == \
+            ['kept']
+    finally:
+        trace.disable()
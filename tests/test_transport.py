@@ -0,0 +1,76 @@
+import os
+import subprocess
+
+import pytest
+
+from lib.benchmark import make_repo
+from lib.config import ConfigError
+from lib.repositories import Repository
+from lib.transport import (LocalTransport, SshTransport, TransportError,
+                           transport_for)
+
+
+def test_transport_for(benchmark):
+    benchmark = benchmark('local')
+    config = benchmark.configuration()
+    transport = transport_for(config)
+    assert isinstance(transport, LocalTransport)
+    assert transport.user_dir == benchmark.user_dir
+    config.set('common', 'transport', 'ssh')
+    assert isinstance(transport_for(config), SshTransport)
+    config.set('common', 'transport', 'ftp')
+    with pytest.raises(ConfigError):
+        transport_for(config)
+
+
+def test_local_delete_missing(tmpdir):
+    transport = LocalTransport(str(tmpdir.join('root')),
+                               str(tmpdir.join('users')))
+    assert transport.remote_delete('tools-1') is False
+    with pytest.raises(TransportError):
+        transport.remote_clone('tools-1', 'build/tools')
+
+
+@pytest.mark.hg
+def test_local_transport(tmpdir):
+    root = str(tmpdir.join('root'))
+    users = str(tmpdir.join('users'))
+    make_repo(os.path.join(root, 'build', 'tools'), files=2, file_kb=1,
+              commits=1)
+    transport = LocalTransport(root, users)
+    transport.remote_clone('tools-1', 'build/tools')
+    user_repo = os.path.join(users, 'tools-1')
+    revision = transport.remote_revision(user_repo)
+    assert revision == transport.remote_revision(
+        os.path.join(root, 'build', 'tools'))
+    with pytest.raises(TransportError):
+        transport.remote_clone('tools-1', 'build/tools')
+    checkout = str(tmpdir.join('checkout'))
+    transport.local_clone(user_repo, checkout)
+    with open(os.path.join(checkout, 'CHANGES'), 'a') as changes:
+        changes.write('staging\n')
+    subprocess.check_call(('hg', 'commit', '-u', 'test', '-m', 'staging'),
+                          cwd=checkout)
+    transport.push(checkout)
+    assert transport.remote_revision(user_repo) != revision
+    assert transport.remote_delete('tools-1') is True
+    assert not os.path.exists(user_repo)
+
+
+@pytest.mark.hg
+def test_repository_with_local_transport(benchmark):
+    benchmark = benchmark('local')
+    config = benchmark.configuration()
+    make_repo(os.path.join(benchmark.root, 'build', 'tools'), files=2,
+              file_kb=1, commits=1)
+    repo = Repository(config, 'tools')
+    assert not repo.exists_remotely()
+    repo.recreate_user_repo()
+    assert repo.exists_remotely()
+    assert not repo.has_tag()
+    repo.tag_user_repo()
+    assert repo.has_tag()
+    # a second run deletes the previous user repository
+    repo.recreate_user_repo()
+    repo.delete_user_repo()
+    assert not repo.exists_remotely()
@@ -0,0 +1,17 @@
+import os
+from lib.workingcopy import WorkingCopy
+
+
+def test_working_copy(tmpdir):
+    basedir = os.path.join(str(tmpdir), 'working_copies')
+    working_copy = WorkingCopy(basedir, 'tools', 'default')
+    assert working_copy.path == os.path.join(basedir, 'tools-default')
+    assert not working_copy.exists()
+    working_copy.acquire()
+    assert os.path.exists(working_copy.lock_path)
+    os.makedirs(os.path.join(working_copy.path, '.hg'))
+    assert working_copy.exists()
+    working_copy.release()
+    # the lock can be taken again
+    working_copy.acquire()
+    working_copy.release()